@@ -0,0 +1,56 @@
+"""Import-time benchmark for the library entry point.
+
+Each sample runs a fresh interpreter, so results include the full cost of
+`from claw_codex import ClawCodexClient`. Pass --max-ms to turn the script into
+a regression gate (non-zero exit when the median exceeds the budget).
+
+    python benchmarks/bench_import.py
+    python benchmarks/bench_import.py --max-ms 250
+"""
+
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+
+TARGETS = {
+    "library": "from claw_codex import ClawCodexClient",
+    "server": "from claw_codex.app import app",
+}
+
+_TIMER = "import time; t = time.perf_counter(); {stmt}; print(time.perf_counter() - t)"
+
+
+def _sample(stmt: str) -> float:
+    out = subprocess.run(
+        [sys.executable, "-c", _TIMER.format(stmt=stmt)],
+        check=True,
+        capture_output=True,
+        text=True,
+    )
+    return float(out.stdout.strip()) * 1000
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=15)
+    parser.add_argument("--max-ms", type=float, default=None, help="Fail if the library import median exceeds this")
+    args = parser.parse_args()
+
+    results = {}
+    for name, stmt in TARGETS.items():
+        samples = [_sample(stmt) for _ in range(args.runs)]
+        results[name] = {
+            "median_ms": round(statistics.median(samples), 2),
+            "min_ms": round(min(samples), 2),
+        }
+    print(json.dumps(results, indent=2))
+
+    if args.max_ms is not None and results["library"]["median_ms"] > args.max_ms:
+        print(f"library import median exceeds {args.max_ms} ms", file=sys.stderr)
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
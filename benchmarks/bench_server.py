@@ -0,0 +1,201 @@
+"""Throughput benchmark for `claw-codex serve` in mock mode.
+
+Starts the server as a subprocess (unless --url is given), authenticates with
+mock credentials and drives concurrent chat completions against it for a fixed
+duration. Mock mode keeps the upstream out of the picture, so the numbers
+measure proxy overhead: request parsing, conversion and SSE framing.
+
+    python benchmarks/bench_server.py --workers 1
+    python benchmarks/bench_server.py --workers 4 --loop uvloop --http httptools
+    python benchmarks/bench_server.py --uds      # over a Unix domain socket
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Any, Dict, List, Optional
+
+import httpx
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def _start_server(args: argparse.Namespace, auth_dir: str, port: int, uds: Optional[str] = None) -> subprocess.Popen:
+    env = dict(os.environ)
+    env.update(
+        {
+            "CLAW_CODEX_MOCK": "1",
+            "CLAW_CODEX_AUTH_DIR": auth_dir,
+            "CLAW_CODEX_AUTH_FILE": os.path.join(auth_dir, "auth.json"),
+            "CLAW_CODEX_PKCE_FILE": os.path.join(auth_dir, "pkce.json"),
+        }
+    )
+    cmd = [
+        sys.executable,
+        "-m",
+        "claw_codex",
+        "serve",
+        "--host",
+        "127.0.0.1",
+        "--port",
+        str(port),
+        "--workers",
+        str(args.workers),
+        "--loop",
+        args.loop,
+        "--http",
+        args.http,
+    ]
+    if uds:
+        cmd += ["--uds", uds]
+    return subprocess.Popen(cmd, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+
+async def _wait_ready(client: httpx.AsyncClient, timeout: float = 20.0) -> None:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            resp = await client.get("/v1/models")
+            if resp.status_code == 200:
+                return
+        except httpx.TransportError:
+            pass
+        await asyncio.sleep(0.1)
+    raise RuntimeError("Server did not become ready")
+
+
+async def _one_request(client: httpx.AsyncClient, payload: Dict[str, Any], stream: bool) -> None:
+    if stream:
+        async with client.stream("POST", "/v1/chat/completions", json=payload) as resp:
+            resp.raise_for_status()
+            async for _ in resp.aiter_bytes():
+                pass
+        return
+    resp = await client.post("/v1/chat/completions", json=payload)
+    resp.raise_for_status()
+
+
+async def _worker(
+    client: httpx.AsyncClient,
+    payload: Dict[str, Any],
+    stream: bool,
+    stop_at: float,
+    latencies: List[float],
+    errors: List[str],
+) -> None:
+    while time.monotonic() < stop_at:
+        started = time.perf_counter()
+        try:
+            await _one_request(client, payload, stream)
+        except Exception as exc:
+            errors.append(type(exc).__name__)
+            continue
+        latencies.append(time.perf_counter() - started)
+
+
+def _percentile(values: List[float], pct: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+async def _run_load(args: argparse.Namespace, base_url: str, uds: Optional[str] = None) -> Dict[str, Any]:
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    # A custom transport ignores the client's limits, so they go on the transport.
+    transport = httpx.AsyncHTTPTransport(uds=uds, limits=limits) if uds else None
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=30, transport=transport) as client:
+        await _wait_ready(client)
+        if not args.url:
+            await client.post("/auth/codex/exchange", json={"code": "mock"})
+
+        payload = {
+            "model": "claw/codex",
+            "stream": args.stream,
+            "messages": [
+                {"role": "system", "content": "You are a benchmark."},
+                {"role": "user", "content": "benchmark " * args.prompt_words},
+            ],
+        }
+        # Warm up connections and worker processes before measuring.
+        await asyncio.gather(*[_one_request(client, payload, args.stream) for _ in range(args.concurrency)])
+
+        latencies: List[float] = []
+        errors: List[str] = []
+        started = time.monotonic()
+        stop_at = started + args.duration
+        await asyncio.gather(
+            *[_worker(client, payload, args.stream, stop_at, latencies, errors) for _ in range(args.concurrency)]
+        )
+        elapsed = time.monotonic() - started
+
+    return {
+        "workers": args.workers,
+        "loop": args.loop,
+        "http": args.http,
+        "transport": "uds" if uds else "tcp",
+        "stream": args.stream,
+        "concurrency": args.concurrency,
+        "requests": len(latencies),
+        "errors": len(errors),
+        "requests_per_second": round(len(latencies) / elapsed, 1),
+        "latency_ms": {
+            "mean": round(statistics.fmean(latencies) * 1000, 2) if latencies else 0.0,
+            "p50": round(_percentile(latencies, 50) * 1000, 2),
+            "p99": round(_percentile(latencies, 99) * 1000, 2),
+        },
+    }
+
+
+def _build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--url", default=None, help="Benchmark an already running server instead of starting one")
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--loop", default="auto")
+    parser.add_argument("--http", default="auto")
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--duration", type=float, default=10.0)
+    parser.add_argument("--prompt-words", type=int, default=200)
+    parser.add_argument("--stream", action="store_true", help="Use stream: true")
+    parser.add_argument(
+        "--uds",
+        nargs="?",
+        const="",
+        default=None,
+        help="Connect over a Unix domain socket: the given path with --url, else a temporary one",
+    )
+    return parser
+
+
+def main() -> None:
+    args = _build_parser().parse_args()
+    if args.url:
+        print(json.dumps(asyncio.run(_run_load(args, args.url, args.uds or None)), indent=2))
+        return
+
+    port = _free_port()
+    with tempfile.TemporaryDirectory() as auth_dir:
+        uds = os.path.join(auth_dir, "claw-codex.sock") if args.uds is not None else None
+        server = _start_server(args, auth_dir, port, uds)
+        try:
+            result = asyncio.run(_run_load(args, f"http://127.0.0.1:{port}", uds))
+        finally:
+            server.terminate()
+            server.wait(timeout=15)
+    print(json.dumps(result, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,10 +1,49 @@
-from .app import app
-from .client import AsyncClawCodexClient, AuthStartResult, ClawCodexClient, SUPPORTED_MODELS
+import sys
+from types import ModuleType
+from typing import Any
+
+from .client import AsyncClawCodexClient, AuthStartResult, ClawCodexClient, SUPPORTED_MODELS, server_client
+from .codex import CodexTimeoutError, CodexTimeouts
+from .context import ContextPolicy, estimate_tokens
+from .hooks import CallTrace, ClientHooks
+from .inflight import CompletionCancelled
+from .models import ModelRoute, ModelRouter
 
 __all__ = [
     "app",
     "AsyncClawCodexClient",
     "AuthStartResult",
+    "CallTrace",
     "ClawCodexClient",
+    "ClientHooks",
+    "CodexTimeoutError",
+    "CodexTimeouts",
+    "CompletionCancelled",
+    "ContextPolicy",
+    "ModelRoute",
+    "ModelRouter",
     "SUPPORTED_MODELS",
+    "estimate_tokens",
+    "server_client",
 ]
+
+
+class _Package(ModuleType):
+    # The server pulls in FastAPI, pydantic and starlette; library users only
+    # pay for them when they actually touch the ASGI app. ``app`` is a
+    # property, so it still means the ASGI app once the ``claw_codex.app``
+    # submodule has been imported and bound on the package.
+    @property
+    def app(self) -> Any:
+        from .app import app
+
+        return app
+
+    @app.setter
+    def app(self, value: Any) -> None:
+        # The import system binds the submodule here; it stays in sys.modules.
+        if not isinstance(value, ModuleType):
+            raise AttributeError("claw_codex.app is read-only")
+
+
+sys.modules[__name__].__class__ = _Package
@@ -0,0 +1,87 @@
+import json
+import os
+import random
+from pathlib import Path
+from typing import IO, Any, Dict, List, Optional
+
+from .writebehind import WriteBehind
+
+
+class AccessLog(WriteBehind[Dict[str, Any]]):
+    """Write-behind JSONL access log with size-based rotation and sampling.
+
+    Lines are appended in batches off the request path (see WriteBehind).
+    Successful requests are kept with probability ``sample_rate``; anything
+    else is always kept. ``{pid}`` in the path is replaced by the process id
+    so each server worker writes and rotates its own file.
+    """
+
+    write_errors = (OSError, ValueError)
+    noun = "access log records"
+
+    def __init__(
+        self,
+        path: Path,
+        *,
+        sample_rate: float = 1.0,
+        max_bytes: int = 100 * 1024 * 1024,
+        backups: int = 5,
+        batch_size: int = 500,
+        max_queue: int = 10000,
+    ) -> None:
+        super().__init__(batch_size=batch_size, max_queue=max_queue)
+        self.path = Path(str(path).replace("{pid}", str(os.getpid())))
+        self.sample_rate = sample_rate
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self.sampled_out = 0
+        self.rotations = 0
+        self._file: Optional[IO[str]] = None
+
+    def record(self, entry: Dict[str, Any]) -> None:
+        if self._task is None:
+            return
+        if entry.get("status") == "ok" and self.sample_rate < 1.0 and random.random() >= self.sample_rate:
+            self.sampled_out += 1
+            return
+        super().record(entry)
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "path": str(self.path),
+            "written": self.written,
+            "dropped": self.dropped,
+            "sampled_out": self.sampled_out,
+            "rotations": self.rotations,
+            "queued": self._queue.qsize(),
+        }
+
+    def _open(self) -> None:
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._file = open(self.path, "a", encoding="utf-8")
+
+    def _close(self) -> None:
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def _rotate(self) -> None:
+        assert self._file is not None
+        self._file.close()
+        if self.backups > 0:
+            for index in range(self.backups - 1, 0, -1):
+                older = self.path.with_name(f"{self.path.name}.{index}")
+                if older.exists():
+                    os.replace(older, self.path.with_name(f"{self.path.name}.{index + 1}"))
+            os.replace(self.path, self.path.with_name(f"{self.path.name}.1"))
+        else:
+            self.path.unlink()
+        self._open()
+        self.rotations += 1
+
+    def _write(self, batch: List[Dict[str, Any]]) -> None:
+        assert self._file is not None
+        self._file.write("".join(json.dumps(entry, separators=(",", ":"), default=str) + "\n" for entry in batch))
+        self._file.flush()
+        if self.max_bytes > 0 and self._file.tell() >= self.max_bytes:
+            self._rotate()
@@ -1,13 +1,54 @@
+import asyncio
+import functools
 import json
+import logging
+import math
+import os
 import time
 import uuid
-from typing import Any, Dict, List, Optional
-
-from fastapi import Body, FastAPI, HTTPException, Request
-from fastapi.responses import HTMLResponse, JSONResponse, StreamingResponse
-
-from .codex import build_request_body, collect_codex_response, iter_codex_events
-from .config import DEFAULT_MODEL, MOCK_MODE, ORIGINATOR, REDIRECT_URI, SUCCESS_HTML
+from contextlib import AsyncExitStack, asynccontextmanager
+from contextvars import ContextVar
+from typing import Any, AsyncGenerator, AsyncIterator, Awaitable, Callable, Dict, List, Mapping, Optional, Tuple
+
+import httpx
+from fastapi import APIRouter, Body, Depends, FastAPI, HTTPException, Request, WebSocket, WebSocketDisconnect
+from fastapi.responses import HTMLResponse, JSONResponse, Response, StreamingResponse
+from starlette.datastructures import Headers
+from starlette.requests import HTTPConnection
+
+from .accesslog import AccessLog
+from .breaker import CircuitBreaker, CircuitOpenError
+from .codex import (
+    CodexTimeoutError,
+    CodexTimeouts,
+    CompletedEventSniffer,
+    OutputLimiter,
+    PhaseBudget,
+    _until_aborted,
+    build_request_body,
+    collect_codex_response,
+    estimate_input_tokens,
+    is_upstream_failure,
+    iter_codex_events,
+    limit_output,
+    merge_event_streams,
+    mock_codex_sse,
+    open_codex_stream,
+    parse_usage,
+    reasoning_detail,
+    response_finish_reason,
+    sum_usage,
+)
+from .client import convert_messages, convert_tools
+from .compression import BodyTooLarge, UnsupportedEncoding, json_response, read_body
+from .config import REDIRECT_URI, SUCCESS_HTML, Settings
+from .context import ContextPolicy, fit_messages
+from .inflight import CONNECTING, STREAMING, CompletionCancelled, InFlight, InFlightRegistry
+from .ledger import UsageLedger, UsageRecord, parse_duration, parse_time_bound, query_usage
+from .metrics import Metrics
+from .models import EFFORTS, VERBOSITIES, ModelRouter
+from .profiling import ProfileSession
+from .ratelimit import ApiKeyRegistry, KeyState
 from .oauth import (
     _decode_state,
     build_authorize_url,
@@ -16,511 +57,539 @@ from .oauth import (
     refresh_access_token,
 )
 from .storage import (
+    CredentialCache,
     OAuthCredentials,
     credentials_valid,
-    load_credentials,
     load_pkce,
-    save_credentials,
     save_pkce,
 )
+from .warmup import CODEX_ORIGIN, TOKEN_ORIGIN, ConnectionWarmer, DNSCache, create_pooled_client
 
-app = FastAPI(title="Claw Codex OpenRouter Mock", version="0.2.2")
-
-DEMO_HTML = """<!doctype html>
-<html lang="en">
-<head>
-  <meta charset="utf-8" />
-  <meta name="viewport" content="width=device-width, initial-scale=1" />
-  <title>Claw Codex Demo</title>
-  <style>
-    :root {
-      color-scheme: light;
-      --bg: #edf3f8;
-      --bg-2: #e3edf4;
-      --ink: #172033;
-      --ink-soft: #53617a;
-      --card: #ffffffd9;
-      --border: #ccd8e6;
-      --accent: #0f766e;
-      --accent-2: #14532d;
-      --accent-soft: #e4f3f1;
-      --danger-soft: #fff2f2;
-      --shadow: 0 14px 40px rgba(14, 25, 42, 0.11);
-      --radius: 16px;
-    }
-
-    * {
-      box-sizing: border-box;
-    }
+logger = logging.getLogger(__name__)
 
-    body {
-      margin: 0;
-      font-family: "IBM Plex Sans", "Avenir Next", "Segoe UI", "Helvetica Neue", sans-serif;
-      color: var(--ink);
-      background:
-        radial-gradient(1200px 700px at 90% -10%, #c9e7f7 0%, transparent 60%),
-        radial-gradient(1000px 650px at -20% 100%, #d4ebdd 0%, transparent 58%),
-        linear-gradient(170deg, var(--bg), var(--bg-2));
-      min-height: 100vh;
-    }
+router = APIRouter()
 
-    header {
-      position: relative;
-      overflow: hidden;
-      background: linear-gradient(128deg, #0b1735, #0d2740 55%, #124858);
-      color: #f8fbff;
-      padding: 34px 22px;
-      border-bottom: 1px solid rgba(255, 255, 255, 0.1);
-    }
 
-    header::after {
-      content: "";
-      position: absolute;
-      inset: 0;
-      background:
-        radial-gradient(420px 140px at 12% -8%, rgba(255, 255, 255, 0.14), transparent 68%),
-        radial-gradient(340px 170px at 88% 6%, rgba(140, 217, 198, 0.26), transparent 72%);
-      pointer-events: none;
-    }
+class ServerState:
+    """Resources owned by one app instance: settings, HTTP pool, credentials and limits."""
 
-    .hero {
-      max-width: 1080px;
-      margin: 0 auto;
-      position: relative;
-      z-index: 1;
-    }
-
-    .eyebrow {
-      margin: 0;
-      font-size: 12px;
-      letter-spacing: 0.14em;
-      text-transform: uppercase;
-      opacity: 0.82;
-      font-weight: 700;
-    }
-
-    h1 {
-      margin: 6px 0 4px;
-      font-size: clamp(28px, 3.6vw, 38px);
-      font-family: "Fraunces", "Iowan Old Style", "Times New Roman", serif;
-      font-weight: 700;
-      letter-spacing: -0.02em;
-    }
+    def __init__(self, settings: Settings) -> None:
+        self.settings = settings
+        self.metrics = Metrics()
+        self.credentials = CredentialCache(
+            settings.auth_file,
+            refresh=_mock_refresh if settings.mock_mode else self._refresh_grant,
+        )
+        # Opened by the lifespan; None means requests fall back to one-off clients.
+        self.http: Optional[httpx.AsyncClient] = None
+        self.ledger: Optional[UsageLedger] = None
+        self.access_log: Optional[AccessLog] = None
+        self.warmer: Optional[ConnectionWarmer] = None
+        self.inflight = InFlightRegistry()
+        self.profile: Optional[ProfileSession] = None
+        # None leaves /v1/* open, as before API keys existed.
+        self.api_keys = ApiKeyRegistry(settings.api_keys_file) if settings.api_keys_file else None
+        self.models = ModelRouter(settings.models_file)
+        self.breaker = CircuitBreaker(
+            window_seconds=settings.breaker_window_seconds,
+            min_calls=settings.breaker_min_calls,
+            failure_ratio=settings.breaker_failure_ratio,
+            slow_call_seconds=settings.breaker_slow_call_seconds,
+            open_seconds=settings.breaker_open_seconds,
+            half_open_probes=settings.breaker_half_open_probes,
+        )
+        self.timeouts = CodexTimeouts(
+            connect=settings.connect_timeout or None,
+            first_event=settings.first_event_timeout or None,
+            idle=settings.idle_timeout or None,
+            total=settings.total_timeout or None,
+        )
+        # None leaves histories untouched; otherwise they are trimmed to the input budget.
+        self.context_policy = (
+            ContextPolicy(
+                max_input_tokens=settings.max_input_tokens,
+                strategies=settings.context_strategies,
+                keep_turns=settings.context_keep_turns,
+                max_tool_output_tokens=settings.context_max_tool_output_tokens,
+            )
+            if settings.max_input_tokens > 0
+            else None
+        )
+        limit = settings.max_concurrent_completions
+        self._slots = asyncio.Semaphore(limit) if limit > 0 else None
+        self.slots_in_use = 0
+        # Set on shutdown: new completions are refused and /readyz fails while running ones finish.
+        self.draining = False
+
+    def begin_drain(self) -> None:
+        if not self.draining:
+            self.draining = True
+            self.metrics.inc("drains")
+
+    def drained(self, deadline: Optional[float] = None) -> bool:
+        """Whether shutdown can proceed; past ``deadline`` the completions still running are aborted."""
+        if not len(self.inflight):
+            return True
+        if deadline is None or time.monotonic() < deadline:
+            return False
+        remaining = list(self.inflight)
+        for entry in remaining:
+            entry.abort.set()
+        self.metrics.inc("drain_aborted", len(remaining))
+        return True
+
+    async def _refresh_grant(self, creds: OAuthCredentials) -> OAuthCredentials:
+        return await refresh_access_token(creds.refresh, http_client=self.http)
+
+    @asynccontextmanager
+    async def completion_slot(
+        self, deadline: Optional[float] = None, entry: Optional[InFlight] = None
+    ) -> AsyncIterator[None]:
+        """Hold a concurrency slot; waiting gives up at ``deadline`` or when ``entry`` is aborted."""
+        if self._slots is not None:
+            await self._acquire_slot(deadline, entry)
+        if entry is not None:
+            entry.phase = CONNECTING
+            entry.slot_at = time.monotonic()
+        self.slots_in_use += 1
+        try:
+            yield
+        finally:
+            self.slots_in_use -= 1
+            if self._slots is not None:
+                self._slots.release()
+
+    async def _acquire_slot(self, deadline: Optional[float], entry: Optional[InFlight]) -> None:
+        assert self._slots is not None
+        if (deadline is None and entry is None) or not self._slots.locked():
+            await self._slots.acquire()
+            return
+        waited = time.monotonic()
+        acquire = asyncio.ensure_future(self._slots.acquire())
+        abort_wait = asyncio.ensure_future(entry.abort.wait()) if entry is not None else None
+        cancelled = False
+        try:
+            await asyncio.wait(
+                {acquire} if abort_wait is None else {acquire, abort_wait},
+                timeout=None if deadline is None else max(deadline - waited, 0.0),
+                return_when=asyncio.FIRST_COMPLETED,
+            )
+        except asyncio.CancelledError:
+            cancelled = True
+        if abort_wait is not None:
+            abort_wait.cancel()
+        if not acquire.done():
+            acquire.cancel()
+            await asyncio.wait({acquire})
+        acquired = not acquire.cancelled() and acquire.exception() is None
+        aborted = entry is not None and entry.abort.is_set()
+        if acquired and (cancelled or aborted):
+            self._slots.release()
+        if cancelled:
+            raise asyncio.CancelledError()
+        if aborted:
+            raise CompletionCancelled(entry.id)
+        if not acquired:
+            raise CodexTimeoutError("deadline", time.monotonic() - waited)
+
+
+def _server(request: HTTPConnection) -> ServerState:
+    return request.app.state.claw
+
+
+def _request_deadline(headers: Mapping[str, str], payload: Optional[Dict[str, Any]] = None) -> Optional[float]:
+    """The caller's deadline as a ``time.monotonic()`` instant, or None.
+
+    ``X-Request-Deadline`` is an absolute Unix timestamp in seconds; a
+    ``timeout`` field in the JSON body is relative seconds. The earlier wins.
+    """
+    now = time.monotonic()
+    deadlines: List[float] = []
+    header = headers.get("x-request-deadline")
+    if header:
+        try:
+            stamp = float(header)
+        except ValueError:
+            stamp = math.nan
+        # NaN, infinities and overflowing values would make a deadline that never fires.
+        if not math.isfinite(stamp):
+            raise HTTPException(status_code=400, detail="X-Request-Deadline must be a Unix timestamp in seconds")
+        deadlines.append(now + stamp - time.time())
+    timeout = (payload or {}).get("timeout")
+    if timeout is not None:
+        if isinstance(timeout, bool) or not isinstance(timeout, (int, float)):
+            raise HTTPException(status_code=400, detail="timeout must be a positive number of seconds")
+        try:
+            seconds = float(timeout)
+        except OverflowError:
+            seconds = math.inf
+        if not math.isfinite(seconds) or seconds <= 0:
+            raise HTTPException(status_code=400, detail="timeout must be a positive number of seconds")
+        deadlines.append(now + seconds)
+    if not deadlines:
+        return None
+    deadline = min(deadlines)
+    if deadline <= now:
+        raise HTTPException(status_code=504, detail="Request deadline already passed")
+    return deadline
 
-    .lead {
-      margin: 0;
-      color: rgba(241, 248, 255, 0.92);
-      max-width: 780px;
-      font-size: 15px;
-    }
 
-    main {
-      max-width: 1080px;
-      margin: 0 auto;
-      padding: 26px 16px 34px;
-    }
+def _track_event(entry: InFlight, event: Dict[str, Any]) -> None:
+    entry.phase = STREAMING
+    if event.get("type") == "response.output_text.delta":
+        entry.record_delta()
 
-    .layout {
-      display: grid;
-      grid-template-columns: minmax(0, 1fr);
-      gap: 16px;
-    }
 
-    .card {
-      background: var(--card);
-      backdrop-filter: blur(8px);
-      border: 1px solid var(--border);
-      border-radius: var(--radius);
-      padding: 18px;
-      box-shadow: var(--shadow);
-    }
+def _sse(payload: Dict[str, Any]) -> str:
+    return f"data: {json.dumps(payload)}\n\n"
 
-    h2 {
-      margin: 0 0 10px;
-      font-size: 28px;
-      letter-spacing: -0.02em;
-      font-family: "Fraunces", "Iowan Old Style", "Times New Roman", serif;
-    }
 
-    .status {
-      margin: 0 0 12px;
-      font-size: 14px;
-      color: var(--ink-soft);
-      font-weight: 600;
+def _chat_chunk(
+    completion_id: str,
+    created: int,
+    model: Any,
+    delta: Dict[str, Any],
+    finish_reason: Optional[str] = None,
+    index: int = 0,
+) -> Dict[str, Any]:
+    return {
+        "id": completion_id,
+        "object": "chat.completion.chunk",
+        "created": created,
+        "model": model,
+        "choices": [{"index": index, "delta": delta, "finish_reason": finish_reason}],
     }
 
-    .row {
-      display: flex;
-      flex-wrap: wrap;
-      gap: 10px;
-      align-items: center;
-    }
 
-    .row.input-row {
-      align-items: stretch;
-    }
+def _choice_count(payload: Dict[str, Any], limit: int) -> int:
+    n = payload.get("n")
+    if n is None:
+        return 1
+    if isinstance(n, bool) or not isinstance(n, int) or not 1 <= n <= limit:
+        raise HTTPException(status_code=400, detail=f"n must be an integer from 1 to {limit}")
+    return n
 
-    .row.input-row input {
-      min-width: 0;
-      flex: 1 1 260px;
-    }
 
-    button {
-      border: 1px solid transparent;
-      border-radius: 11px;
-      padding: 10px 14px;
-      font-size: 13px;
-      font-weight: 700;
-      letter-spacing: 0.01em;
-      background: linear-gradient(180deg, #105850, #0f766e);
-      color: #f7fdfc;
-      cursor: pointer;
-      transition: transform 120ms ease, filter 120ms ease, box-shadow 140ms ease;
-      box-shadow: 0 8px 16px rgba(15, 118, 110, 0.22);
-    }
+async def _gather_choices(calls: List[Awaitable[Any]]) -> List[Any]:
+    """Run one call per choice concurrently; the first failure cancels the others."""
+    if len(calls) == 1:
+        return [await calls[0]]
+    tasks = [asyncio.ensure_future(call) for call in calls]
+    try:
+        return list(await asyncio.gather(*tasks))
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
 
-    button:hover {
-      transform: translateY(-1px);
-      filter: brightness(1.03);
-    }
 
-    button:disabled {
-      cursor: not-allowed;
-      opacity: 0.6;
-      transform: none;
-      box-shadow: none;
-    }
+def _completion_id(request: Request) -> str:
+    """A fresh ``chatcmpl_`` id, or the caller's own from ``X-Claw-Completion-Id`` so it can cancel early."""
+    requested = request.headers.get("x-claw-completion-id")
+    if requested is None:
+        return f"chatcmpl_{uuid.uuid4().hex}"
+    if not requested.startswith("chatcmpl_") or len(requested) > 128 or not requested.isprintable():
+        raise HTTPException(status_code=400, detail="X-Claw-Completion-Id must start with 'chatcmpl_'")
+    return requested
 
-    button.secondary {
-      background: #eef4fa;
-      color: #1e2d45;
-      border-color: #cfdbeb;
-      box-shadow: none;
-    }
 
-    label {
-      display: block;
-      margin: 11px 0 6px;
-      font-size: 13px;
-      font-weight: 700;
-      color: #354562;
-    }
+def _timed_out(server: ServerState, exc: CodexTimeoutError) -> HTTPException:
+    server.metrics.inc("upstream_timeouts")
+    return HTTPException(status_code=504, detail=str(exc))
 
-    input,
-    textarea {
-      width: 100%;
-      padding: 11px 12px;
-      border-radius: 11px;
-      border: 1px solid #c7d6e8;
-      background: #f9fbfd;
-      color: var(--ink);
-      font: inherit;
-      transition: border-color 120ms ease, box-shadow 120ms ease;
-    }
 
-    input:focus,
-    textarea:focus {
-      outline: none;
-      border-color: #4e8fb8;
-      box-shadow: 0 0 0 3px rgba(78, 143, 184, 0.16);
-      background: #ffffff;
-    }
+def _timeout_error(exc: CodexTimeoutError) -> Dict[str, Any]:
+    return {"message": str(exc), "type": "timeout", "code": f"{exc.phase}_timeout"}
 
-    .url-box {
-      border: 1px solid #d2ddeb;
-      border-radius: 11px;
-      background: #f8fbff;
-      padding: 9px 11px;
-      max-height: 92px;
-      overflow: auto;
-    }
 
-    .auth-url {
-      display: block;
-      color: #1f4f8f;
-      text-decoration: none;
-      line-height: 1.3;
-      overflow-wrap: anywhere;
-      word-break: break-word;
-    }
+def _circuit_open(server: ServerState, retry_after: float) -> HTTPException:
+    server.metrics.inc("circuit_rejected")
+    return HTTPException(
+        status_code=503,
+        detail="Codex upstream is unavailable; failing fast while the circuit is open",
+        headers={"Retry-After": str(max(1, math.ceil(retry_after)))},
+    )
 
-    .auth-url:hover {
-      text-decoration: underline;
-    }
 
-    .hint {
-      margin: 8px 0 0;
-      font-size: 12px;
-      color: #5d6c86;
-    }
+@asynccontextmanager
+async def _lifespan(app: FastAPI) -> AsyncIterator[None]:
+    server: ServerState = app.state.claw
+    settings = server.settings
+    dns_cache = DNSCache(settings.dns_cache_seconds) if settings.dns_cache_seconds > 0 else None
+    warm = settings.warm_connections > 0 and not settings.mock_mode
+    server.http = create_pooled_client(
+        httpx.Limits(
+            max_connections=settings.max_connections,
+            max_keepalive_connections=settings.max_keepalive_connections,
+            keepalive_expiry=settings.keepalive_expiry,
+        ),
+        dns_cache=dns_cache,
+    )
+    if warm:
+        server.warmer = ConnectionWarmer(
+            server.http,
+            {CODEX_ORIGIN: settings.warm_connections, TOKEN_ORIGIN: 1},
+            interval=settings.warm_interval_seconds,
+            dns_cache=dns_cache,
+        )
+        server.http.event_hooks = {"request": [server.warmer.mark_active]}
+        # Warming runs in the background so an unreachable upstream never delays startup.
+        server.warmer.start()
+    if settings.usage_db is not None:
+        server.ledger = UsageLedger(settings.usage_db)
+        await server.ledger.start()
+    if settings.access_log is not None:
+        server.access_log = AccessLog(
+            settings.access_log,
+            sample_rate=settings.access_log_sample_rate,
+            max_bytes=settings.access_log_max_bytes,
+            backups=settings.access_log_backups,
+        )
+        await server.access_log.start()
+    try:
+        yield
+    finally:
+        if server.warmer is not None:
+            await server.warmer.close()
+            server.warmer = None
+        client, server.http = server.http, None
+        await client.aclose()
+        if server.ledger is not None:
+            await server.ledger.close()
+        if server.access_log is not None:
+            await server.access_log.close()
+
+
+def create_app(settings: Optional[Settings] = None) -> FastAPI:
+    """Build an independent app instance; settings default to the environment."""
+    app = FastAPI(title="Claw Codex OpenRouter Mock", version="0.2.2", lifespan=_lifespan)
+    app.state.claw = ServerState(settings or Settings.from_env())
+    app.add_middleware(_AccessLogMiddleware, server=app.state.claw)
+    app.include_router(router)
+    return app
+
+
+class _ClosingStreamingResponse(StreamingResponse):
+    """StreamingResponse that always runs ``on_close``, even if the body is never iterated."""
+
+    def __init__(self, content: Any, *, on_close: Callable[[], Awaitable[None]], **kwargs: Any) -> None:
+        super().__init__(content, **kwargs)
+        self._on_close = on_close
+
+    async def __call__(self, scope: Any, receive: Any, send: Any) -> None:
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            await self._on_close()
+
+
+async def _read_raw_body(request: Request) -> bytes:
+    try:
+        return await read_body(request, _server(request).settings.max_request_body_bytes)
+    except BodyTooLarge:
+        raise HTTPException(status_code=413, detail="Request body too large")
+    except UnsupportedEncoding as exc:
+        raise HTTPException(status_code=415, detail=str(exc))
+    except ValueError as exc:
+        raise HTTPException(status_code=400, detail=str(exc))
 
-    .chat-log {
-      min-height: 290px;
-      max-height: 420px;
-      overflow-y: auto;
-      border: 1px solid #d7e1ee;
-      border-radius: 12px;
-      padding: 10px;
-      background: linear-gradient(180deg, #fbfdff, #f4f8fc);
-      display: flex;
-      flex-direction: column;
-      gap: 10px;
-    }
 
-    .msg {
-      max-width: 100%;
-      border-radius: 12px;
-      padding: 9px 11px;
-      border: 1px solid #d7e3f0;
-      background: #ffffff;
-    }
+async def _read_json_payload(request: Request) -> Dict[str, Any]:
+    raw = await _read_raw_body(request)
+    try:
+        payload = json.loads(raw)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Request body must be valid JSON")
+    if not isinstance(payload, dict):
+        raise HTTPException(status_code=400, detail="Request body must be a JSON object")
+    return payload
+
+
+async def _watch_disconnect(request: Request, abort: asyncio.Event) -> None:
+    # The body has already been read, so the next ASGI message is the disconnect.
+    while True:
+        message = await request.receive()
+        if message["type"] == "http.disconnect":
+            abort.set()
+            return
+
+
+def _api_key(request: HTTPConnection) -> Optional[KeyState]:
+    registry = _server(request).api_keys
+    if registry is None:
+        return None
+    scheme, _, token = request.headers.get("authorization", "").partition(" ")
+    key = registry.lookup(token.strip() if scheme.lower() == "bearer" else None)
+    if key is None:
+        raise HTTPException(status_code=401, detail="Invalid or missing API key", headers={"WWW-Authenticate": "Bearer"})
+    return key
 
-    .msg.user {
-      align-self: flex-end;
-      background: var(--accent-soft);
-      border-color: #bce0d7;
-    }
 
-    .msg.assistant {
-      align-self: flex-start;
-    }
+async def _authenticate(request: Request) -> Optional[KeyState]:
+    key = _api_key(request)
+    if key is not None:
+        request.state.api_key = key
+    return key
 
-    .msg.error {
-      background: var(--danger-soft);
-      border-color: #f3c4c4;
-    }
 
-    .msg strong {
-      display: block;
-      font-size: 11px;
-      letter-spacing: 0.08em;
-      text-transform: uppercase;
-      margin-bottom: 4px;
-      color: #63758f;
-    }
+async def _refuse_when_draining(request: Request) -> None:
+    if _server(request).draining:
+        raise HTTPException(
+            status_code=503,
+            detail="Server is shutting down; retry on another instance",
+            headers={"Retry-After": "1", "Connection": "close"},
+        )
 
-    .msg-text {
-      margin: 0;
-      font-family: inherit;
-      line-height: 1.36;
-      white-space: pre-wrap;
-      overflow-wrap: anywhere;
-      word-break: break-word;
-    }
 
-    code {
-      font-family: "IBM Plex Mono", "SFMono-Regular", Menlo, Consolas, monospace;
-      background: #eaf1f8;
-      color: #244066;
-      border-radius: 7px;
-      padding: 2px 6px;
-      font-size: 12px;
-    }
+async def _enforce_rate_limits(request: Request, key: Optional[KeyState] = Depends(_authenticate)) -> None:
+    if key is None:
+        return
+    wait = key.admit()
+    if wait > 0:
+        _server(request).metrics.inc("rate_limited")
+        raise HTTPException(
+            status_code=429,
+            detail=f"Rate limit exceeded for API key {key.name!r}",
+            headers={"Retry-After": str(max(1, math.ceil(wait)))},
+        )
 
-    @media (min-width: 900px) {
-      .layout {
-        grid-template-columns: minmax(320px, 360px) minmax(0, 1fr);
-      }
 
-      .chat-card {
-        min-height: 560px;
-      }
+async def _require_admin(request: Request, key: Optional[KeyState] = Depends(_authenticate)) -> None:
+    if key is not None and not key.admin:
+        raise HTTPException(status_code=403, detail=f"API key {key.name!r} is not an admin key")
+
+
+def _caller(request: HTTPConnection, payload: Optional[Dict[str, Any]] = None) -> Optional[str]:
+    key = getattr(request.state, "api_key", None)
+    if key is not None:
+        return key.name
+    caller = request.headers.get("x-claw-caller")
+    if caller:
+        return caller
+    user = (payload or {}).get("user")
+    return str(user) if user else None
+
+
+# The access log line of the HTTP request being served; completions add their details to it.
+_ACCESS_LINE: ContextVar[Optional[Dict[str, Any]]] = ContextVar("claw_access_line", default=None)
+
+
+class _AccessLogMiddleware:
+    """Writes one access log line per HTTP response, whatever its status.
+
+    Requests rejected before a completion starts (``400``, ``401``, ``429``,
+    ``503`` and so on) get a line with just the request and its status.
+    """
+
+    def __init__(self, app: Any, server: ServerState) -> None:
+        self.app = app
+        self.server = server
+
+    async def __call__(self, scope: Any, receive: Any, send: Any) -> None:
+        access_log = self.server.access_log
+        if scope["type"] != "http" or access_log is None:
+            await self.app(scope, receive, send)
+            return
+        started = time.perf_counter()
+        line: Dict[str, Any] = {"ts": round(time.time(), 3), "method": scope["method"], "path": scope["path"]}
+        # Unhandled exceptions become a 500 outside this middleware.
+        http_status = 500
+
+        async def send_status(message: Dict[str, Any]) -> None:
+            nonlocal http_status
+            if message["type"] == "http.response.start":
+                http_status = message["status"]
+            await send(message)
+
+        token = _ACCESS_LINE.set(line)
+        try:
+            await self.app(scope, receive, send_status)
+        finally:
+            _ACCESS_LINE.reset(token)
+            line["http_status"] = http_status
+            line.setdefault("total_ms", round((time.perf_counter() - started) * 1000, 3))
+            line.setdefault("status", "ok" if http_status < 400 else "error")
+            if "caller" not in line:
+                key = scope.get("state", {}).get("api_key")
+                line["caller"] = key.name if key is not None else Headers(scope=scope).get("x-claw-caller")
+            access_log.record(line)
+
+
+def _access_entry(record: UsageRecord, entry: Optional[InFlight]) -> Dict[str, Any]:
+    """One access log line; phase timings are measured from when the completion was registered."""
+    line: Dict[str, Any] = {
+        "ts": round(record.created_at, 3),
+        "completion_id": record.completion_id,
+        "endpoint": record.endpoint,
+        "caller": record.caller,
+        "model": record.model,
+        "account_id": record.account_id,
+        "status": record.status,
+        "total_ms": record.latency_ms,
+        "prompt_tokens": record.prompt_tokens,
+        "completion_tokens": record.completion_tokens,
+        "total_tokens": record.total_tokens,
     }
+    if entry is not None:
+        line["transport"] = entry.endpoint
+        line["queue_ms"] = round((entry.slot_at - entry.started) * 1000, 3) if entry.slot_at is not None else None
+        line["ttft_ms"] = (
+            round((entry.first_token_at - entry.started) * 1000, 3) if entry.first_token_at is not None else None
+        )
+        line["deltas"] = entry.deltas
+        line["bytes_sent"] = entry.bytes_sent
+    return line
 
-    @media (max-width: 700px) {
-      header {
-        padding: 24px 14px;
-      }
 
-      main {
-        padding: 16px 10px 26px;
-      }
+def _record_usage(server: ServerState, record: UsageRecord, entry: Optional[InFlight] = None) -> None:
+    if server.access_log is not None:
+        line = _ACCESS_LINE.get()
+        if line is None:
+            # WebSocket turns have no HTTP response of their own; each gets its own line.
+            server.access_log.record(_access_entry(record, entry))
+        else:
+            line.update(_access_entry(record, entry))
+    server.metrics.inc("prompt_tokens", record.prompt_tokens)
+    server.metrics.inc("completion_tokens", record.completion_tokens)
+    server.metrics.inc("total_tokens", record.total_tokens)
+    if server.api_keys is not None and record.caller:
+        key = server.api_keys.get(record.caller)
+        if key is not None:
+            key.charge(record.total_tokens)
+    if server.ledger is not None:
+        server.ledger.record(record)
+
+
+def _usage_record(
+    completion_id: str,
+    endpoint: str,
+    model: Optional[str],
+    creds: OAuthCredentials,
+    caller: Optional[str],
+    usage: Dict[str, int],
+    started: float,
+    status: str,
+) -> UsageRecord:
+    return UsageRecord(
+        completion_id=completion_id,
+        endpoint=endpoint,
+        model=model,
+        account_id=creds.account_id,
+        caller=caller,
+        prompt_tokens=usage.get("prompt_tokens", 0),
+        completion_tokens=usage.get("completion_tokens", 0),
+        total_tokens=usage.get("total_tokens", 0),
+        latency_ms=round((time.perf_counter() - started) * 1000, 3),
+        status=status,
+    )
 
-      .card {
-        padding: 14px;
-      }
 
-      .row {
-        flex-direction: column;
-        align-items: stretch;
-      }
+async def _mock_refresh(creds: OAuthCredentials) -> OAuthCredentials:
+    return _mock_credentials()
 
-      button {
-        width: 100%;
-      }
 
-      .chat-log {
-        min-height: 240px;
-      }
-    }
-  </style>
-</head>
-<body>
-  <header>
-    <div class="hero">
-      <p class="eyebrow">Local Codex Proxy</p>
-      <h1>Claw Codex Demo</h1>
-      <p class="lead">Authenticate with Codex OAuth and chat via an OpenRouter-style endpoint.</p>
-    </div>
-  </header>
-  <main>
-    <div class="layout">
-      <section class="card auth-card">
-        <h2>Auth</h2>
-        <p class="status" id="auth-status">Status: unknown</p>
-        <label for="custom-redirect">Custom Redirect URI (optional)</label>
-        <div class="row input-row">
-          <input id="custom-redirect" placeholder="http://localhost:8001/api/settings/codex/callback" />
-        </div>
-        <p class="hint">For testing downstream integration. Leave empty to use default.</p>
-        <div class="row">
-          <button id="start-auth">Start OAuth</button>
-          <button id="check-auth" class="secondary">Check Status</button>
-        </div>
-        <label>Authorize URL</label>
-        <div class="url-box">
-          <a class="auth-url" id="auth-url" href="#" target="_blank" rel="noreferrer">not started</a>
-        </div>
-        <label for="auth-code">Paste redirect URL or code (if callback failed)</label>
-        <div class="row input-row">
-          <input id="auth-code" placeholder="http://localhost:1455/auth/callback?code=...&state=..." />
-          <button id="exchange-auth">Exchange</button>
-        </div>
-        <p class="hint">Tip: paste the full URL including both <code>code</code> and <code>state</code>.</p>
-      </section>
-
-      <section class="card chat-card">
-        <h2>Chat</h2>
-        <div class="chat-log" id="chat-log"></div>
-        <label for="chat-input">Message</label>
-        <textarea id="chat-input" rows="3" placeholder="Ask something..."></textarea>
-        <div class="row">
-          <button id="send-chat">Send</button>
-          <button id="clear-chat" class="secondary">Clear</button>
-        </div>
-        <p class="hint">Model: <code>claw/codex</code></p>
-      </section>
-    </div>
-  </main>
-  <script>
-    const authStatus = document.getElementById('auth-status');
-    const authUrl = document.getElementById('auth-url');
-    const authCodeInput = document.getElementById('auth-code');
-    const customRedirectInput = document.getElementById('custom-redirect');
-    const chatLog = document.getElementById('chat-log');
-    const chatInput = document.getElementById('chat-input');
-    const sendButton = document.getElementById('send-chat');
-
-    const messages = [
-      { role: 'system', content: 'You are a helpful assistant.' }
-    ];
-
-    function appendMessage(role, content) {
-      const wrap = document.createElement('div');
-      const roleLabel = String(role || '').toLowerCase();
-      const msgType = roleLabel === 'user' ? 'user' : (roleLabel === 'error' ? 'error' : 'assistant');
-      wrap.className = 'msg ' + msgType;
-
-      const title = document.createElement('strong');
-      title.textContent = roleLabel || 'assistant';
-      wrap.appendChild(title);
-
-      const text = document.createElement('pre');
-      text.className = 'msg-text';
-      text.textContent = String(content ?? '');
-      wrap.appendChild(text);
-
-      chatLog.appendChild(wrap);
-      chatLog.scrollTop = chatLog.scrollHeight;
-    }
-
-    async function checkStatus() {
-      const res = await fetch('/auth/codex/status');
-      const data = await res.json();
-      authStatus.textContent = data.authenticated ? 'Status: authenticated' : 'Status: not authenticated';
-    }
-
-    document.getElementById('start-auth').addEventListener('click', async () => {
-      const customRedirect = customRedirectInput.value.trim();
-      const body = customRedirect ? JSON.stringify({ redirect_uri: customRedirect }) : '';
-      const res = await fetch('/auth/codex/start', {
-        method: 'POST',
-        headers: customRedirect ? { 'content-type': 'application/json' } : {},
-        body: body || undefined
-      });
-      const data = await res.json();
-      authUrl.textContent = data.authorize_url;
-      authUrl.href = data.authorize_url;
-      window.open(data.authorize_url, '_blank', 'noopener');
-    });
-
-    document.getElementById('check-auth').addEventListener('click', checkStatus);
-
-    document.getElementById('exchange-auth').addEventListener('click', async () => {
-      const code = authCodeInput.value.trim();
-      if (!code) return;
-      const res = await fetch('/auth/codex/exchange', {
-        method: 'POST',
-        headers: { 'content-type': 'application/json' },
-        body: JSON.stringify({ code })
-      });
-      if (res.ok) {
-        authCodeInput.value = '';
-        await checkStatus();
-      } else {
-        let msg = 'Exchange failed';
-        try {
-          const data = await res.json();
-          if (data.detail) msg = data.detail;
-        } catch {}
-        authStatus.textContent = 'Status: ' + msg;
-      }
-    });
-
-    document.getElementById('send-chat').addEventListener('click', async () => {
-      const content = chatInput.value.trim();
-      if (!content) return;
-      chatInput.value = '';
-      messages.push({ role: 'user', content });
-      appendMessage('user', content);
-      sendButton.disabled = true;
-      try {
-        const res = await fetch('/v1/chat/completions', {
-          method: 'POST',
-          headers: { 'content-type': 'application/json' },
-          body: JSON.stringify({ model: 'claw/codex', messages, stream: false })
-        });
-        let data = {};
-        try {
-          data = await res.json();
-        } catch {}
-        if (!res.ok) {
-          const detail = data?.detail ? String(data.detail) : `HTTP ${res.status}`;
-          appendMessage('error', detail);
-          return;
-        }
-        const reply = data?.choices?.[0]?.message?.content || '(no reply)';
-        messages.push({ role: 'assistant', content: reply });
-        appendMessage('assistant', reply);
-      } finally {
-        sendButton.disabled = false;
-      }
-    });
-
-    document.getElementById('clear-chat').addEventListener('click', () => {
-      messages.splice(1);
-      chatLog.innerHTML = '';
-    });
-
-    checkStatus();
-  </script>
-</body>
-</html>
-"""
-
-
-def _ensure_credentials() -> OAuthCredentials:
-    creds = load_credentials()
+def _ensure_credentials(server: ServerState) -> OAuthCredentials:
+    creds = server.credentials.load()
     if not creds:
         raise HTTPException(status_code=401, detail="No Codex OAuth credentials found")
     if not credentials_valid(creds):
@@ -537,96 +606,9 @@ def _mock_credentials() -> OAuthCredentials:
     )
 
 
-def _coerce_text(content: Any) -> str:
-    if content is None:
-        return ""
-    if isinstance(content, str):
-        return content
-    return str(content)
-
-
-def _content_to_parts(content: Any, role: str) -> List[Dict[str, Any]]:
-    text_type = "output_text" if role == "assistant" else "input_text"
-
-    if isinstance(content, list):
-        parts: List[Dict[str, Any]] = []
-        for item in content:
-            if not isinstance(item, dict):
-                continue
-            item_type = str(item.get("type", "")).strip()
-            if item_type in {"text", "input_text", "output_text"}:
-                if role == "assistant":
-                    parts.append(
-                        {
-                            "type": "output_text",
-                            "text": _coerce_text(item.get("text")),
-                            "annotations": item.get("annotations") or [],
-                        }
-                    )
-                else:
-                    parts.append({"type": "input_text", "text": _coerce_text(item.get("text"))})
-            elif role == "assistant" and item_type == "refusal":
-                parts.append({"type": "refusal", "refusal": _coerce_text(item.get("refusal"))})
-        if parts:
-            return parts
-
-    if role == "assistant":
-        return [{"type": "output_text", "text": _coerce_text(content), "annotations": []}]
-    return [{"type": text_type, "text": _coerce_text(content)}]
-
-
-def _convert_messages(messages: List[Dict[str, Any]]) -> Dict[str, Any]:
-    system_parts: List[str] = []
-    input_messages: List[Dict[str, Any]] = []
-
-    for msg in messages:
-        role = msg.get("role")
-        content = msg.get("content")
-        if role == "system":
-            system_parts.append(_coerce_text(content))
-            continue
-        if not role:
-            continue
-        normalized_role = str(role)
-        if normalized_role == "assistant":
-            input_messages.append(
-                {
-                    "type": "message",
-                    "role": "assistant",
-                    "content": _content_to_parts(content, normalized_role),
-                    "status": "completed",
-                    "id": f"msg_{len(input_messages)}",
-                }
-            )
-        else:
-            input_messages.append({"role": normalized_role, "content": _content_to_parts(content, normalized_role)})
-
-    instructions = "\n".join([part for part in system_parts if part]) if system_parts else None
-    return {"instructions": instructions, "input": input_messages}
-
-
-def _convert_tools(tools: Optional[List[Dict[str, Any]]]) -> Optional[List[Dict[str, Any]]]:
-    if not tools:
-        return None
-    converted: List[Dict[str, Any]] = []
-    for tool in tools:
-        if tool.get("type") != "function":
-            continue
-        fn = tool.get("function") or {}
-        converted.append(
-            {
-                "type": "function",
-                "name": fn.get("name"),
-                "description": fn.get("description"),
-                "parameters": fn.get("parameters"),
-            }
-        )
-    return converted or None
-
-
-@app.get("/auth/codex/status")
-async def auth_status() -> JSONResponse:
-    creds = load_credentials()
+@router.get("/auth/codex/status")
+async def auth_status(request: Request) -> JSONResponse:
+    creds = _server(request).credentials.load()
     if not creds:
         return JSONResponse({"authenticated": False})
     return JSONResponse(
@@ -638,20 +620,23 @@ async def auth_status() -> JSONResponse:
     )
 
 
-@app.post("/auth/codex/start")
-async def auth_start(originator: Optional[str] = None, redirect_uri: Optional[str] = None) -> JSONResponse:
-    oauth_state, url = build_authorize_url(originator or ORIGINATOR, redirect_uri=redirect_uri)
-    save_pkce(oauth_state)
+@router.post("/auth/codex/start")
+async def auth_start(
+    request: Request, originator: Optional[str] = None, redirect_uri: Optional[str] = None
+) -> JSONResponse:
+    settings = _server(request).settings
+    oauth_state, url = build_authorize_url(originator or settings.originator, redirect_uri=redirect_uri)
+    save_pkce(oauth_state, path=settings.pkce_file)
     return JSONResponse({"authorize_url": url, "redirect_uri": oauth_state.redirect_uri or REDIRECT_URI, "state": oauth_state.state})
 
 
-async def _handle_auth_callback(code: Optional[str], state: Optional[str]) -> HTMLResponse:
+async def _handle_auth_callback(server: ServerState, code: Optional[str], state: Optional[str]) -> HTMLResponse:
     if not code:
         raise HTTPException(status_code=400, detail="Missing authorization code")
     
     # Decode state to extract original state and actual redirect (Approach B)
     original_state, actual_redirect = _decode_state(state) if state else (state, None)
-    pkce = load_pkce(original_state)
+    pkce = load_pkce(original_state, path=server.settings.pkce_file)
     if not pkce:
         raise HTTPException(
             status_code=400,
@@ -660,37 +645,42 @@ async def _handle_auth_callback(code: Optional[str], state: Optional[str]) -> HT
     try:
         # Use actual redirect from state (if present) or from PKCE storage
         effective_redirect_uri = actual_redirect or pkce.redirect_uri or REDIRECT_URI
-        creds = await exchange_authorization_code(code, pkce.verifier, redirect_uri=effective_redirect_uri)
+        creds = await exchange_authorization_code(
+            code, pkce.verifier, redirect_uri=effective_redirect_uri, http_client=server.http
+        )
     except RuntimeError as exc:
         raise HTTPException(status_code=400, detail=str(exc))
-    save_credentials(creds)
+    server.credentials.save(creds)
     return HTMLResponse(SUCCESS_HTML)
 
 
-@app.get("/auth/callback")
-async def auth_callback_root(code: Optional[str] = None, state: Optional[str] = None) -> HTMLResponse:
-    return await _handle_auth_callback(code, state)
+@router.get("/auth/callback")
+async def auth_callback_root(
+    request: Request, code: Optional[str] = None, state: Optional[str] = None
+) -> HTMLResponse:
+    return await _handle_auth_callback(_server(request), code, state)
 
 
-@app.get("/auth/codex/callback")
-async def auth_callback(code: Optional[str] = None, state: Optional[str] = None) -> HTMLResponse:
-    return await _handle_auth_callback(code, state)
+@router.get("/auth/codex/callback")
+async def auth_callback(request: Request, code: Optional[str] = None, state: Optional[str] = None) -> HTMLResponse:
+    return await _handle_auth_callback(_server(request), code, state)
 
 
-@app.post("/auth/codex/exchange")
-async def auth_exchange(payload: Dict[str, Any] = Body(...)) -> JSONResponse:
+@router.post("/auth/codex/exchange")
+async def auth_exchange(request: Request, payload: Dict[str, Any] = Body(...)) -> JSONResponse:
+    server = _server(request)
     raw = str(payload.get("code", ""))
     code, state = parse_authorization_input(raw)
     if not code:
         raise HTTPException(status_code=400, detail="Missing authorization code")
-    if MOCK_MODE:
+    if server.settings.mock_mode:
         creds = _mock_credentials()
-        save_credentials(creds)
+        server.credentials.save(creds)
         return JSONResponse({"ok": True, "expires": creds.expires, "account_id": creds.account_id})
     
     # Decode state to extract original state and actual redirect (Approach B)
     original_state, actual_redirect = _decode_state(state) if state else (state, None)
-    pkce = load_pkce(original_state)
+    pkce = load_pkce(original_state, path=server.settings.pkce_file)
     if not pkce:
         raise HTTPException(
             status_code=400,
@@ -699,9 +689,11 @@ async def auth_exchange(payload: Dict[str, Any] = Body(...)) -> JSONResponse:
     try:
         # Use actual redirect from state (if present) or from PKCE storage
         effective_redirect_uri = actual_redirect or pkce.redirect_uri or REDIRECT_URI
-        creds = await exchange_authorization_code(code, pkce.verifier, redirect_uri=effective_redirect_uri)
+        creds = await exchange_authorization_code(
+            code, pkce.verifier, redirect_uri=effective_redirect_uri, http_client=server.http
+        )
     except RuntimeError as exc:
-        existing = load_credentials()
+        existing = server.credentials.load()
         if existing and credentials_valid(existing):
             return JSONResponse(
                 {
@@ -712,132 +704,526 @@ async def auth_exchange(payload: Dict[str, Any] = Body(...)) -> JSONResponse:
                 }
             )
         raise HTTPException(status_code=400, detail=str(exc))
-    save_credentials(creds)
+    server.credentials.save(creds)
     return JSONResponse({"ok": True, "expires": creds.expires, "account_id": creds.account_id})
 
 
-@app.post("/auth/codex/refresh")
-async def auth_refresh() -> JSONResponse:
-    creds = load_credentials()
+@router.post("/auth/codex/refresh")
+async def auth_refresh(request: Request) -> JSONResponse:
+    server = _server(request)
+    creds = server.credentials.load()
     if not creds:
         raise HTTPException(status_code=401, detail="No credentials to refresh")
-    if MOCK_MODE:
-        new_creds = _mock_credentials()
-        save_credentials(new_creds)
-        return JSONResponse({"ok": True, "expires": new_creds.expires})
-    new_creds = await refresh_access_token(creds.refresh)
-    save_credentials(new_creds)
+    new_creds = await server.credentials.refresh(stale=creds)
     return JSONResponse({"ok": True, "expires": new_creds.expires})
 
 
-@app.get("/demo")
+@router.get("/demo")
 async def demo() -> HTMLResponse:
+    from .demo import DEMO_HTML
+
     return HTMLResponse(DEMO_HTML)
 
 
-@app.get("/v1/models")
-async def list_models() -> JSONResponse:
+@router.get("/metrics")
+async def metrics(request: Request) -> JSONResponse:
+    server = _server(request)
+    snapshot = server.metrics.snapshot()
+    snapshot["circuit"] = server.breaker.snapshot()
+    if server.access_log is not None:
+        snapshot["access_log"] = server.access_log.snapshot()
+    return JSONResponse(snapshot)
+
+
+@router.get("/status")
+async def status(request: Request) -> JSONResponse:
+    circuit = _server(request).breaker.snapshot()
+    return JSONResponse({"ok": circuit["state"] != "open", "circuit": circuit})
+
+
+@router.get("/healthz")
+async def healthz(request: Request) -> JSONResponse:
+    """Liveness: the process is serving requests, even while it drains."""
+    server = _server(request)
+    return JSONResponse({"ok": True, "draining": server.draining, "in_flight": len(server.inflight)})
+
+
+@router.get("/readyz")
+async def readyz(request: Request) -> JSONResponse:
+    """Readiness: not draining, usable credentials and a circuit that is not open."""
+    server = _server(request)
+    creds = server.credentials.load()
+    if creds is None:
+        credentials = "missing"
+    elif credentials_valid(creds):
+        credentials = "valid"
+    else:
+        credentials = "refreshable" if creds.refresh else "expired"
+    circuit = server.breaker.state()
+    ready = not server.draining and credentials in ("valid", "refreshable") and circuit != "open"
+    return JSONResponse(
+        {
+            "ready": ready,
+            "draining": server.draining,
+            "credentials": credentials,
+            "circuit": circuit,
+            "in_flight": len(server.inflight),
+        },
+        status_code=200 if ready else 503,
+    )
+
+
+@router.get("/admin/streams", dependencies=[Depends(_require_admin)])
+async def admin_streams(request: Request) -> JSONResponse:
+    """Every in-flight completion with its phase and progress, plus queue and slot totals."""
+    server = _server(request)
+    snapshot = server.inflight.snapshot()
+    snapshot["slots"] = {
+        "limit": server.settings.max_concurrent_completions or None,
+        "in_use": server.slots_in_use,
+    }
+    # Each worker process only sees its own completions.
+    snapshot["worker"] = {"pid": os.getpid(), "workers": server.settings.workers}
+    return JSONResponse(snapshot)
+
+
+@router.post("/admin/profile", dependencies=[Depends(_require_admin)])
+async def admin_profile(
+    request: Request,
+    seconds: float = 10.0,
+    interval_ms: float = 5.0,
+    allocations: bool = False,
+    format: str = "json",
+) -> Response:
+    """Profile this worker for ``seconds`` while it keeps serving; ``format=collapsed`` returns CPU stacks as text.
+
+    ``allocations`` adds tracemalloc, which slows the worker noticeably and skews the CPU profile.
+    """
+    server = _server(request)
+    if not server.settings.profiling_enabled:
+        raise HTTPException(status_code=404, detail="Profiling is disabled; set CLAW_CODEX_PROFILING=1")
+    if not 0 < seconds <= 300 or not 0.1 <= interval_ms <= 1000:
+        raise HTTPException(status_code=400, detail="seconds must be in (0, 300] and interval_ms in [0.1, 1000]")
+    if format not in {"json", "collapsed"}:
+        raise HTTPException(status_code=400, detail="format must be json or collapsed")
+    if server.profile is not None:
+        raise HTTPException(status_code=409, detail="A profile is already running")
+    # Started from a handler, so the sampler watches the event loop thread.
+    server.profile = ProfileSession(interval=interval_ms / 1000, allocations=allocations)
+    server.profile.start()
+    try:
+        await asyncio.sleep(seconds)
+    finally:
+        session, server.profile = server.profile, None
+        result = session.stop()
+    if format == "collapsed":
+        return Response(result["cpu_collapsed"], media_type="text/plain")
+    return JSONResponse(result)
+
+
+@router.get("/v1/models", dependencies=[Depends(_authenticate)])
+async def list_models(request: Request) -> JSONResponse:
+    server = _server(request)
     now = int(time.time())
     data = [
         {
-            "id": "claw/codex",
+            "id": route.id,
             "object": "model",
             "created": now,
             "owned_by": "claw",
+            "upstream_model": route.model or server.settings.default_model,
+            "reasoning_effort": route.effort,
+            "verbosity": route.verbosity,
+            "description": route.description,
         }
+        for route in server.models.routes()
     ]
     return JSONResponse({"object": "list", "data": data})
 
 
-@app.post("/v1/chat/completions")
-async def chat_completions(request: Request) -> JSONResponse:
-    payload = await request.json()
+# Builds a fresh OutputLimiter per choice; None when the request sets neither ``stop`` nor a token cap.
+_Limits = Optional[Callable[[], OutputLimiter]]
+
+
+def _output_limits(payload: Dict[str, Any]) -> _Limits:
+    stop = payload.get("stop")
+    if stop is None:
+        stop = []
+    elif isinstance(stop, str):
+        stop = [stop]
+    elif not isinstance(stop, list) or len(stop) > 4 or not all(isinstance(item, str) for item in stop):
+        raise HTTPException(status_code=400, detail="stop must be a string or an array of up to 4 strings")
+    max_tokens = payload.get("max_completion_tokens")
+    if max_tokens is None:
+        max_tokens = payload.get("max_tokens")
+    if max_tokens is not None and (isinstance(max_tokens, bool) or not isinstance(max_tokens, int) or max_tokens < 1):
+        raise HTTPException(status_code=400, detail="max_tokens must be a positive integer")
+    if not any(stop) and max_tokens is None:
+        return None
+    return functools.partial(OutputLimiter, stop, max_tokens)
+
+
+def _chat_body(
+    server: ServerState, payload: Dict[str, Any]
+) -> Tuple[Any, int, Optional[str], Dict[str, Any], Optional[Dict[str, Any]], _Limits]:
+    """Validate a chat completion payload and build its upstream body.
+
+    Returns ``(model, n, session_id, body, context, limits)``; ``context``
+    reports history trimming, or is None when the messages fit the input
+    budget. ``limits`` enforces ``stop`` and ``max_tokens`` client-side, as
+    the Codex backend takes neither.
+    """
+    settings = server.settings
     model = payload.get("model")
-    if model not in {"claw/codex", "claw/codex-responses", "openai-codex"}:
-        raise HTTPException(status_code=400, detail="Unsupported model. Use claw/codex")
+    route = server.models.resolve(model)
+    if route is None:
+        raise HTTPException(status_code=400, detail="Unsupported model. Use claw/codex or see GET /v1/models")
+    # Per-request reasoning_effort and verbosity, as in OpenAI's chat API, override the alias;
+    # null, like a missing field, keeps the alias's value.
+    effort = payload.get("reasoning_effort")
+    if effort is None:
+        effort = route.effort
+    if effort is not None and effort not in EFFORTS:
+        raise HTTPException(status_code=400, detail=f"reasoning_effort must be one of {', '.join(EFFORTS)}")
+    verbosity = payload.get("verbosity")
+    if verbosity is None:
+        verbosity = route.verbosity
+    if verbosity not in VERBOSITIES:
+        raise HTTPException(status_code=400, detail=f"verbosity must be one of {', '.join(VERBOSITIES)}")
 
     messages = payload.get("messages") or []
     if not isinstance(messages, list):
         raise HTTPException(status_code=400, detail="messages must be an array")
+    for index, message in enumerate(messages):
+        if not isinstance(message, dict) or not isinstance(message.get("role"), str):
+            raise HTTPException(status_code=400, detail=f"messages[{index}] must be an object with a string role")
 
-    stream = bool(payload.get("stream"))
-    temperature = payload.get("temperature")
-    tools = _convert_tools(payload.get("tools"))
-    tool_choice = payload.get("tool_choice")
+    n = _choice_count(payload, settings.max_choices)
+    limits = _output_limits(payload)
     session_id = payload.get("session_id")
-
-    converted = _convert_messages(messages)
+    converted = convert_messages(messages, server.context_policy)
+    context = converted["context"]
+    if context is not None:
+        server.metrics.inc("context_trimmed")
+        server.metrics.inc("context_tokens_saved", context["tokens_saved"])
     body = build_request_body(
-        model=DEFAULT_MODEL,
+        model=route.model or settings.default_model,
         instructions=converted["instructions"],
         input_messages=converted["input"],
-        temperature=temperature,
-        tools=tools,
-        tool_choice=tool_choice,
+        temperature=payload.get("temperature"),
+        tools=convert_tools(payload.get("tools")),
+        tool_choice=payload.get("tool_choice"),
         session_id=session_id,
+        reasoning_effort=effort,
+        verbosity=verbosity,
     )
+    return model, n, session_id, body, context, limits
+
+
+async def _chat_chunks(
+    server: ServerState,
+    entry: InFlight,
+    creds: OAuthCredentials,
+    body: Dict[str, Any],
+    *,
+    model: Any,
+    created: int,
+    n: int,
+    session_id: Optional[str],
+    deadline: Optional[float],
+    usages: List[Dict[str, int]],
+    limits: _Limits = None,
+) -> AsyncGenerator[Dict[str, Any], None]:
+    """Chat completion chunks for ``entry``, merged from ``n`` upstream streams.
+
+    Each choice's usage is appended to ``usages`` as it completes. With
+    ``limits``, a choice that hits a stop sequence or its token cap has its
+    upstream stream closed right away.
+    """
+    # The body is built once; each choice is its own upstream stream over the shared pool.
+    streams = [
+        iter_codex_events(
+            creds.access,
+            creds.account_id,
+            body,
+            session_id=session_id,
+            mock_mode=server.settings.mock_mode,
+            abort=entry.abort,
+            http_client=server.http,
+            breaker=server.breaker,
+            timeouts=server.timeouts,
+            deadline=deadline,
+        )
+        for _ in range(n)
+    ]
+    if limits is not None:
+        prompt_tokens = estimate_input_tokens(body)
+        streams = [limit_output(stream, limits(), prompt_tokens) for stream in streams]
+    events = merge_event_streams(streams)
+    sent_role = [False] * n
+    try:
+        async with server.completion_slot(deadline, entry):
+            async for index, event in events:
+                entry.phase = STREAMING
+                event_type = event.get("type")
+                chunk_delta: Optional[Dict[str, Any]] = None
+                if event_type == "response.output_text.delta":
+                    delta = event.get("delta")
+                    if isinstance(delta, str):
+                        entry.record_delta()
+                        chunk_delta = {"content": delta}
+                elif event_type == "response.output_item.done":
+                    detail = reasoning_detail(event)
+                    if detail is not None:
+                        chunk_delta = {"reasoning_details": [detail]}
+                if chunk_delta is not None:
+                    if not sent_role[index]:
+                        yield _chat_chunk(entry.id, created, model, {"role": "assistant"}, index=index)
+                        sent_role[index] = True
+                    yield _chat_chunk(entry.id, created, model, chunk_delta, index=index)
+                elif event_type == "response.completed":
+                    response = event.get("response") or {}
+                    usages.append(parse_usage(response))
+                    yield _chat_chunk(entry.id, created, model, {}, response_finish_reason(response), index=index)
+                elif event_type == "error":
+                    raise RuntimeError("Codex error event")
+                elif event_type == "response.failed":
+                    raise RuntimeError("Codex response failed")
+    finally:
+        await events.aclose()
+
+
+def _assistant_message(text: str, reasoning: List[Dict[str, Any]]) -> Dict[str, Any]:
+    message: Dict[str, Any] = {"role": "assistant", "content": text}
+    if reasoning:
+        # Clients send the message back as-is in the next turn to carry the reasoning over.
+        message["reasoning_details"] = reasoning
+    return message
+
+
+def _stream_options(payload: Dict[str, Any]) -> Tuple[bool, bool]:
+    """``(include_usage, include_timing)`` from a request's ``stream_options``."""
+    options = payload.get("stream_options")
+    if options is None:
+        return False, False
+    if not isinstance(options, dict):
+        raise HTTPException(status_code=400, detail="stream_options must be an object")
+    return bool(options.get("include_usage")), bool(options.get("include_timing"))
+
+
+async def _with_stream_options(
+    chunks: AsyncGenerator[Dict[str, Any], None],
+    entry: InFlight,
+    usages: List[Dict[str, int]],
+    *,
+    model: Any,
+    created: int,
+    include_usage: bool,
+    include_timing: bool,
+) -> AsyncGenerator[Dict[str, Any], None]:
+    """Apply ``stream_options`` to chat chunks, ending with a chunk that has no choices.
+
+    ``include_usage`` (as in OpenAI's API) sets ``usage`` to null on every
+    chunk and to the summed usage on the last one. ``include_timing``, our
+    extension, stamps each chunk with ``timing.upstream_ms`` and puts a
+    summary with TTFT and tokens per second on the last one.
+    """
+    try:
+        async for chunk in chunks:
+            if include_usage:
+                chunk["usage"] = None
+            if include_timing:
+                chunk["timing"] = {"upstream_ms": entry.upstream_ms(time.monotonic())}
+            yield chunk
+    finally:
+        await chunks.aclose()
+    usage = sum_usage(usages)
+    final: Dict[str, Any] = {
+        "id": entry.id,
+        "object": "chat.completion.chunk",
+        "created": created,
+        "model": model,
+        "choices": [],
+    }
+    if include_usage:
+        final["usage"] = usage
+    if include_timing:
+        final["timing"] = entry.timing(time.monotonic(), usage["completion_tokens"])
+    yield final
+
+
+def _stream_outcome(server: ServerState, entry: InFlight, status: str) -> str:
+    if entry.cancelled:
+        server.metrics.inc("chat_completions_cancelled")
+        return "cancelled"
+    if entry.abort.is_set():
+        server.metrics.inc("chat_completions_aborted")
+        return "aborted"
+    return status
+
+
+@router.post("/v1/chat/completions", dependencies=[Depends(_refuse_when_draining), Depends(_enforce_rate_limits)])
+async def chat_completions(request: Request) -> Response:
+    started = time.perf_counter()
+    server = _server(request)
+    settings = server.settings
+    payload = await _read_json_payload(request)
+    stream = bool(payload.get("stream"))
+    model, n, session_id, body, context, limits = _chat_body(server, payload)
+    include_usage, include_timing = _stream_options(payload) if stream else (False, False)
 
-    creds = load_credentials()
+    deadline = _request_deadline(request.headers, payload)
+    creds = await server.credentials.get_valid()
     if not creds:
         raise HTTPException(status_code=401, detail="No Codex OAuth credentials found")
-    if not credentials_valid(creds):
-        creds = await refresh_access_token(creds.refresh)
-        save_credentials(creds)
 
-    completion_id = f"chatcmpl_{uuid.uuid4().hex}"
+    wait = server.breaker.retry_after()
+    if wait > 0:
+        raise _circuit_open(server, wait)
+
+    completion_id = _completion_id(request)
     created = int(time.time())
+    caller = _caller(request, payload)
+    key = getattr(request.state, "api_key", None)
+    entry = InFlight(
+        completion_id,
+        owner=key.name if key is not None else None,
+        caller=caller,
+        session_id=session_id,
+        account_id=creds.account_id,
+    )
+    try:
+        server.inflight.register(entry)
+    except KeyError:
+        raise HTTPException(status_code=409, detail=f"Completion {completion_id} is already in flight")
 
+    headers = {"X-Claw-Completion-Id": completion_id}
+    if context is not None:
+        headers["X-Claw-Tokens-Saved"] = str(context["tokens_saved"])
     if stream:
         async def event_stream() -> Any:
-            sent_role = False
+            usages: List[Dict[str, int]] = []
+            status = "error"
+            abort = entry.abort
+            watcher = asyncio.create_task(_watch_disconnect(request, abort))
+            chunks = _chat_chunks(
+                server,
+                entry,
+                creds,
+                body,
+                model=model,
+                created=created,
+                n=n,
+                session_id=session_id,
+                deadline=deadline,
+                usages=usages,
+                limits=limits,
+            )
+            if include_usage or include_timing:
+                chunks = _with_stream_options(
+                    chunks,
+                    entry,
+                    usages,
+                    model=model,
+                    created=created,
+                    include_usage=include_usage,
+                    include_timing=include_timing,
+                )
+            server.metrics.inc("chat_completions_streamed")
             try:
-                async for event in iter_codex_events(creds.access, creds.account_id, body, session_id=session_id):
-                    event_type = event.get("type")
-                    if event_type == "response.output_text.delta":
-                        delta = event.get("delta")
-                        if isinstance(delta, str):
-                            if not sent_role:
-                                chunk = {
-                                    "id": completion_id,
-                                    "object": "chat.completion.chunk",
-                                    "created": created,
-                                    "model": model,
-                                    "choices": [{"index": 0, "delta": {"role": "assistant"}, "finish_reason": None}],
-                                }
-                                yield f"data: {json.dumps(chunk)}\n\n"
-                                sent_role = True
-                            chunk = {
-                                "id": completion_id,
-                                "object": "chat.completion.chunk",
-                                "created": created,
-                                "model": model,
-                                "choices": [{"index": 0, "delta": {"content": delta}, "finish_reason": None}],
-                            }
-                            yield f"data: {json.dumps(chunk)}\n\n"
-                    elif event_type == "response.completed":
-                        chunk = {
-                            "id": completion_id,
-                            "object": "chat.completion.chunk",
-                            "created": created,
-                            "model": model,
-                            "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}],
-                        }
-                        yield f"data: {json.dumps(chunk)}\n\n"
-                    elif event_type == "error":
-                        raise RuntimeError("Codex error event")
-                    elif event_type == "response.failed":
-                        raise RuntimeError("Codex response failed")
+                async for chunk in chunks:
+                    line = _sse(chunk)
+                    entry.bytes_sent += len(line)
+                    yield line
+                status = "ok"
+            except CompletionCancelled:
+                pass
+            except CodexTimeoutError as exc:
+                status = "timeout"
+                server.metrics.inc("upstream_timeouts")
+                yield _sse({"error": _timeout_error(exc)})
+            except CircuitOpenError as exc:
+                # The response has started, so errors become a final chunk, as on the WebSocket.
+                yield _sse({"error": _error_body(_circuit_open(server, exc.retry_after))})
+            except RuntimeError as exc:
+                yield _sse({"error": {"message": str(exc), "type": "upstream_error", "code": 502}})
+            except (asyncio.CancelledError, GeneratorExit):
+                # The server cancelled or closed us because the client went away.
+                abort.set()
+                raise
             finally:
-                yield "data: [DONE]\n\n"
-
-        return StreamingResponse(event_stream(), media_type="text/event-stream")
+                watcher.cancel()
+                server.inflight.unregister(entry)
+                await chunks.aclose()
+                status = _stream_outcome(server, entry, status)
+                usage = sum_usage(usages) if usages else {}
+                _record_usage(
+                    server,
+                    _usage_record(completion_id, "chat.completions", model, creds, caller, usage, started, status),
+                    entry,
+                )
+                if entry.cancelled:
+                    yield _sse(_chat_chunk(completion_id, created, model, {}, "cancelled"))
+                if entry.cancelled or not abort.is_set():
+                    yield "data: [DONE]\n\n"
+
+        async def forget() -> None:
+            server.inflight.unregister(entry)
+
+        return _ClosingStreamingResponse(
+            event_stream(),
+            media_type="text/event-stream",
+            headers=headers,
+            on_close=forget,
+        )
 
+    reasoning: List[List[Dict[str, Any]]] = [[] for _ in range(n)]
     try:
-        text, usage, finish_reason = await collect_codex_response(
-            creds.access, creds.account_id, body, session_id=session_id
-        )
+        async with server.completion_slot(deadline, entry):
+            results = await _gather_choices(
+                [
+                    collect_codex_response(
+                        creds.access,
+                        creds.account_id,
+                        body,
+                        session_id=session_id,
+                        mock_mode=settings.mock_mode,
+                        http_client=server.http,
+                        breaker=server.breaker,
+                        timeouts=server.timeouts,
+                        deadline=deadline,
+                        abort=entry.abort,
+                        on_event=functools.partial(_track_event, entry),
+                        limiter=limits() if limits is not None else None,
+                        reasoning=reasoning[index],
+                    )
+                    for index in range(n)
+                ]
+            )
+        if entry.cancelled:
+            raise CompletionCancelled(completion_id)
+    except CompletionCancelled as exc:
+        server.metrics.inc("chat_completions_cancelled")
+        record = _usage_record(completion_id, "chat.completions", model, creds, caller, {}, started, "cancelled")
+        _record_usage(server, record, entry)
+        raise HTTPException(status_code=409, detail=str(exc))
+    except CodexTimeoutError as exc:
+        record = _usage_record(completion_id, "chat.completions", model, creds, caller, {}, started, "timeout")
+        _record_usage(server, record, entry)
+        raise _timed_out(server, exc)
+    except CircuitOpenError as exc:
+        record = _usage_record(completion_id, "chat.completions", model, creds, caller, {}, started, "error")
+        _record_usage(server, record, entry)
+        raise _circuit_open(server, exc.retry_after)
     except RuntimeError as exc:
+        record = _usage_record(completion_id, "chat.completions", model, creds, caller, {}, started, "error")
+        _record_usage(server, record, entry)
         raise HTTPException(status_code=400, detail=str(exc))
+    finally:
+        server.inflight.unregister(entry)
+    usage = sum_usage([choice_usage for _, choice_usage, _ in results])
+    record = _usage_record(completion_id, "chat.completions", model, creds, caller, usage, started, "ok")
+    _record_usage(server, record, entry)
 
     response = {
         "id": completion_id,
@@ -846,11 +1232,445 @@ async def chat_completions(request: Request) -> JSONResponse:
         "model": model,
         "choices": [
             {
-                "index": 0,
-                "message": {"role": "assistant", "content": text},
+                "index": index,
+                "message": _assistant_message(text, reasoning[index]),
                 "finish_reason": finish_reason or "stop",
             }
+            for index, (text, _, finish_reason) in enumerate(results)
         ],
         "usage": usage,
     }
-    return JSONResponse(response)
+    if context is not None:
+        response["context"] = context
+    return json_response(request, response, min_size=settings.compress_min_bytes, headers=headers)
+
+
+@router.post("/v1/chat/completions/{completion_id}/cancel")
+async def cancel_chat_completion(
+    request: Request, completion_id: str, key: Optional[KeyState] = Depends(_authenticate)
+) -> JSONResponse:
+    """Stop an in-flight completion: its upstream stream is closed and its slot freed."""
+    server = _server(request)
+    # With API keys, a completion started under another key looks the same as an unknown one.
+    if not server.inflight.cancel(completion_id, owner=key.name if key is not None else None):
+        workers = server.settings.workers
+        if workers > 1:
+            # Completions are registered per worker; a new connection may reach the one running it.
+            raise HTTPException(
+                status_code=421,
+                detail=f"Completion {completion_id} is not running on this worker ({workers} workers); "
+                "retry on a new connection",
+                headers={"Connection": "close"},
+            )
+        raise HTTPException(status_code=404, detail=f"No in-flight completion {completion_id}")
+    return JSONResponse({"id": completion_id, "object": "chat.completion.cancellation", "cancelled": True})
+
+
+def _error_body(exc: HTTPException) -> Dict[str, Any]:
+    error: Dict[str, Any] = {"message": exc.detail, "type": "request_error", "code": exc.status_code}
+    retry_after = (exc.headers or {}).get("Retry-After")
+    if retry_after:
+        error["retry_after"] = int(retry_after)
+    return error
+
+
+class _ChatSocket:
+    """One WebSocket chat session: concurrent turns keyed by the client's ``id``, and server-side history.
+
+    Client frames are JSON objects with a ``type``:
+
+    - ``chat.completion``: a chat completion body plus a unique ``id``. With
+      ``conversation``, that conversation's history is sent before
+      ``messages``, and the turn and its reply (choice 0) are appended to it
+      once the turn completes.
+    - ``cancel``: stops the running turn ``id``.
+    - ``reset``: forgets the history of ``conversation``.
+
+    Each turn streams the same chunks as SSE, with ``request_id`` added, and
+    ends with ``{"type": "done"}``. Failures arrive as ``{"type": "error"}``.
+    Histories keep the last ``websocket_history_turns`` turns, trimmed to the
+    context policy if there is one, for at most ``max_conversations``
+    conversations; the least recently used is forgotten first.
+    """
+
+    max_conversations = 64
+
+    def __init__(self, server: ServerState, websocket: WebSocket, key: Optional[KeyState]) -> None:
+        self.server = server
+        self.websocket = websocket
+        self.key = key
+        self.histories: Dict[str, List[Dict[str, Any]]] = {}
+        turns = server.settings.websocket_history_turns
+        # A zero token budget is always exceeded, so keep_last_turns always applies.
+        self._history_policy = ContextPolicy(0, ("keep_last_turns",), keep_turns=turns) if turns > 0 else None
+        self.turns: Dict[str, asyncio.Task] = {}
+        self.entries: Dict[str, InFlight] = {}
+        self.closed = False
+        self._send_lock = asyncio.Lock()
+
+    async def send(self, frame: Dict[str, Any]) -> int:
+        """Send one frame and return its size; once the socket fails, every running turn is aborted."""
+        if self.closed:
+            return 0
+        text = json.dumps(frame)
+        try:
+            async with self._send_lock:
+                await self.websocket.send_text(text)
+        except (WebSocketDisconnect, RuntimeError, OSError):
+            self.closed = True
+            for entry in self.entries.values():
+                entry.abort.set()
+            return 0
+        return len(text)
+
+    async def error(self, request_id: Any, error: Dict[str, Any]) -> None:
+        await self.send({"type": "error", "request_id": request_id, "error": error})
+
+    async def reject(self, request_id: Any, status_code: int, message: str) -> None:
+        await self.error(request_id, {"message": message, "type": "request_error", "code": status_code})
+
+    def remember(self, conversation: str, history: List[Dict[str, Any]]) -> None:
+        for policy in (self.server.context_policy, self._history_policy):
+            if policy is not None:
+                history, _ = fit_messages(history, policy)
+        self.histories.pop(conversation, None)
+        self.histories[conversation] = history
+        while len(self.histories) > self.max_conversations:
+            del self.histories[next(iter(self.histories))]
+
+    async def run(self) -> None:
+        try:
+            while True:
+                message = await self.websocket.receive()
+                if message["type"] == "websocket.disconnect":
+                    return
+                try:
+                    frame = json.loads(message.get("text") or message.get("bytes") or b"")
+                except ValueError:
+                    frame = None
+                if not isinstance(frame, dict):
+                    await self.reject(None, 400, "Frames must be JSON objects")
+                    continue
+                await self.dispatch(frame)
+        finally:
+            self.closed = True
+            for entry in self.entries.values():
+                entry.abort.set()
+            turns = list(self.turns.values())
+            for task in turns:
+                task.cancel()
+            await asyncio.gather(*turns, return_exceptions=True)
+
+    async def dispatch(self, frame: Dict[str, Any]) -> None:
+        kind = frame.get("type")
+        request_id = frame.get("id")
+        if kind == "chat.completion":
+            if not isinstance(request_id, str) or not request_id:
+                await self.reject(request_id, 400, "id must be a non-empty string")
+            elif request_id in self.turns:
+                await self.reject(request_id, 409, "id is already running")
+            elif self.server.draining:
+                await self.reject(request_id, 503, "Server is shutting down; retry on another instance")
+            else:
+                task = asyncio.create_task(self.turn(request_id, frame))
+                self.turns[request_id] = task
+                task.add_done_callback(lambda _: self.turns.pop(request_id, None))
+        elif kind == "cancel":
+            entry = self.entries.get(request_id) if isinstance(request_id, str) else None
+            if entry is None:
+                await self.reject(request_id, 404, "No running turn with this id")
+            else:
+                entry.cancel()
+        elif kind == "reset":
+            conversation = frame.get("conversation")
+            if isinstance(conversation, str):
+                self.histories.pop(conversation, None)
+            await self.send({"type": "reset", "conversation": conversation})
+        else:
+            await self.reject(request_id, 400, f"Unknown frame type {kind!r}")
+
+    async def turn(self, request_id: str, frame: Dict[str, Any]) -> None:
+        try:
+            await self._turn(request_id, frame)
+        except Exception:
+            logger.exception("WebSocket turn %s failed", request_id)
+            await self.error(request_id, {"message": "Internal server error", "type": "server_error", "code": 500})
+            await self.send({"type": "done", "request_id": request_id, "id": None, "usage": {}})
+
+    async def _turn(self, request_id: str, frame: Dict[str, Any]) -> None:
+        started = time.perf_counter()
+        server = self.server
+        conversation = frame.get("conversation")
+        messages = frame.get("messages") or []
+        try:
+            if conversation is not None and not isinstance(conversation, str):
+                raise HTTPException(status_code=400, detail="conversation must be a string")
+            if not isinstance(messages, list):
+                raise HTTPException(status_code=400, detail="messages must be an array")
+            history = self.histories.get(conversation, []) if conversation else []
+            payload = {**frame, "messages": history + messages} if history else frame
+            model, n, session_id, body, context, limits = _chat_body(server, payload)
+            deadline = _request_deadline({}, payload)
+            if self.key is not None:
+                wait = self.key.admit()
+                if wait > 0:
+                    server.metrics.inc("rate_limited")
+                    raise HTTPException(
+                        status_code=429,
+                        detail=f"Rate limit exceeded for API key {self.key.name!r}",
+                        headers={"Retry-After": str(max(1, math.ceil(wait)))},
+                    )
+            creds = await server.credentials.get_valid()
+            if not creds:
+                raise HTTPException(status_code=401, detail="No Codex OAuth credentials found")
+            wait = server.breaker.retry_after()
+            if wait > 0:
+                raise _circuit_open(server, wait)
+        except HTTPException as exc:
+            await self.error(request_id, _error_body(exc))
+            return
+
+        completion_id = f"chatcmpl_{uuid.uuid4().hex}"
+        created = int(time.time())
+        caller = _caller(self.websocket, payload)
+        entry = InFlight(
+            completion_id,
+            endpoint="chat.websocket",
+            owner=self.key.name if self.key is not None else None,
+            caller=caller,
+            session_id=session_id,
+            account_id=creds.account_id,
+        )
+        server.inflight.register(entry)
+        self.entries[request_id] = entry
+        usages: List[Dict[str, int]] = []
+        reply: List[str] = []
+        reasoning: List[Dict[str, Any]] = []
+        status = "error"
+        error: Optional[Dict[str, Any]] = None
+        chunks = _chat_chunks(
+            server,
+            entry,
+            creds,
+            body,
+            model=model,
+            created=created,
+            n=n,
+            session_id=session_id,
+            deadline=deadline,
+            usages=usages,
+            limits=limits,
+        )
+        server.metrics.inc("chat_completions_websocket")
+        try:
+            async for chunk in chunks:
+                choice = chunk["choices"][0]
+                if choice["index"] == 0:
+                    reply.append(choice["delta"].get("content", ""))
+                    reasoning.extend(choice["delta"].get("reasoning_details", ()))
+                entry.bytes_sent += await self.send({"request_id": request_id, **chunk})
+            status = "ok"
+        except CompletionCancelled:
+            pass
+        except CodexTimeoutError as exc:
+            status = "timeout"
+            server.metrics.inc("upstream_timeouts")
+            error = _timeout_error(exc)
+        except CircuitOpenError as exc:
+            error = _error_body(_circuit_open(server, exc.retry_after))
+        except RuntimeError as exc:
+            error = {"message": str(exc), "type": "upstream_error", "code": 502}
+        finally:
+            server.inflight.unregister(entry)
+            self.entries.pop(request_id, None)
+            await chunks.aclose()
+            status = _stream_outcome(server, entry, status)
+            usage = sum_usage(usages) if usages else {}
+            _record_usage(
+                server,
+                _usage_record(completion_id, "chat.completions", model, creds, caller, usage, started, status),
+                entry,
+            )
+
+        if status == "ok" and conversation:
+            self.remember(conversation, history + messages + [_assistant_message("".join(reply), reasoning)])
+        if error is not None:
+            await self.error(request_id, error)
+        if entry.cancelled:
+            await self.send({"request_id": request_id, **_chat_chunk(completion_id, created, model, {}, "cancelled")})
+        done = {"type": "done", "request_id": request_id, "id": completion_id, "usage": usage}
+        if context is not None:
+            done["context"] = context
+        await self.send(done)
+
+
+@router.websocket("/v1/chat/ws")
+async def chat_websocket(websocket: WebSocket) -> None:
+    """Many chat turns, and concurrent completions, over one connection; see ``_ChatSocket``."""
+    server = _server(websocket)
+    try:
+        key = _api_key(websocket)
+    except HTTPException as exc:
+        await websocket.close(code=1008, reason=str(exc.detail))
+        return
+    if server.draining:
+        await websocket.close(code=1012, reason="Server is shutting down")
+        return
+    if key is not None:
+        websocket.state.api_key = key
+    await websocket.accept()
+    server.metrics.inc("websocket_sessions")
+    await _ChatSocket(server, websocket, key).run()
+
+
+@router.post("/v1/responses", dependencies=[Depends(_refuse_when_draining), Depends(_enforce_rate_limits)])
+async def responses(request: Request) -> Response:
+    """Relay a Responses API request upstream without re-encoding the event stream."""
+    started = time.perf_counter()
+    server = _server(request)
+    settings = server.settings
+    raw = await _read_raw_body(request)
+    deadline = _request_deadline(request.headers)
+    creds = await server.credentials.get_valid()
+    if not creds:
+        raise HTTPException(status_code=401, detail="No Codex OAuth credentials found")
+    session_id = request.headers.get("session_id")
+    caller = _caller(request)
+
+    try:
+        call = server.breaker.start_call()
+    except CircuitOpenError as exc:
+        raise _circuit_open(server, exc.retry_after)
+    key = getattr(request.state, "api_key", None)
+    entry = server.inflight.register(
+        InFlight(
+            f"resp_{uuid.uuid4().hex}",
+            endpoint="responses",
+            owner=key.name if key is not None else None,
+            caller=caller,
+            session_id=session_id,
+            account_id=creds.account_id,
+        )
+    )
+    stack = AsyncExitStack()
+    stack.callback(call.finish)
+    stack.callback(server.inflight.unregister, entry)
+    try:
+        await stack.enter_async_context(server.completion_slot(deadline, entry))
+        budget = PhaseBudget(server.timeouts, deadline)
+        if settings.mock_mode:
+            try:
+                mock_body = json.loads(raw)
+            except ValueError:
+                raise HTTPException(status_code=400, detail="Request body must be valid JSON")
+            source = mock_codex_sse(mock_body if isinstance(mock_body, dict) else {})
+            media_type = "text/event-stream"
+        else:
+            client = server.http or await stack.enter_async_context(httpx.AsyncClient(timeout=None))
+            try:
+                upstream = await open_codex_stream(
+                    creds.access, creds.account_id, raw, client, session_id=session_id, budget=budget
+                )
+            except (httpx.TransportError, CodexTimeoutError) as exc:
+                if is_upstream_failure(exc):
+                    call.ok = False
+                raise
+            stack.push_async_callback(upstream.aclose)
+            if upstream.status_code >= 400:
+                if upstream.status_code >= 500 or upstream.status_code == 429:
+                    call.ok = False
+                content = await upstream.aread()
+                await stack.aclose()
+                return Response(content, status_code=upstream.status_code, media_type=upstream.headers.get("content-type"))
+            source = upstream.aiter_bytes()
+            media_type = upstream.headers.get("content-type", "text/event-stream")
+    except CompletionCancelled as exc:
+        await stack.aclose()
+        raise HTTPException(status_code=409, detail=str(exc))
+    except CodexTimeoutError as exc:
+        await stack.aclose()
+        raise _timed_out(server, exc)
+    except BaseException:
+        await stack.aclose()
+        raise
+
+    async def relay() -> Any:
+        abort = entry.abort
+        watcher = asyncio.create_task(_watch_disconnect(request, abort))
+        sniffer = CompletedEventSniffer()
+        status = "error"
+        server.metrics.inc("responses_streamed")
+        try:
+            async for chunk in _until_aborted(source, abort, budget):
+                call.mark_first_event()
+                sniffer.feed(chunk)
+                # Relayed bytes are never parsed, so each upstream chunk counts as one delta.
+                entry.phase = STREAMING
+                entry.record_delta()
+                entry.bytes_sent += len(chunk)
+                yield chunk
+            status = "ok"
+        except CodexTimeoutError as exc:
+            status = "timeout"
+            if is_upstream_failure(exc):
+                call.ok = False
+            server.metrics.inc("upstream_timeouts")
+            error = {"type": "error", "code": f"{exc.phase}_timeout", "message": str(exc)}
+            yield f"event: error\ndata: {json.dumps(error)}\n\n".encode("utf-8")
+        except (asyncio.CancelledError, GeneratorExit):
+            abort.set()
+            raise
+        except Exception as exc:
+            if is_upstream_failure(exc):
+                call.ok = False
+            raise
+        finally:
+            watcher.cancel()
+            if abort.is_set():
+                status = "aborted"
+                server.metrics.inc("responses_aborted")
+            elif status == "ok":
+                call.ok = True
+            response = sniffer.response or {}
+            usage = parse_usage(response)
+            record_id = str(response.get("id") or f"resp_{uuid.uuid4().hex}")
+            model = response.get("model")
+            _record_usage(
+                server, _usage_record(record_id, "responses", model, creds, caller, usage, started, status), entry
+            )
+
+    return _ClosingStreamingResponse(relay(), media_type=media_type, on_close=stack.aclose)
+
+
+@router.get("/v1/usage")
+async def usage(
+    request: Request,
+    since: Optional[str] = None,
+    until: Optional[str] = None,
+    group_by: Optional[str] = None,
+    bucket: Optional[str] = None,
+    key: Optional[KeyState] = Depends(_authenticate),
+) -> JSONResponse:
+    """Usage aggregates; a key that is not an admin key only sees its own completions."""
+    server = _server(request)
+    settings = server.settings
+    if settings.usage_db is None:
+        raise HTTPException(status_code=404, detail="Usage ledger is disabled")
+    if server.ledger is not None:
+        await server.ledger.flush()
+    try:
+        rows = await asyncio.to_thread(
+            query_usage,
+            settings.usage_db,
+            since=parse_time_bound(since),
+            until=parse_time_bound(until),
+            group_by=group_by,
+            bucket_seconds=parse_duration(bucket) if bucket else None,
+            caller=key.name if key is not None and not key.admin else None,
+        )
+    except ValueError as exc:
+        raise HTTPException(status_code=400, detail=str(exc))
+    return JSONResponse({"object": "list", "data": rows})
+
+
+app = create_app()
@@ -0,0 +1,206 @@
+import time
+from collections import deque
+from typing import Any, Deque, Dict, Optional, Tuple
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitOpenError(RuntimeError):
+    def __init__(self, retry_after: float) -> None:
+        super().__init__("Codex upstream circuit is open; failing fast")
+        self.retry_after = retry_after
+
+
+class CircuitBreaker:
+    """Rolling-window circuit breaker for the Codex upstream.
+
+    Closed: calls flow and outcomes land in a time window. Once the window
+    holds ``min_calls`` and the share of failures (errors, or successes slower
+    than ``slow_call_seconds`` to first event) reaches ``failure_ratio``, the
+    circuit opens. Open: calls fail fast for ``open_seconds``. Half-open: up to
+    ``half_open_probes`` calls run concurrently; that many successes close the
+    circuit, any failure re-opens it.
+    """
+
+    def __init__(
+        self,
+        *,
+        window_seconds: float = 30.0,
+        min_calls: int = 10,
+        failure_ratio: float = 0.5,
+        slow_call_seconds: Optional[float] = None,
+        open_seconds: float = 15.0,
+        half_open_probes: int = 2,
+    ) -> None:
+        self.window_seconds = window_seconds
+        self.min_calls = min_calls
+        self.failure_ratio = failure_ratio
+        self.slow_call_seconds = slow_call_seconds
+        self.open_seconds = open_seconds
+        self.half_open_probes = half_open_probes
+        self.times_opened = 0
+        self._state = CLOSED
+        self._opened_at = 0.0
+        self._probes_in_flight = 0
+        self._probe_successes = 0
+        # Counts half-open periods, so probes that outlive theirs are not counted in the next one.
+        self._generation = 0
+        # (timestamp, failed, latency or None) per finished call, oldest first.
+        self._window: Deque[Tuple[float, bool, Optional[float]]] = deque()
+        self._failures = 0
+        self._latency_sum = 0.0
+        self._latency_count = 0
+
+    def _evict(self, now: float) -> None:
+        cutoff = now - self.window_seconds
+        while self._window and self._window[0][0] < cutoff:
+            _, failed, latency = self._window.popleft()
+            self._failures -= failed
+            if latency is not None:
+                self._latency_sum -= latency
+                self._latency_count -= 1
+
+    def _reset_window(self) -> None:
+        self._window.clear()
+        self._failures = 0
+        self._latency_sum = 0.0
+        self._latency_count = 0
+
+    def state(self, now: Optional[float] = None) -> str:
+        now = time.monotonic() if now is None else now
+        if self._state == OPEN and now - self._opened_at >= self.open_seconds:
+            self._state = HALF_OPEN
+            self._generation += 1
+            self._probes_in_flight = 0
+            self._probe_successes = 0
+        return self._state
+
+    def retry_after(self, now: Optional[float] = None) -> float:
+        """Seconds until a call would be admitted; 0 when it would be now."""
+        now = time.monotonic() if now is None else now
+        state = self.state(now)
+        if state == OPEN:
+            return max(0.0, self._opened_at + self.open_seconds - now)
+        if state == HALF_OPEN and self._probes_in_flight >= self.half_open_probes:
+            return 1.0
+        return 0.0
+
+    def before_call(self, now: Optional[float] = None) -> bool:
+        """Admit a call or raise CircuitOpenError. Returns True if the call is a half-open probe."""
+        now = time.monotonic() if now is None else now
+        wait = self.retry_after(now)
+        if wait > 0:
+            raise CircuitOpenError(wait)
+        if self._state == HALF_OPEN:
+            self._probes_in_flight += 1
+            return True
+        return False
+
+    def start_call(self) -> "BreakerCall":
+        """Admit a call (or raise CircuitOpenError) and return a handle to report its outcome."""
+        return BreakerCall(self, self.before_call(), self._generation)
+
+    def _end_probe(self, generation: Optional[int]) -> bool:
+        """Retire a probe; False if it was admitted in an earlier half-open period and must not count."""
+        if generation is not None and generation != self._generation:
+            return False
+        self._probes_in_flight = max(0, self._probes_in_flight - 1)
+        return True
+
+    def record_success(
+        self, probe: bool, latency: float, now: Optional[float] = None, generation: Optional[int] = None
+    ) -> None:
+        now = time.monotonic() if now is None else now
+        slow = self.slow_call_seconds is not None and latency > self.slow_call_seconds
+        if probe:
+            if not self._end_probe(generation):
+                return
+            if slow:
+                self._trip(now)
+                return
+            self._probe_successes += 1
+            if self._state == HALF_OPEN and self._probe_successes >= self.half_open_probes:
+                self._state = CLOSED
+                self._reset_window()
+            return
+        self._add(now, slow, latency)
+
+    def record_failure(self, probe: bool, now: Optional[float] = None, generation: Optional[int] = None) -> None:
+        now = time.monotonic() if now is None else now
+        if probe:
+            if self._end_probe(generation):
+                self._trip(now)
+            return
+        self._add(now, True, None)
+
+    def release(self, probe: bool, generation: Optional[int] = None) -> None:
+        """Forget a call that ended without a verdict, e.g. cancelled by the client."""
+        if probe:
+            self._end_probe(generation)
+
+    def _add(self, now: float, failed: bool, latency: Optional[float]) -> None:
+        self._window.append((now, failed, latency))
+        self._failures += failed
+        if latency is not None:
+            self._latency_sum += latency
+            self._latency_count += 1
+        self._evict(now)
+        calls = len(self._window)
+        if self._state == CLOSED and calls >= self.min_calls and self._failures / calls >= self.failure_ratio:
+            self._trip(now)
+
+    def _trip(self, now: float) -> None:
+        self._state = OPEN
+        self._opened_at = now
+        self.times_opened += 1
+        self._reset_window()
+
+    def snapshot(self, now: Optional[float] = None) -> Dict[str, Any]:
+        now = time.monotonic() if now is None else now
+        self._evict(now)
+        calls = len(self._window)
+        return {
+            "state": self.state(now),
+            "retry_after": round(self.retry_after(now), 3),
+            "window_seconds": self.window_seconds,
+            "calls": calls,
+            "failures": self._failures,
+            "failure_ratio": round(self._failures / calls, 4) if calls else 0.0,
+            "avg_first_event_seconds": round(self._latency_sum / self._latency_count, 4) if self._latency_count else None,
+            "probes_in_flight": self._probes_in_flight,
+            "times_opened": self.times_opened,
+        }
+
+
+class BreakerCall:
+    """Outcome of one admitted call; ``finish`` reports it to the breaker exactly once."""
+
+    def __init__(self, breaker: CircuitBreaker, probe: bool, generation: Optional[int] = None) -> None:
+        self.breaker = breaker
+        self.probe = probe
+        self.generation = generation
+        self.started = time.monotonic()
+        self.first_event_latency: Optional[float] = None
+        # True/False once the upstream's health is known; None releases without a verdict.
+        self.ok: Optional[bool] = None
+        self._finished = False
+
+    def mark_first_event(self) -> None:
+        if self.first_event_latency is None:
+            self.first_event_latency = time.monotonic() - self.started
+
+    def finish(self) -> None:
+        if self._finished:
+            return
+        self._finished = True
+        if self.ok is True:
+            latency = self.first_event_latency
+            if latency is None:
+                latency = time.monotonic() - self.started
+            self.breaker.record_success(self.probe, latency, generation=self.generation)
+        elif self.ok is False:
+            self.breaker.record_failure(self.probe, generation=self.generation)
+        else:
+            self.breaker.release(self.probe, generation=self.generation)
@@ -1,21 +1,139 @@
 import argparse
+import asyncio
 import json
 import os
+import shutil
+import socket
+import stat
 import sys
+import tempfile
+import time
 import webbrowser
-from typing import Any
-
-import uvicorn
+from pathlib import Path
+from typing import Any, Dict, List, Optional
 
 from .client import ClawCodexClient
+from .config import USAGE_DB
+from .ledger import GROUP_BY_COLUMNS, parse_duration, parse_time_bound, query_usage
 
 
 def _print_json(payload: Any) -> None:
     print(json.dumps(payload, indent=2))
 
 
-def _run_server(host: str, port: int) -> None:
-    uvicorn.run("claw_codex.app:app", host=host, port=port, log_level="info")
+def _env_int(name: str) -> Optional[int]:
+    value = os.getenv(name, "").strip()
+    return int(value) if value else None
+
+
+def _bind_unix_socket(path: str, mode: int, group: Optional[str] = None) -> socket.socket:
+    """Bind a listening Unix socket at ``path`` with ``mode`` permissions, replacing a stale one."""
+    if os.path.exists(path):
+        if not stat.S_ISSOCK(os.stat(path).st_mode):
+            raise SystemExit(f"{path} exists and is not a socket")
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as probe:
+            try:
+                probe.connect(path)
+            except OSError:
+                os.unlink(path)
+            else:
+                raise SystemExit(f"Another server is already listening on {path}")
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    # Bind under a tight umask so the socket is never reachable with looser permissions than asked for.
+    umask = os.umask(0o777 & ~mode)
+    try:
+        sock.bind(path)
+    finally:
+        os.umask(umask)
+    os.chmod(path, mode)
+    if group:
+        shutil.chown(path, group=group)
+    sock.set_inheritable(True)
+    return sock
+
+
+def _bind_tcp_socket(host: str, port: int) -> socket.socket:
+    sock = socket.socket(socket.AF_INET6 if ":" in host else socket.AF_INET)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.set_inheritable(True)
+    return sock
+
+
+def _run_server(
+    host: str,
+    port: int,
+    *,
+    workers: int = 1,
+    loop: str = "auto",
+    http: str = "auto",
+    backlog: int = 2048,
+    timeout_keep_alive: int = 5,
+    limit_concurrency: Optional[int] = None,
+    ws_per_message_deflate: bool = True,
+    uds: Optional[str] = None,
+    uds_mode: int = 0o660,
+    uds_group: Optional[str] = None,
+    tcp: bool = False,
+    drain_timeout: float = 30.0,
+) -> None:
+    import uvicorn
+
+    from .serving import DrainingServer, run_workers
+
+    # Workers build their app from the environment, so they learn how many siblings they have.
+    os.environ["CLAW_CODEX_WORKERS"] = str(workers)
+    options: Dict[str, Any] = dict(
+        log_level="info",
+        workers=workers,
+        loop=loop,
+        http=http,
+        backlog=backlog,
+        timeout_keep_alive=timeout_keep_alive,
+        limit_concurrency=limit_concurrency,
+        ws_per_message_deflate=ws_per_message_deflate,
+        # The app's own access log records every response, so uvicorn's would only duplicate it.
+        access_log=not os.getenv("CLAW_CODEX_ACCESS_LOG"),
+        # Completions were drained before shutdown starts; this bounds what is left, such as idle WebSockets.
+        timeout_graceful_shutdown=drain_timeout or None,
+    )
+
+    def supervise(sockets: List[socket.socket]) -> None:
+        # Workers are separate processes: they share credentials only through the
+        # auth file, whose refresh is serialized by a file lock (see storage.py).
+        # Each one drains on the SIGTERM the supervisor forwards.
+        run_workers(config, sockets, drain_timeout=drain_timeout)
+
+    if uds is None:
+        config = uvicorn.Config("claw_codex.app:app", host=host, port=port, **options)
+        try:
+            if workers == 1:
+                DrainingServer(config, drain_timeout=drain_timeout).run()
+            else:
+                supervise([config.bind_socket()])
+        except KeyboardInterrupt:
+            pass
+        return
+
+    # uvicorn binds one address and chmods Unix sockets 0o666, so the sockets are
+    # bound here and handed to the server (or to every worker) already listening.
+    sockets = [_bind_unix_socket(uds, uds_mode, uds_group)]
+    try:
+        if tcp:
+            sockets.append(_bind_tcp_socket(host, port))
+        config = uvicorn.Config("claw_codex.app:app", **options)
+        print(f"Serving on unix:{uds}" + (f" and http://{host}:{port}" if tcp else ""), file=sys.stderr)
+        if workers == 1:
+            DrainingServer(config, drain_timeout=drain_timeout).run(sockets=sockets)
+        else:
+            supervise(sockets)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for sock in sockets:
+            sock.close()
+        if os.path.exists(uds):
+            os.unlink(uds)
 
 
 def _auth_start(client: ClawCodexClient, args: argparse.Namespace) -> None:
@@ -69,6 +187,92 @@ def _chat(client: ClawCodexClient, args: argparse.Namespace) -> None:
     _print_json(response)
 
 
+def _usage(args: argparse.Namespace) -> None:
+    path = Path(args.db)
+    if not path.exists():
+        raise RuntimeError(f"No usage ledger at {path}")
+    rows = query_usage(
+        path,
+        since=parse_time_bound(args.since),
+        until=parse_time_bound(args.until),
+        group_by=args.group_by,
+        bucket_seconds=parse_duration(args.bucket) if args.bucket else None,
+    )
+    _print_json({"object": "list", "data": rows})
+
+
+async def _profile_workload(app: Any, requests: int, concurrency: int) -> None:
+    import httpx
+
+    # ASGITransport skips the network, so the profile shows only the app: routing, conversion and SSE framing.
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://claw-codex") as client:
+        resp = await client.post("/auth/codex/exchange", json={"code": "mock"})
+        resp.raise_for_status()
+        remaining = iter(range(requests))
+
+        async def worker() -> None:
+            for index in remaining:
+                payload = {
+                    "model": "claw/codex",
+                    "messages": [
+                        {"role": "system", "content": "You are concise."},
+                        {"role": "user", "content": f"Request {index}: summarize the plan in a few words please."},
+                    ],
+                    "stream": index % 2 == 0,
+                }
+                async with client.stream("POST", "/v1/chat/completions", json=payload) as resp:
+                    resp.raise_for_status()
+                    async for _ in resp.aiter_bytes():
+                        pass
+
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+
+
+def _profile(args: argparse.Namespace) -> None:
+    from .app import create_app
+    from .config import Settings
+    from .profiling import AllocationTracer, SamplingProfiler
+
+    out = Path(args.out)
+    out.mkdir(parents=True, exist_ok=True)
+    with tempfile.TemporaryDirectory() as auth_dir:
+        settings = Settings(mock_mode=True, auth_file=Path(auth_dir) / "auth.json", pkce_file=Path(auth_dir) / "pkce.json")
+
+        # tracemalloc slows every allocation, so CPU and allocations are profiled in separate passes.
+        sampler = SamplingProfiler(args.interval_ms / 1000)
+        started = time.perf_counter()
+        sampler.start()
+        try:
+            asyncio.run(_profile_workload(create_app(settings), args.requests, args.concurrency))
+        finally:
+            cpu = sampler.stop()
+        seconds = time.perf_counter() - started
+        (out / "cpu.collapsed").write_text(cpu, encoding="utf-8")
+        result: Dict[str, Any] = {
+            "requests": args.requests,
+            "seconds": round(seconds, 3),
+            "requests_per_second": round(args.requests / seconds, 1),
+            "samples": sampler.samples,
+            "cpu_top": sampler.top(10),
+            "files": {"cpu": str(out / "cpu.collapsed")},
+        }
+
+        if not args.no_allocations:
+            tracer = AllocationTracer(frames=args.alloc_frames)
+            tracer.start()
+            try:
+                asyncio.run(_profile_workload(create_app(settings), args.requests, args.concurrency))
+            finally:
+                allocations = tracer.stop(limit=10)
+            (out / "alloc.collapsed").write_text(allocations["collapsed"], encoding="utf-8")
+            result["alloc_bytes"] = allocations["bytes"]
+            result["alloc_top"] = allocations["top"]
+            result["files"]["allocations"] = str(out / "alloc.collapsed")
+
+    (out / "profile.json").write_text(json.dumps(result, indent=2), encoding="utf-8")
+    _print_json(result)
+
+
 def _build_parser() -> argparse.ArgumentParser:
     parser = argparse.ArgumentParser(description="Claw Codex OAuth proxy and library CLI")
     subparsers = parser.add_subparsers(dest="command")
@@ -76,6 +280,75 @@ def _build_parser() -> argparse.ArgumentParser:
     serve_parser = subparsers.add_parser("serve", help="Run the local FastAPI proxy server")
     serve_parser.add_argument("--host", default=os.getenv("CLAW_CODEX_HOST", "127.0.0.1"))
     serve_parser.add_argument("--port", type=int, default=int(os.getenv("CLAW_CODEX_PORT", "1455")))
+    serve_parser.add_argument(
+        "--workers",
+        type=int,
+        default=int(os.getenv("CLAW_CODEX_WORKERS", "1")),
+        help="Number of worker processes",
+    )
+    serve_parser.add_argument(
+        "--loop",
+        choices=["auto", "asyncio", "uvloop"],
+        default=os.getenv("CLAW_CODEX_LOOP", "auto"),
+        help="Event loop implementation (uvloop requires claw-codex[server])",
+    )
+    serve_parser.add_argument(
+        "--http",
+        choices=["auto", "h11", "httptools"],
+        default=os.getenv("CLAW_CODEX_HTTP", "auto"),
+        help="HTTP protocol implementation (httptools requires claw-codex[server])",
+    )
+    serve_parser.add_argument(
+        "--backlog",
+        type=int,
+        default=int(os.getenv("CLAW_CODEX_BACKLOG", "2048")),
+        help="Maximum number of pending connections",
+    )
+    serve_parser.add_argument(
+        "--timeout-keep-alive",
+        type=int,
+        default=int(os.getenv("CLAW_CODEX_KEEP_ALIVE", "5")),
+        help="Seconds to keep idle client connections open",
+    )
+    serve_parser.add_argument(
+        "--limit-concurrency",
+        type=int,
+        default=_env_int("CLAW_CODEX_LIMIT_CONCURRENCY"),
+        help="Maximum concurrent connections per worker before responding 503",
+    )
+    serve_parser.add_argument(
+        "--ws-per-message-deflate",
+        action=argparse.BooleanOptionalAction,
+        default=os.getenv("CLAW_CODEX_WS_DEFLATE", "1").strip().lower() not in {"0", "false", "no", "off"},
+        help="Offer permessage-deflate on /v1/chat/ws (WebSockets require claw-codex[server])",
+    )
+    serve_parser.add_argument(
+        "--uds",
+        default=os.getenv("CLAW_CODEX_UDS") or None,
+        help="Listen on this Unix domain socket instead of TCP (add --tcp to serve both)",
+    )
+    serve_parser.add_argument(
+        "--uds-mode",
+        type=lambda value: int(value, 8),
+        default=int(os.getenv("CLAW_CODEX_UDS_MODE", "660"), 8),
+        help="Octal permissions for the socket file (default 660: owner and group)",
+    )
+    serve_parser.add_argument(
+        "--uds-group",
+        default=os.getenv("CLAW_CODEX_UDS_GROUP") or None,
+        help="Group that owns the socket file, so its members can connect",
+    )
+    serve_parser.add_argument(
+        "--tcp",
+        action="store_true",
+        help="With --uds, also listen on --host/--port",
+    )
+    serve_parser.add_argument(
+        "--drain-timeout",
+        type=float,
+        default=float(os.getenv("CLAW_CODEX_DRAIN_TIMEOUT", "30")),
+        help="On SIGTERM, seconds to let in-flight completions finish before stopping (0 stops at once)",
+    )
 
     auth_parser = subparsers.add_parser("auth", help="Authenticate with Codex OAuth")
     auth_sub = auth_parser.add_subparsers(dest="auth_command", required=True)
@@ -100,6 +373,23 @@ def _build_parser() -> argparse.ArgumentParser:
     chat_parser.add_argument("--model", default="claw/codex")
     chat_parser.add_argument("--text-only", action="store_true", help="Print assistant text only")
 
+    usage_parser = subparsers.add_parser("usage", help="Aggregate recorded token usage")
+    usage_parser.add_argument("--db", default=str(USAGE_DB), help="Usage ledger SQLite file")
+    usage_parser.add_argument("--since", default="24h", help="Epoch seconds or relative window such as 30m, 24h, 7d")
+    usage_parser.add_argument("--until", default=None, help="Epoch seconds or relative time")
+    usage_parser.add_argument("--group-by", choices=sorted(GROUP_BY_COLUMNS), default=None)
+    usage_parser.add_argument("--bucket", default=None, help="Time bucket size such as 1h or 1d")
+
+    profile_parser = subparsers.add_parser(
+        "profile", help="Profile a mock chat workload and write flamegraph-ready CPU and allocation stacks"
+    )
+    profile_parser.add_argument("--requests", type=int, default=1000, help="Completions to run; half stream")
+    profile_parser.add_argument("--concurrency", type=int, default=16)
+    profile_parser.add_argument("--interval-ms", type=float, default=1.0, help="CPU sampling interval")
+    profile_parser.add_argument("--no-allocations", action="store_true", help="Skip the tracemalloc pass")
+    profile_parser.add_argument("--alloc-frames", type=int, default=16, help="Stack depth kept per allocation")
+    profile_parser.add_argument("--out", default="claw-codex-profile", help="Output directory")
+
     return parser
 
 
@@ -114,7 +404,24 @@ def main() -> None:
         return
 
     if args.command == "serve":
-        _run_server(args.host, args.port)
+        if args.workers < 1:
+            parser.error("--workers must be at least 1")
+        _run_server(
+            args.host,
+            args.port,
+            workers=args.workers,
+            loop=args.loop,
+            http=args.http,
+            backlog=args.backlog,
+            timeout_keep_alive=args.timeout_keep_alive,
+            limit_concurrency=args.limit_concurrency,
+            ws_per_message_deflate=args.ws_per_message_deflate,
+            uds=args.uds,
+            uds_mode=args.uds_mode,
+            uds_group=args.uds_group,
+            tcp=args.tcp,
+            drain_timeout=args.drain_timeout,
+        )
         return
 
     client = ClawCodexClient(mock_mode=os.getenv("CLAW_CODEX_MOCK", "").strip().lower() in {"1", "true", "yes", "on"})
@@ -136,6 +443,14 @@ def main() -> None:
         if args.command == "chat":
             _chat(client, args)
             return
+
+        if args.command == "usage":
+            _usage(args)
+            return
+
+        if args.command == "profile":
+            _profile(args)
+            return
     except (RuntimeError, ValueError) as exc:
         print(str(exc), file=sys.stderr)
         raise SystemExit(1)
@@ -1,12 +1,31 @@
 import asyncio
+import functools
 import time
 import uuid
 from dataclasses import dataclass
 from pathlib import Path
-from typing import Any, AsyncGenerator, Dict, List, Optional
-
-from .codex import build_request_body, collect_codex_response, iter_codex_events
+from typing import Any, AsyncGenerator, Dict, List, Optional, Tuple, Union
+
+import httpx
+
+from .codex import (
+    REASONING_FORMAT,
+    CodexTimeouts,
+    OutputLimiter,
+    build_request_body,
+    collect_codex_response,
+    estimate_input_tokens,
+    iter_codex_events,
+    limit_output,
+    parse_usage,
+    reasoning_detail,
+    response_finish_reason,
+)
+from .context import ContextPolicy, fit_messages
 from .config import AUTH_FILE, DEFAULT_MODEL, MOCK_MODE, ORIGINATOR, PKCE_FILE, REDIRECT_URI
+from .hooks import CallTrace, ClientHooks
+from .inflight import CompletionCancelled, InFlight, InFlightRegistry
+from .models import DEFAULT_ROUTES, ModelRouter
 from .oauth import (
     build_authorize_url,
     exchange_authorization_code,
@@ -18,11 +37,13 @@ from .storage import (
     credentials_valid,
     load_credentials,
     load_pkce,
+    refresh_credentials_locked,
     save_credentials,
     save_pkce,
 )
+from .warmup import CODEX_ORIGIN, TOKEN_ORIGIN, ConnectionWarmer, DNSCache, create_pooled_client
 
-SUPPORTED_MODELS = {"claw/codex", "claw/codex-responses", "openai-codex"}
+SUPPORTED_MODELS = {route.id for route in DEFAULT_ROUTES}
 
 
 @dataclass
@@ -79,7 +100,30 @@ def _content_to_parts(content: Any, role: str) -> List[Dict[str, Any]]:
     return [{"type": text_type, "text": _coerce_text(content)}]
 
 
-def convert_messages(messages: List[Dict[str, Any]]) -> Dict[str, Any]:
+def _reasoning_items(details: Any) -> List[Dict[str, Any]]:
+    # Encrypted reasoning from an earlier response goes back in as it came out; ids are left
+    # off because with ``store: False`` upstream cannot look them up.
+    if not isinstance(details, list):
+        return []
+    return [
+        {"type": "reasoning", "summary": [], "encrypted_content": detail["data"]}
+        for detail in details
+        if isinstance(detail, dict)
+        and detail.get("type") == "reasoning.encrypted"
+        and detail.get("format", REASONING_FORMAT) == REASONING_FORMAT
+        and isinstance(detail.get("data"), str)
+    ]
+
+
+def convert_messages(messages: List[Dict[str, Any]], policy: Optional[ContextPolicy] = None) -> Dict[str, Any]:
+    """Chat messages to Responses API ``instructions`` and ``input``.
+
+    With a ``policy``, the history is first trimmed to its token budget;
+    ``context`` then reports what was trimmed (None when nothing was).
+    """
+    context: Optional[Dict[str, Any]] = None
+    if policy is not None:
+        messages, context = fit_messages(messages, policy)
     system_parts: List[str] = []
     input_messages: List[Dict[str, Any]] = []
 
@@ -93,6 +137,7 @@ def convert_messages(messages: List[Dict[str, Any]]) -> Dict[str, Any]:
             continue
         normalized_role = str(role)
         if normalized_role == "assistant":
+            input_messages.extend(_reasoning_items(msg.get("reasoning_details")))
             input_messages.append(
                 {
                     "type": "message",
@@ -106,7 +151,7 @@ def convert_messages(messages: List[Dict[str, Any]]) -> Dict[str, Any]:
             input_messages.append({"role": normalized_role, "content": _content_to_parts(content, normalized_role)})
 
     instructions = "\n".join([part for part in system_parts if part]) if system_parts else None
-    return {"instructions": instructions, "input": input_messages}
+    return {"instructions": instructions, "input": input_messages, "context": context}
 
 
 def convert_tools(tools: Optional[List[Dict[str, Any]]]) -> Optional[List[Dict[str, Any]]]:
@@ -128,6 +173,38 @@ def convert_tools(tools: Optional[List[Dict[str, Any]]]) -> Optional[List[Dict[s
     return converted or None
 
 
+def _output_limiter(stop: Optional[Union[str, List[str]]], max_tokens: Optional[int]) -> Optional[OutputLimiter]:
+    if isinstance(stop, str):
+        stop = [stop]
+    if stop is not None and (not isinstance(stop, list) or not all(isinstance(item, str) for item in stop)):
+        raise ValueError("stop must be a string or a list of strings")
+    if max_tokens is not None and (isinstance(max_tokens, bool) or not isinstance(max_tokens, int) or max_tokens < 1):
+        raise ValueError("max_tokens must be a positive integer")
+    if not any(stop or []) and max_tokens is None:
+        return None
+    return OutputLimiter(stop or [], max_tokens)
+
+
+def server_client(
+    base_url: str = "http://127.0.0.1:1455",
+    *,
+    uds: Optional[str] = None,
+    api_key: Optional[str] = None,
+    **kwargs: Any,
+) -> httpx.AsyncClient:
+    """An AsyncClient for a running ``claw-codex serve``, over its Unix socket when ``uds`` is set.
+
+    Over a socket, ``base_url`` only supplies the Host header and paths. Extra
+    keyword arguments go to ``httpx.AsyncClient``.
+    """
+    headers = dict(kwargs.pop("headers", None) or {})
+    if api_key:
+        headers["Authorization"] = f"Bearer {api_key}"
+    kwargs.setdefault("timeout", None)
+    transport = httpx.AsyncHTTPTransport(uds=uds, limits=kwargs.pop("limits", httpx.Limits())) if uds else None
+    return httpx.AsyncClient(base_url=base_url, headers=headers, transport=transport, **kwargs)
+
+
 class AsyncClawCodexClient:
     def __init__(
         self,
@@ -137,12 +214,80 @@ class AsyncClawCodexClient:
         model: str = DEFAULT_MODEL,
         originator: str = ORIGINATOR,
         mock_mode: Optional[bool] = None,
+        http_client: Optional[httpx.AsyncClient] = None,
+        timeouts: Optional[CodexTimeouts] = None,
+        context: Optional[ContextPolicy] = None,
+        models: Optional[ModelRouter] = None,
+        hooks: Optional[ClientHooks] = None,
     ) -> None:
         self.auth_file = Path(auth_file) if auth_file else AUTH_FILE
         self.pkce_file = Path(pkce_file) if pkce_file else PKCE_FILE
         self.model = model
         self.originator = originator
         self.mock_mode = MOCK_MODE if mock_mode is None else mock_mode
+        # None means each call opens a one-off connection; warmup() creates a pooled client.
+        self.http_client = http_client
+        # Upstream phase limits; None leaves calls unbounded, as they were before limits existed.
+        self.timeouts = timeouts
+        # Trims message histories to an input token budget before they are sent.
+        self.context = context
+        # Model aliases and the upstream model, reasoning effort and verbosity each selects.
+        self.models = models or ModelRouter()
+        # Instrumentation callbacks; None skips tracing entirely.
+        self.hooks = hooks
+        self._owns_http_client = False
+        self._warmer: Optional[ConnectionWarmer] = None
+        self.inflight = InFlightRegistry()
+
+    async def __aenter__(self) -> "AsyncClawCodexClient":
+        return self
+
+    async def __aexit__(self, *exc_info: Any) -> None:
+        await self.aclose()
+
+    async def warmup(
+        self,
+        connections: int = 2,
+        *,
+        keep_warm: bool = False,
+        interval: float = 20.0,
+        dns_cache_seconds: float = 300.0,
+    ) -> int:
+        """Pre-resolve DNS and pre-open pooled connections to the Codex and token endpoints.
+
+        Creates a pooled client if none was passed in; ``keep_warm`` re-warms it
+        in the background after idle periods until ``aclose()``. Returns the
+        number of connections that answered.
+        """
+        if self.mock_mode:
+            return 0
+        dns_cache = DNSCache(dns_cache_seconds) if dns_cache_seconds > 0 else None
+        if self.http_client is None:
+            self.http_client = create_pooled_client(dns_cache=dns_cache)
+            self._owns_http_client = True
+        warmer = ConnectionWarmer(
+            self.http_client, {CODEX_ORIGIN: connections, TOKEN_ORIGIN: 1}, interval=interval, dns_cache=dns_cache
+        )
+        warmed = await warmer.warm()
+        if keep_warm and self._warmer is None:
+            self.http_client.event_hooks["request"].append(warmer.mark_active)
+            await warmer.mark_active()
+            self._warmer = warmer
+            warmer.start()
+        return warmed
+
+    async def cancel(self, completion_id: str) -> bool:
+        """Abort an in-flight completion started by this client; False if it is not running."""
+        return self.inflight.cancel(completion_id)
+
+    async def aclose(self) -> None:
+        if self._warmer is not None:
+            await self._warmer.close()
+            self._warmer = None
+        if self._owns_http_client and self.http_client is not None:
+            await self.http_client.aclose()
+            self.http_client = None
+            self._owns_http_client = False
 
     def auth_status(self) -> Dict[str, Any]:
         creds = load_credentials(path=self.auth_file)
@@ -178,7 +323,9 @@ class AsyncClawCodexClient:
 
         # Use provided redirect_uri, or fall back to the one stored with PKCE state, or use default
         effective_redirect_uri = redirect_uri or pkce.redirect_uri or REDIRECT_URI
-        creds = await exchange_authorization_code(code, pkce.verifier, redirect_uri=effective_redirect_uri)
+        creds = await exchange_authorization_code(
+            code, pkce.verifier, redirect_uri=effective_redirect_uri, http_client=self.http_client
+        )
         save_credentials(creds, path=self.auth_file)
         return creds
 
@@ -186,12 +333,17 @@ class AsyncClawCodexClient:
         creds = load_credentials(path=self.auth_file)
         if not creds:
             raise RuntimeError("No credentials to refresh")
+        return await self._refresh(creds)
+
+    async def _refresh(self, stale: OAuthCredentials) -> OAuthCredentials:
         if self.mock_mode:
             refreshed = _mock_credentials()
-        else:
-            refreshed = await refresh_access_token(creds.refresh)
-        save_credentials(refreshed, path=self.auth_file)
-        return refreshed
+            save_credentials(refreshed, path=self.auth_file)
+            return refreshed
+        return await refresh_credentials_locked(self._refresh_grant, path=self.auth_file, stale=stale)
+
+    async def _refresh_grant(self, creds: OAuthCredentials) -> OAuthCredentials:
+        return await refresh_access_token(creds.refresh, http_client=self.http_client)
 
     async def ensure_credentials(self, *, auto_refresh: bool = True) -> OAuthCredentials:
         creds = load_credentials(path=self.auth_file)
@@ -201,44 +353,108 @@ class AsyncClawCodexClient:
             return creds
         if not auto_refresh:
             raise RuntimeError("Codex OAuth credentials expired; refresh required")
-        return await self.refresh()
+        return await self._refresh(creds)
 
-    async def chat_completions(
+    def _prepare(
         self,
-        *,
         messages: List[Dict[str, Any]],
-        model: str = "claw/codex",
-        temperature: Optional[float] = None,
-        tools: Optional[List[Dict[str, Any]]] = None,
-        tool_choice: Optional[Any] = None,
-        session_id: Optional[str] = None,
-    ) -> Dict[str, Any]:
-        if model not in SUPPORTED_MODELS:
-            raise ValueError("Unsupported model. Use claw/codex")
+        model: str,
+        temperature: Optional[float],
+        tools: Optional[List[Dict[str, Any]]],
+        tool_choice: Optional[Any],
+        session_id: Optional[str],
+        stop: Optional[Union[str, List[str]]],
+        max_tokens: Optional[int],
+    ) -> Tuple[Dict[str, Any], Optional[OutputLimiter], Optional[Dict[str, Any]]]:
+        """Validate a chat call; returns its upstream body, output limiter and context-trimming report."""
+        route = self.models.resolve(model)
+        if route is None:
+            raise ValueError("Unsupported model. Use claw/codex or one of client.models.routes()")
         if not isinstance(messages, list):
             raise ValueError("messages must be an array")
+        limiter = _output_limiter(stop, max_tokens)
 
-        converted = convert_messages(messages)
+        converted = convert_messages(messages, self.context)
         body = build_request_body(
-            model=self.model,
+            model=route.model or self.model,
             instructions=converted["instructions"],
             input_messages=converted["input"],
             temperature=temperature,
             tools=convert_tools(tools),
             tool_choice=tool_choice,
             session_id=session_id,
+            reasoning_effort=route.effort,
+            verbosity=route.verbosity,
         )
+        return body, limiter, converted["context"]
 
-        creds = await self.ensure_credentials(auto_refresh=True)
-        completion_id = f"chatcmpl_{uuid.uuid4().hex}"
-        created = int(time.time())
-        text, usage, finish_reason = await collect_codex_response(
-            creds.access,
-            creds.account_id,
-            body,
-            session_id=session_id,
-            mock_mode=self.mock_mode,
-        )
+    async def chat_completions(
+        self,
+        *,
+        messages: List[Dict[str, Any]],
+        model: str = "claw/codex",
+        temperature: Optional[float] = None,
+        tools: Optional[List[Dict[str, Any]]] = None,
+        tool_choice: Optional[Any] = None,
+        session_id: Optional[str] = None,
+        completion_id: Optional[str] = None,
+        stop: Optional[Union[str, List[str]]] = None,
+        max_tokens: Optional[int] = None,
+    ) -> Dict[str, Any]:
+        """Run a completion to the end; ``cancel(completion_id)`` from another task raises CompletionCancelled.
+
+        ``stop`` and ``max_tokens`` are enforced locally: the generation is cut
+        off as soon as either trips, with ``finish_reason`` ``stop``/``length``.
+        """
+        completion_id = completion_id or f"chatcmpl_{uuid.uuid4().hex}"
+        hooks = self.hooks
+        trace = CallTrace(completion_id, model, stream=False) if hooks is not None else None
+        try:
+            body, limiter, context = self._prepare(
+                messages, model, temperature, tools, tool_choice, session_id, stop, max_tokens
+            )
+            if trace is not None:
+                trace.body = body
+                hooks.fire("request_built", trace)
+
+            creds = await self.ensure_credentials(auto_refresh=True)
+            if trace is not None:
+                trace.account_id = creds.account_id
+                hooks.fire("credentials", trace)
+            entry = self.inflight.register(InFlight(completion_id, session_id=session_id))
+            created = int(time.time())
+            reasoning: List[Dict[str, Any]] = []
+            try:
+                text, usage, finish_reason = await collect_codex_response(
+                    creds.access,
+                    creds.account_id,
+                    body,
+                    session_id=session_id,
+                    mock_mode=self.mock_mode,
+                    http_client=self.http_client,
+                    timeouts=self.timeouts,
+                    abort=entry.abort,
+                    on_event=functools.partial(hooks.event, trace) if trace is not None else None,
+                    limiter=limiter,
+                    reasoning=reasoning,
+                    on_connect=functools.partial(hooks.fire, "connect", trace) if trace is not None else None,
+                )
+            finally:
+                self.inflight.unregister(entry)
+            if entry.cancelled:
+                raise CompletionCancelled(completion_id)
+        except BaseException as exc:
+            if trace is not None:
+                hooks.fail(trace, exc)
+            raise
+        if trace is not None:
+            trace.usage = usage
+            trace.finish_reason = finish_reason or "stop"
+            hooks.fire("complete", trace)
+        message: Dict[str, Any] = {"role": "assistant", "content": text}
+        if reasoning:
+            # Send the message back as-is in the next turn to carry the reasoning over.
+            message["reasoning_details"] = reasoning
         return {
             "id": completion_id,
             "object": "chat.completion",
@@ -247,11 +463,12 @@ class AsyncClawCodexClient:
             "choices": [
                 {
                     "index": 0,
-                    "message": {"role": "assistant", "content": text},
+                    "message": message,
                     "finish_reason": finish_reason or "stop",
                 }
             ],
             "usage": usage,
+            **({"context": context} if context is not None else {}),
         }
 
     async def stream_chat_completions(
@@ -263,66 +480,116 @@ class AsyncClawCodexClient:
         tools: Optional[List[Dict[str, Any]]] = None,
         tool_choice: Optional[Any] = None,
         session_id: Optional[str] = None,
+        completion_id: Optional[str] = None,
+        stop: Optional[Union[str, List[str]]] = None,
+        max_tokens: Optional[int] = None,
+        stream_options: Optional[Dict[str, Any]] = None,
     ) -> AsyncGenerator[Dict[str, Any], None]:
-        if model not in SUPPORTED_MODELS:
-            raise ValueError("Unsupported model. Use claw/codex")
-        if not isinstance(messages, list):
-            raise ValueError("messages must be an array")
-
-        converted = convert_messages(messages)
-        body = build_request_body(
-            model=self.model,
-            instructions=converted["instructions"],
-            input_messages=converted["input"],
-            temperature=temperature,
-            tools=convert_tools(tools),
-            tool_choice=tool_choice,
-            session_id=session_id,
-        )
-
-        creds = await self.ensure_credentials(auto_refresh=True)
-        completion_id = f"chatcmpl_{uuid.uuid4().hex}"
-        created = int(time.time())
-        sent_role = False
-        async for event in iter_codex_events(
-            creds.access,
-            creds.account_id,
-            body,
-            session_id=session_id,
-            mock_mode=self.mock_mode,
-        ):
-            event_type = event.get("type")
-            if event_type == "response.output_text.delta":
-                delta = event.get("delta")
-                if isinstance(delta, str):
-                    if not sent_role:
-                        sent_role = True
-                        yield {
-                            "id": completion_id,
-                            "object": "chat.completion.chunk",
-                            "created": created,
-                            "model": model,
-                            "choices": [{"index": 0, "delta": {"role": "assistant"}, "finish_reason": None}],
-                        }
-                    yield {
-                        "id": completion_id,
-                        "object": "chat.completion.chunk",
-                        "created": created,
-                        "model": model,
-                        "choices": [{"index": 0, "delta": {"content": delta}, "finish_reason": None}],
-                    }
-            elif event_type == "response.completed":
-                yield {
+        """Yield chat chunks; after ``cancel(completion_id)`` the stream ends with finish_reason ``cancelled``.
+
+        ``stream_options`` works as on the server: ``include_usage`` ends the
+        stream with a usage chunk, ``include_timing`` adds ``timing``.
+        """
+        include_usage = bool((stream_options or {}).get("include_usage"))
+        include_timing = bool((stream_options or {}).get("include_timing"))
+        completion_id = completion_id or f"chatcmpl_{uuid.uuid4().hex}"
+        hooks = self.hooks
+        trace = CallTrace(completion_id, model, stream=True) if hooks is not None else None
+        try:
+            body, limiter, _ = self._prepare(
+                messages, model, temperature, tools, tool_choice, session_id, stop, max_tokens
+            )
+            if trace is not None:
+                trace.body = body
+                hooks.fire("request_built", trace)
+
+            creds = await self.ensure_credentials(auto_refresh=True)
+            if trace is not None:
+                trace.account_id = creds.account_id
+                hooks.fire("credentials", trace)
+            entry = self.inflight.register(InFlight(completion_id, session_id=session_id))
+            created = int(time.time())
+            usage: Dict[str, int] = {}
+
+            def chunk(delta: Optional[Dict[str, Any]], finish_reason: Optional[str] = None) -> Dict[str, Any]:
+                data: Dict[str, Any] = {
                     "id": completion_id,
                     "object": "chat.completion.chunk",
                     "created": created,
                     "model": model,
-                    "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}],
+                    "choices": [] if delta is None else [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
                 }
-            elif event_type == "error":
-                raise RuntimeError(f"Codex error: {event}")
-            elif event_type == "response.failed":
-                raise RuntimeError("Codex response failed")
+                if include_usage:
+                    data["usage"] = usage if delta is None else None
+                if include_timing:
+                    now = time.monotonic()
+                    data["timing"] = (
+                        entry.timing(now, usage.get("completion_tokens", 0))
+                        if delta is None
+                        else {"upstream_ms": entry.upstream_ms(now)}
+                    )
+                return data
+
+            sent_role = False
+            events = iter_codex_events(
+                creds.access,
+                creds.account_id,
+                body,
+                session_id=session_id,
+                mock_mode=self.mock_mode,
+                http_client=self.http_client,
+                timeouts=self.timeouts,
+                abort=entry.abort,
+                on_connect=functools.partial(hooks.fire, "connect", trace) if trace is not None else None,
+            )
+            if limiter is not None:
+                events = limit_output(events, limiter, estimate_input_tokens(body))
+            try:
+                async for event in events:
+                    if trace is not None:
+                        hooks.event(trace, event)
+                    event_type = event.get("type")
+                    chunk_delta: Optional[Dict[str, Any]] = None
+                    if event_type == "response.output_text.delta":
+                        delta = event.get("delta")
+                        if isinstance(delta, str):
+                            entry.record_delta()
+                            chunk_delta = {"content": delta}
+                    elif event_type == "response.output_item.done":
+                        detail = reasoning_detail(event)
+                        if detail is not None:
+                            chunk_delta = {"reasoning_details": [detail]}
+                    if chunk_delta is not None:
+                        if not sent_role:
+                            sent_role = True
+                            yield chunk({"role": "assistant"})
+                        yield chunk(chunk_delta)
+                    elif event_type == "response.completed":
+                        response = event.get("response") or {}
+                        finish_reason = response_finish_reason(response)
+                        usage = parse_usage(response)
+                        if trace is not None:
+                            trace.usage = usage
+                            trace.finish_reason = finish_reason
+                        yield chunk({}, finish_reason)
+                    elif event_type == "error":
+                        raise RuntimeError(f"Codex error: {event}")
+                    elif event_type == "response.failed":
+                        raise RuntimeError("Codex response failed")
+            finally:
+                self.inflight.unregister(entry)
+            if entry.cancelled:
+                if trace is not None:
+                    trace.finish_reason = "cancelled"
+                yield chunk({}, "cancelled")
+            elif include_usage or include_timing:
+                yield chunk(None)
+        except BaseException as exc:
+            if trace is not None:
+                hooks.fail(trace, exc)
+            raise
+        if trace is not None:
+            hooks.fire("complete", trace)
 
 
 class ClawCodexClient:
@@ -334,6 +601,8 @@ class ClawCodexClient:
         model: str = DEFAULT_MODEL,
         originator: str = ORIGINATOR,
         mock_mode: Optional[bool] = None,
+        context: Optional[ContextPolicy] = None,
+        hooks: Optional[ClientHooks] = None,
     ) -> None:
         self._client = AsyncClawCodexClient(
             auth_file=auth_file,
@@ -341,6 +610,8 @@ class ClawCodexClient:
             model=model,
             originator=originator,
             mock_mode=mock_mode,
+            context=context,
+            hooks=hooks,
         )
 
     @property
@@ -379,6 +650,8 @@ class ClawCodexClient:
         tools: Optional[List[Dict[str, Any]]] = None,
         tool_choice: Optional[Any] = None,
         session_id: Optional[str] = None,
+        stop: Optional[Union[str, List[str]]] = None,
+        max_tokens: Optional[int] = None,
     ) -> Dict[str, Any]:
         return self._run(
             self._client.chat_completions(
@@ -388,5 +661,7 @@ class ClawCodexClient:
                 tools=tools,
                 tool_choice=tool_choice,
                 session_id=session_id,
+                stop=stop,
+                max_tokens=max_tokens,
             )
         )
@@ -1,10 +1,131 @@
+import asyncio
 import json
 import platform
-from typing import Any, AsyncGenerator, Dict, List, Optional, Tuple
+import time
+from contextlib import AsyncExitStack
+from dataclasses import dataclass
+from typing import (
+    Any,
+    AsyncGenerator,
+    AsyncIterator,
+    Awaitable,
+    Callable,
+    Dict,
+    List,
+    Optional,
+    Sequence,
+    Tuple,
+    TypeVar,
+)
 
 import httpx
 
+from .breaker import CircuitBreaker
 from .config import CODEX_URL, MOCK_MODE
+from .context import estimate_tokens
+
+T = TypeVar("T")
+
+_COMPLETED_MARKER = b'"response.completed"'
+# ``format`` of the reasoning_details entries carrying Responses API encrypted reasoning.
+REASONING_FORMAT = "openai-responses-v1"
+
+
+class CodexHTTPError(RuntimeError):
+    def __init__(self, status_code: int, text: str) -> None:
+        super().__init__(f"Codex request failed: {status_code} {text}")
+        self.status_code = status_code
+
+
+class CodexTimeoutError(RuntimeError):
+    """An upstream call ran out of time; ``phase`` says which limit fired.
+
+    Phases are ``connect``, ``first_event``, ``idle``, ``total`` and
+    ``deadline`` (the caller's own deadline was the tighter bound).
+    """
+
+    def __init__(self, phase: str, seconds: float) -> None:
+        super().__init__(f"Codex upstream timed out ({phase} after {seconds:.3g}s)")
+        self.phase = phase
+        self.seconds = seconds
+
+
+def is_upstream_failure(exc: BaseException) -> bool:
+    """Whether an error says the upstream is unhealthy, as opposed to a bad request."""
+    if isinstance(exc, CodexHTTPError):
+        return exc.status_code >= 500 or exc.status_code == 429
+    if isinstance(exc, CodexTimeoutError):
+        # A caller asking for an answer faster than the upstream can give says nothing about its health.
+        return exc.phase != "deadline"
+    return isinstance(exc, (httpx.TransportError, RuntimeError))
+
+
+@dataclass
+class CodexTimeouts:
+    """Per-phase limits in seconds for one upstream call; None disables a phase.
+
+    ``first_event`` runs from the start of the call, ``idle`` between events
+    and ``total`` over the whole call.
+    """
+
+    connect: Optional[float] = 10.0
+    first_event: Optional[float] = 60.0
+    idle: Optional[float] = 120.0
+    total: Optional[float] = 900.0
+
+
+class PhaseBudget:
+    """Tracks the phase limits of one call against an optional absolute deadline (``time.monotonic()``)."""
+
+    def __init__(self, timeouts: Optional[CodexTimeouts] = None, deadline: Optional[float] = None) -> None:
+        self.timeouts = timeouts or CodexTimeouts()
+        self.started = time.monotonic()
+        total = self.timeouts.total
+        self.total_at = self.started + total if total is not None else None
+        self.deadline = deadline
+        self.seen_event = False
+
+    def _next(self, phase: str, limit: Optional[float]) -> Tuple[Optional[float], str]:
+        now = time.monotonic()
+        bounds = []
+        if limit is not None:
+            bounds.append((limit, phase))
+        if self.total_at is not None:
+            bounds.append((self.total_at - now, "total"))
+        if self.deadline is not None:
+            bounds.append((self.deadline - now, "deadline"))
+        if not bounds:
+            return None, phase
+        return min(bounds)
+
+    def next_wait(self) -> Tuple[Optional[float], str]:
+        """Seconds the next event may take, and the phase whose limit that is."""
+        if self.seen_event:
+            return self._next("idle", self.timeouts.idle)
+        return self._next("first_event", self.timeouts.first_event)
+
+    def connect_wait(self) -> Tuple[Optional[float], str]:
+        return self._next("connect", self.timeouts.connect)
+
+    def expired(self, phase: str) -> CodexTimeoutError:
+        if phase in {"first_event", "idle", "connect"}:
+            seconds = getattr(self.timeouts, phase)
+        else:
+            seconds = time.monotonic() - self.started
+        return CodexTimeoutError(phase, seconds)
+
+
+async def within_budget(budget: Optional[PhaseBudget], awaitable: Awaitable[T], *, connect: bool = False) -> T:
+    """Await ``awaitable`` within the budget's next limit, raising CodexTimeoutError when it fires."""
+    if budget is None:
+        return await awaitable
+    wait, phase = budget.connect_wait() if connect else budget.next_wait()
+    if wait is None:
+        return await awaitable
+    try:
+        return await asyncio.wait_for(awaitable, max(wait, 0.0))
+    except asyncio.TimeoutError:
+        raise budget.expired(phase) from None
 
 
 def build_headers(access_token: str, account_id: str, session_id: Optional[str] = None) -> Dict[str, str]:
@@ -30,6 +151,8 @@ def build_request_body(
     tools: Optional[List[Dict[str, Any]]],
     tool_choice: Optional[Any],
     session_id: Optional[str],
+    reasoning_effort: Optional[str] = None,
+    verbosity: str = "medium",
 ) -> Dict[str, Any]:
     body: Dict[str, Any] = {
         "model": model,
@@ -37,7 +160,7 @@ def build_request_body(
         "stream": True,
         "instructions": instructions,
         "input": input_messages,
-        "text": {"verbosity": "medium"},
+        "text": {"verbosity": verbosity},
         "include": ["reasoning.encrypted_content"],
         "prompt_cache_key": session_id,
         "tool_choice": "auto",
@@ -45,6 +168,8 @@ def build_request_body(
     }
     if temperature is not None:
         body["temperature"] = temperature
+    if reasoning_effort is not None:
+        body["reasoning"] = {"effort": reasoning_effort}
     if tools:
         body["tools"] = tools
     if tool_choice is not None:
@@ -52,43 +177,416 @@ def build_request_body(
     return body
 
 
+async def _until_aborted(
+    source: AsyncIterator[T], abort: Optional[asyncio.Event], budget: Optional[PhaseBudget] = None
+) -> AsyncGenerator[T, None]:
+    """Relay items from source, stopping as soon as abort is set, even mid-read.
+
+    With a ``budget``, an item that does not arrive within the current phase
+    limit raises CodexTimeoutError.
+    """
+    if abort is None and budget is None:
+        async for item in source:
+            yield item
+        return
+
+    abort_wait = asyncio.ensure_future(abort.wait()) if abort is not None else None
+    step: Optional["asyncio.Future[T]"] = None
+    try:
+        while abort is None or not abort.is_set():
+            wait, phase = budget.next_wait() if budget is not None else (None, "")
+            step = asyncio.ensure_future(source.__anext__())
+            waiters = {step} if abort_wait is None else {step, abort_wait}
+            done, _ = await asyncio.wait(
+                waiters,
+                timeout=None if wait is None else max(wait, 0.0),
+                return_when=asyncio.FIRST_COMPLETED,
+            )
+            if step not in done:
+                step.cancel()
+                await asyncio.wait({step})
+                if abort is not None and abort.is_set():
+                    return
+                raise budget.expired(phase)
+            try:
+                item = step.result()
+            except StopAsyncIteration:
+                return
+            if budget is not None:
+                budget.seen_event = True
+            yield item
+    finally:
+        if abort_wait is not None:
+            abort_wait.cancel()
+        # Cancelled mid-read: the source stays "already running" until its pending step ends.
+        if step is not None and not step.done():
+            step.cancel()
+            await asyncio.wait({step})
+
+
+async def _guarded_by(
+    breaker: CircuitBreaker, events: AsyncGenerator[Dict[str, Any], None]
+) -> AsyncGenerator[Dict[str, Any], None]:
+    call = breaker.start_call()
+    try:
+        async for event in events:
+            call.mark_first_event()
+            if event.get("type") in {"error", "response.failed"}:
+                call.ok = False
+            yield event
+        if call.ok is None:
+            call.ok = True
+    except Exception as exc:
+        if is_upstream_failure(exc):
+            call.ok = False
+        raise
+    finally:
+        await events.aclose()
+        call.finish()
+
+
 async def iter_codex_events(
     access_token: str,
     account_id: str,
     body: Dict[str, Any],
     session_id: Optional[str] = None,
     mock_mode: Optional[bool] = None,
+    abort: Optional[asyncio.Event] = None,
+    http_client: Optional[httpx.AsyncClient] = None,
+    breaker: Optional[CircuitBreaker] = None,
+    timeouts: Optional[CodexTimeouts] = None,
+    deadline: Optional[float] = None,
+    on_connect: Optional[Callable[[], None]] = None,
 ) -> AsyncGenerator[Dict[str, Any], None]:
+    """Yield parsed Codex SSE events.
+
+    Setting ``abort`` ends the iteration promptly and closes the upstream
+    connection, so callers can stop paying for a generation nobody reads.
+    Pass ``http_client`` to reuse a pooled client; otherwise a one-off client
+    is opened for this request. With a ``breaker`` the call fails fast with
+    CircuitOpenError while the upstream is considered unhealthy. ``timeouts``
+    and ``deadline`` (a ``time.monotonic()`` instant) bound the call; when one
+    fires, CodexTimeoutError is raised. ``on_connect`` is called once the
+    upstream response headers are in.
+    """
+    if breaker is not None:
+        events = iter_codex_events(
+            access_token,
+            account_id,
+            body,
+            session_id=session_id,
+            mock_mode=mock_mode,
+            abort=abort,
+            http_client=http_client,
+            timeouts=timeouts,
+            deadline=deadline,
+            on_connect=on_connect,
+        )
+        async for event in _guarded_by(breaker, events):
+            yield event
+        return
+
+    budget = PhaseBudget(timeouts, deadline) if timeouts is not None or deadline is not None else None
     use_mock_mode = MOCK_MODE if mock_mode is None else mock_mode
     if use_mock_mode:
-        async for event in _mock_codex_events(body):
+        if on_connect is not None:
+            on_connect()
+        async for event in _until_aborted(_mock_codex_events(body), abort, budget):
             yield event
         return
 
     headers = build_headers(access_token, account_id, session_id)
-    async with httpx.AsyncClient(timeout=None) as client:
-        async with client.stream("POST", CODEX_URL, headers=headers, json=body) as resp:
-            if resp.status_code >= 400:
-                text = await resp.aread()
-                raise RuntimeError(f"Codex request failed: {resp.status_code} {text.decode('utf-8', 'ignore')}")
-
-            buffer = ""
-            async for chunk in resp.aiter_text():
-                buffer += chunk
-                while "\n\n" in buffer:
-                    part, buffer = buffer.split("\n\n", 1)
-                    data_lines = [line[5:].strip() for line in part.split("\n") if line.startswith("data:")]
-                    if not data_lines:
-                        continue
-                    data = "\n".join(data_lines).strip()
-                    if not data or data == "[DONE]":
-                        continue
-                    try:
-                        event = json.loads(data)
-                    except Exception:
-                        continue
-                    if isinstance(event, dict):
-                        yield event
+    async with AsyncExitStack() as stack:
+        client = http_client or await stack.enter_async_context(httpx.AsyncClient(timeout=None))
+        request = client.build_request("POST", CODEX_URL, headers=headers, json=body)
+        resp = await _send(client, request, budget)
+        stack.push_async_callback(resp.aclose)
+        if on_connect is not None:
+            on_connect()
+        if resp.status_code >= 400:
+            text = await resp.aread()
+            raise CodexHTTPError(resp.status_code, text.decode("utf-8", "ignore"))
+
+        buffer = ""
+        async for chunk in _until_aborted(resp.aiter_text(), abort, budget):
+            buffer += chunk
+            while "\n\n" in buffer:
+                part, buffer = buffer.split("\n\n", 1)
+                data_lines = [line[5:].strip() for line in part.split("\n") if line.startswith("data:")]
+                if not data_lines:
+                    continue
+                data = "\n".join(data_lines).strip()
+                if not data or data == "[DONE]":
+                    continue
+                try:
+                    event = json.loads(data)
+                except Exception:
+                    continue
+                if isinstance(event, dict):
+                    yield event
+
+
+async def _send(client: httpx.AsyncClient, request: httpx.Request, budget: Optional[PhaseBudget]) -> httpx.Response:
+    """Send with streaming, holding connection setup and response headers to the budget."""
+    if budget is None:
+        return await client.send(request, stream=True)
+    connect_wait, connect_phase = budget.connect_wait()
+    if connect_wait is not None:
+        connect_wait = max(connect_wait, 0.0)
+        request.extensions["timeout"] = httpx.Timeout(None, connect=connect_wait, pool=connect_wait).as_dict()
+    try:
+        return await within_budget(budget, client.send(request, stream=True))
+    except (httpx.ConnectTimeout, httpx.PoolTimeout):
+        raise budget.expired(connect_phase) from None
+
+
+async def open_codex_stream(
+    access_token: str,
+    account_id: str,
+    content: bytes,
+    http_client: httpx.AsyncClient,
+    session_id: Optional[str] = None,
+    budget: Optional[PhaseBudget] = None,
+) -> httpx.Response:
+    """Send an already-serialized Responses API body upstream and return the open stream.
+
+    The caller owns the response and must ``aclose()`` it. Pass the same
+    ``budget`` to ``_until_aborted`` when relaying the body.
+    """
+    headers = build_headers(access_token, account_id, session_id)
+    request = http_client.build_request("POST", CODEX_URL, headers=headers, content=content)
+    return await _send(http_client, request, budget)
+
+
+async def merge_event_streams(
+    streams: List[AsyncGenerator[Dict[str, Any], None]],
+) -> AsyncGenerator[Tuple[int, Dict[str, Any]], None]:
+    """Interleave event streams as ``(index, event)`` pairs in arrival order.
+
+    Each stream is drained by its own task, a few events ahead at most. The
+    first error from any stream is re-raised here; closing the merged stream
+    cancels and closes every source.
+    """
+    if len(streams) == 1:
+        try:
+            async for event in streams[0]:
+                yield 0, event
+        finally:
+            await streams[0].aclose()
+        return
+
+    queue: "asyncio.Queue[Tuple[int, Any]]" = asyncio.Queue(maxsize=len(streams))
+    finished = object()
+
+    async def pump(index: int, stream: AsyncGenerator[Dict[str, Any], None]) -> None:
+        try:
+            async for event in stream:
+                await queue.put((index, event))
+        except Exception as exc:
+            await queue.put((index, exc))
+        else:
+            await queue.put((index, finished))
+
+    tasks = [asyncio.create_task(pump(index, stream)) for index, stream in enumerate(streams)]
+    try:
+        running = len(tasks)
+        while running:
+            index, item = await queue.get()
+            if item is finished:
+                running -= 1
+            elif isinstance(item, Exception):
+                raise item
+            else:
+                yield index, item
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        for stream in streams:
+            await stream.aclose()
+
+
+def sum_usage(usages: List[Dict[str, int]]) -> Dict[str, int]:
+    total: Dict[str, int] = {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0}
+    for usage in usages:
+        for key, value in usage.items():
+            total[key] = total.get(key, 0) + value
+    return total
+
+
+def parse_usage(response: Dict[str, Any]) -> Dict[str, int]:
+    usage_obj = response.get("usage") or {}
+    return {
+        "prompt_tokens": int(usage_obj.get("input_tokens", 0)),
+        "completion_tokens": int(usage_obj.get("output_tokens", 0)),
+        "total_tokens": int(usage_obj.get("total_tokens", 0)),
+    }
+
+
+class CompletedEventSniffer:
+    """Spot ``response.completed`` in raw SSE bytes without decoding any other event."""
+
+    def __init__(self) -> None:
+        self._pending: List[bytes] = []
+        self.response: Optional[Dict[str, Any]] = None
+
+    def feed(self, chunk: bytes) -> None:
+        if self.response is not None:
+            return
+        straddles = chunk[:1] == b"\n" and bool(self._pending) and self._pending[-1][-1:] == b"\n"
+        if b"\n\n" not in chunk and not straddles:
+            self._pending.append(chunk)
+            return
+        data = b"".join(self._pending) + chunk if self._pending else chunk
+        cut = data.rfind(b"\n\n")
+        frames = data[:cut]
+        self._pending = [data[cut + 2 :]]
+        if _COMPLETED_MARKER not in frames:
+            return
+        for frame in frames.split(b"\n\n"):
+            if _COMPLETED_MARKER not in frame:
+                continue
+            payload = b"\n".join(line[5:].strip() for line in frame.split(b"\n") if line.startswith(b"data:"))
+            try:
+                event = json.loads(payload)
+            except ValueError:
+                continue
+            if isinstance(event, dict) and event.get("type") == "response.completed":
+                self.response = event.get("response") or {}
+                self._pending = []
+                return
+
+
+def reasoning_detail(event: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """The encrypted reasoning item finished by ``event``, as a chat ``reasoning_details`` entry.
+
+    With ``store: False`` upstream keeps no reasoning between calls; sending
+    these back in a later turn's ``input`` spares the model re-reasoning.
+    """
+    if event.get("type") != "response.output_item.done":
+        return None
+    item = event.get("item") or {}
+    if item.get("type") != "reasoning" or not item.get("encrypted_content"):
+        return None
+    return {
+        "type": "reasoning.encrypted",
+        "id": item.get("id"),
+        "format": REASONING_FORMAT,
+        "data": item["encrypted_content"],
+    }
+
+
+def response_finish_reason(response: Dict[str, Any]) -> str:
+    """Chat ``finish_reason`` for a completed Responses API response."""
+    if (response.get("incomplete_details") or {}).get("reason") == "max_output_tokens":
+        return "length"
+    return "stop"
+
+
+def estimate_input_tokens(body: Dict[str, Any]) -> int:
+    """Rough prompt size of a request body, for generations that end before upstream reports usage."""
+    texts = [body.get("instructions") or ""]
+    for item in body.get("input") or []:
+        content = item.get("content")
+        if isinstance(content, str):
+            texts.append(content)
+        elif isinstance(content, list):
+            texts.extend(str(part.get("text") or "") for part in content if isinstance(part, dict))
+    return sum(map(estimate_tokens, texts)) + 4 * len(body.get("input") or [])
+
+
+class OutputLimiter:
+    """Client-side ``stop`` sequences and output token cap over a stream of text deltas.
+
+    ``feed`` returns the text that can be released now. A tail that could be
+    the start of a stop sequence is held back until the next delta settles
+    it, so a stop sequence split across deltas is still caught and never
+    emitted. Output tokens are estimated locally. Once ``finish_reason`` is
+    set, the rest of the generation should be dropped.
+    """
+
+    def __init__(self, stop: Sequence[str] = (), max_tokens: Optional[int] = None) -> None:
+        self.stop = [sequence for sequence in stop if sequence]
+        self.max_tokens = max_tokens
+        self.tokens = 0
+        self.finish_reason: Optional[str] = None
+        self._held = ""
+        self._longest = max(map(len, self.stop), default=0)
+
+    def feed(self, delta: str) -> str:
+        if self.finish_reason is not None:
+            return ""
+        text = self._held + delta
+        self._held = ""
+        if self.stop:
+            cut = min((at for at in map(text.find, self.stop) if at >= 0), default=-1)
+            if cut >= 0:
+                text = self._cap(text[:cut])
+                self.finish_reason = self.finish_reason or "stop"
+                return text
+            for size in range(min(len(text), self._longest - 1), 0, -1):
+                if any(sequence.startswith(text[-size:]) for sequence in self.stop):
+                    self._held = text[-size:]
+                    text = text[:-size]
+                    break
+        return self._cap(text)
+
+    def flush(self) -> str:
+        """Release the held-back tail once the generation has ended on its own."""
+        text, self._held = self._held, ""
+        return self._cap(text) if self.finish_reason is None else ""
+
+    def _cap(self, text: str) -> str:
+        tokens = estimate_tokens(text)
+        if self.max_tokens is not None and tokens >= self.max_tokens - self.tokens:
+            remaining = self.max_tokens - self.tokens
+            text = text[: len(text) * remaining // tokens]
+            tokens = remaining
+            self.finish_reason = "length"
+        self.tokens += tokens
+        return text
+
+
+async def limit_output(
+    events: AsyncGenerator[Dict[str, Any], None], limiter: OutputLimiter, prompt_tokens: int = 0
+) -> AsyncGenerator[Dict[str, Any], None]:
+    """Apply ``limiter`` to the text deltas of a Codex event stream.
+
+    When it trips, the upstream stream is closed at once and a synthetic
+    ``response.completed`` ends this one. Upstream never reports usage for a
+    generation cut off early, so that event carries an estimate.
+    """
+    try:
+        async for event in events:
+            event_type = event.get("type")
+            if event_type == "response.output_text.delta" and isinstance(event.get("delta"), str):
+                text = limiter.feed(event["delta"])
+            elif event_type == "response.completed":
+                text = limiter.flush()
+            else:
+                yield event
+                continue
+            if text:
+                yield {**event, "type": "response.output_text.delta", "delta": text}
+            if limiter.finish_reason is not None:
+                break
+            if event_type == "response.completed":
+                yield event
+        else:
+            return
+    finally:
+        await events.aclose()
+    response: Dict[str, Any] = {
+        "status": "completed",
+        "usage": {
+            "input_tokens": prompt_tokens,
+            "output_tokens": limiter.tokens,
+            "total_tokens": prompt_tokens + limiter.tokens,
+        },
+    }
+    if limiter.finish_reason == "length":
+        response.update(status="incomplete", incomplete_details={"reason": "max_output_tokens"})
+    yield {"type": "response.completed", "response": response}
 
 
 async def collect_codex_response(
@@ -97,31 +595,55 @@ async def collect_codex_response(
     body: Dict[str, Any],
     session_id: Optional[str] = None,
     mock_mode: Optional[bool] = None,
+    http_client: Optional[httpx.AsyncClient] = None,
+    breaker: Optional[CircuitBreaker] = None,
+    timeouts: Optional[CodexTimeouts] = None,
+    deadline: Optional[float] = None,
+    abort: Optional[asyncio.Event] = None,
+    on_event: Optional[Callable[[Dict[str, Any]], None]] = None,
+    limiter: Optional[OutputLimiter] = None,
+    reasoning: Optional[List[Dict[str, Any]]] = None,
+    on_connect: Optional[Callable[[], None]] = None,
 ) -> Tuple[str, Dict[str, int], Optional[str]]:
+    """Run a generation to the end; a ``limiter`` ends it early on a stop sequence or token cap.
+
+    Encrypted reasoning items are appended to ``reasoning`` as ``reasoning_details`` entries.
+    """
     text_parts: List[str] = []
     usage: Dict[str, int] = {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0}
     finish_reason: Optional[str] = None
 
-    async for event in iter_codex_events(
+    events = iter_codex_events(
         access_token,
         account_id,
         body,
         session_id=session_id,
         mock_mode=mock_mode,
-    ):
+        http_client=http_client,
+        breaker=breaker,
+        timeouts=timeouts,
+        deadline=deadline,
+        abort=abort,
+        on_connect=on_connect,
+    )
+    if limiter is not None:
+        events = limit_output(events, limiter, estimate_input_tokens(body))
+    async for event in events:
+        if on_event is not None:
+            on_event(event)
         event_type = event.get("type")
         if event_type == "response.output_text.delta":
             delta = event.get("delta")
             if isinstance(delta, str):
                 text_parts.append(delta)
+        elif event_type == "response.output_item.done" and reasoning is not None:
+            detail = reasoning_detail(event)
+            if detail is not None:
+                reasoning.append(detail)
         elif event_type == "response.completed":
             response = event.get("response") or {}
-            status = response.get("status")
-            finish_reason = "stop" if status == "completed" else "stop"
-            usage_obj = response.get("usage") or {}
-            usage["prompt_tokens"] = int(usage_obj.get("input_tokens", 0))
-            usage["completion_tokens"] = int(usage_obj.get("output_tokens", 0))
-            usage["total_tokens"] = int(usage_obj.get("total_tokens", 0))
+            finish_reason = response_finish_reason(response)
+            usage = parse_usage(response)
         elif event_type == "error":
             raise RuntimeError(f"Codex error: {event}")
         elif event_type == "response.failed":
@@ -156,11 +678,6 @@ def _extract_last_user_text(body: Dict[str, Any]) -> str:
     return ""
 
 
-def _estimate_tokens(text: str) -> int:
-    words = [w for w in text.replace("\n", " ").split(" ") if w]
-    return max(1, len(words)) if text else 0
-
-
 async def _mock_codex_events(body: Dict[str, Any]) -> AsyncGenerator[Dict[str, Any], None]:
     user_text = _extract_last_user_text(body)
     if user_text:
@@ -168,12 +685,22 @@ async def _mock_codex_events(body: Dict[str, Any]) -> AsyncGenerator[Dict[str, A
     else:
         response_text = "Mock Codex response."
 
+    # Opaque stand-in for encrypted reasoning; it records how many reasoning items were carried in.
+    carried = sum(1 for item in body.get("input") or [] if item.get("type") == "reasoning")
+    yield {
+        "type": "response.output_item.done",
+        "item": {"type": "reasoning", "id": "rs_mock", "summary": [], "encrypted_content": f"mock:{carried}"},
+    }
     for i in range(0, len(response_text), 16):
         yield {"type": "response.output_text.delta", "delta": response_text[i : i + 16]}
 
-    usage = {
-        "input_tokens": _estimate_tokens(user_text),
-        "output_tokens": _estimate_tokens(response_text),
-        "total_tokens": _estimate_tokens(user_text) + _estimate_tokens(response_text),
-    }
+    input_tokens = estimate_tokens(user_text)
+    output_tokens = estimate_tokens(response_text)
+    usage = {"input_tokens": input_tokens, "output_tokens": output_tokens, "total_tokens": input_tokens + output_tokens}
     yield {"type": "response.completed", "response": {"status": "completed", "usage": usage}}
+
+
+async def mock_codex_sse(body: Dict[str, Any]) -> AsyncGenerator[bytes, None]:
+    """Mock upstream SSE bytes, framed the way the Codex backend frames them."""
+    async for event in _mock_codex_events(body):
+        yield f"event: {event['type']}\ndata: {json.dumps(event)}\n\n".encode("utf-8")
@@ -0,0 +1,199 @@
+import gzip
+import json
+import zlib
+from typing import Any, Dict, Optional
+
+from starlette.requests import Request
+from starlette.responses import Response
+
+try:  # Python 3.14+
+    from compression import zstd as _stdlib_zstd  # type: ignore[import-not-found]
+except ImportError:
+    _stdlib_zstd = None
+
+try:
+    import zstandard  # type: ignore[import-not-found]
+except ImportError:
+    zstandard = None
+
+_DECODE_ERRORS: tuple = (zlib.error, EOFError)
+if _stdlib_zstd is not None:
+    _DECODE_ERRORS += (_stdlib_zstd.ZstdError,)
+if zstandard is not None:
+    _DECODE_ERRORS += (zstandard.ZstdError,)
+
+# How much decompressed output zstandard hands over at a time; the size cap
+# is checked between these, so it is also how far a body can overshoot it.
+_ZSTD_WRITE_SIZE = 64 * 1024
+
+
+class BodyTooLarge(ValueError):
+    pass
+
+
+class UnsupportedEncoding(ValueError):
+    pass
+
+
+def zstd_available() -> bool:
+    return _stdlib_zstd is not None or zstandard is not None
+
+
+class _IdentityDecoder:
+    def feed(self, data: bytes, limit: int) -> bytes:
+        if len(data) > limit:
+            raise BodyTooLarge()
+        return data
+
+    def flush(self) -> bytes:
+        return b""
+
+
+class _ZlibDecoder:
+    def __init__(self, wbits: int) -> None:
+        self._obj = zlib.decompressobj(wbits)
+
+    def feed(self, data: bytes, limit: int) -> bytes:
+        out = self._obj.decompress(data, limit + 1)
+        if len(out) > limit:
+            raise BodyTooLarge()
+        return out
+
+    def flush(self) -> bytes:
+        out = self._obj.flush()
+        if not self._obj.eof:
+            raise EOFError("Compressed body ended before the end of the stream")
+        return out
+
+
+class _StdlibZstdDecoder:
+    def __init__(self) -> None:
+        self._obj = _stdlib_zstd.ZstdDecompressor()
+
+    def feed(self, data: bytes, limit: int) -> bytes:
+        out = self._obj.decompress(data, max_length=limit + 1)
+        if len(out) > limit:
+            raise BodyTooLarge()
+        return out
+
+    def flush(self) -> bytes:
+        if not self._obj.eof:
+            raise EOFError("Compressed body ended before the end of the stream")
+        return b""
+
+
+class _BoundedSink:
+    def __init__(self) -> None:
+        self.out = bytearray()
+        self.limit = 0
+
+    def write(self, data: bytes) -> int:
+        if len(self.out) + len(data) > self.limit:
+            raise BodyTooLarge()
+        self.out += data
+        return len(data)
+
+
+class _ZstandardDecoder:
+    # zstandard's decompressobj has no max_length, so output goes through a
+    # stream_writer into a sink that stops decoding once it passes the limit.
+    def __init__(self) -> None:
+        self._sink = _BoundedSink()
+        self._writer = zstandard.ZstdDecompressor().stream_writer(self._sink, write_size=_ZSTD_WRITE_SIZE)
+
+    def feed(self, data: bytes, limit: int) -> bytes:
+        self._sink.limit = limit
+        self._writer.write(data)
+        out = bytes(self._sink.out)
+        self._sink.out.clear()
+        return out
+
+    def flush(self) -> bytes:
+        return b""
+
+
+def _decoder_for(encoding: str) -> Any:
+    if encoding in {"", "identity"}:
+        return _IdentityDecoder()
+    if encoding in {"gzip", "x-gzip"}:
+        return _ZlibDecoder(16 + zlib.MAX_WBITS)
+    if encoding == "deflate":
+        return _ZlibDecoder(zlib.MAX_WBITS)
+    if encoding == "zstd":
+        if _stdlib_zstd is not None:
+            return _StdlibZstdDecoder()
+        if zstandard is not None:
+            return _ZstandardDecoder()
+    raise UnsupportedEncoding(f"Unsupported Content-Encoding: {encoding}")
+
+
+async def read_body(request: Request, max_bytes: int) -> bytes:
+    """Read the request body, decoding Content-Encoding incrementally.
+
+    Raises BodyTooLarge once the decoded size passes max_bytes, without
+    inflating the rest of the payload.
+    """
+    encoding = request.headers.get("content-encoding", "").strip().lower()
+    decoder = _decoder_for(encoding)
+    out = bytearray()
+    try:
+        async for chunk in request.stream():
+            if chunk:
+                out += decoder.feed(chunk, max_bytes - len(out))
+        out += decoder.flush()
+    except _DECODE_ERRORS as exc:
+        raise ValueError(f"Invalid {encoding} request body") from exc
+    if len(out) > max_bytes:
+        raise BodyTooLarge()
+    return bytes(out)
+
+
+def _accepted_encodings(header: str) -> set:
+    accepted = set()
+    for item in header.split(","):
+        token, _, params = item.strip().partition(";")
+        token = token.strip().lower()
+        if not token:
+            continue
+        params = params.replace(" ", "")
+        if params.startswith("q=") and params[2:] in {"0", "0.0", "0.00", "0.000"}:
+            continue
+        accepted.add(token)
+    return accepted
+
+
+def negotiate_encoding(accept_encoding: Optional[str]) -> Optional[str]:
+    if not accept_encoding:
+        return None
+    accepted = _accepted_encodings(accept_encoding)
+    if "zstd" in accepted and zstd_available():
+        return "zstd"
+    if "gzip" in accepted or "*" in accepted:
+        return "gzip"
+    return None
+
+
+def _compress(data: bytes, encoding: str) -> bytes:
+    if encoding == "zstd":
+        if _stdlib_zstd is not None:
+            return _stdlib_zstd.compress(data, level=3)
+        return zstandard.ZstdCompressor(level=3).compress(data)
+    return gzip.compress(data, compresslevel=5)
+
+
+def json_response(
+    request: Request,
+    payload: Dict[str, Any],
+    *,
+    min_size: int,
+    status_code: int = 200,
+    headers: Optional[Dict[str, str]] = None,
+) -> Response:
+    """JSON response compressed with the best encoding the client accepts."""
+    data = json.dumps(payload, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+    headers = {**(headers or {}), "vary": "Accept-Encoding"}
+    encoding = negotiate_encoding(request.headers.get("accept-encoding")) if len(data) >= min_size else None
+    if encoding:
+        data = _compress(data, encoding)
+        headers["content-encoding"] = encoding
+    return Response(data, status_code=status_code, headers=headers, media_type="application/json")
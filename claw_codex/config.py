@@ -1,5 +1,7 @@
 import os
+from dataclasses import dataclass
 from pathlib import Path
+from typing import Optional, Tuple
 
 CLIENT_ID = "app_EMoamEEZ73f0CkXaXp7hrann"
 AUTHORIZE_URL = "https://auth.openai.com/oauth/authorize"
@@ -25,6 +27,11 @@ def _is_truthy(value: str) -> bool:
     return value.strip().lower() in {"1", "true", "yes", "on"}
 
 
+def _optional_path(value: str) -> Optional[Path]:
+    value = value.strip()
+    return Path(value) if value else None
+
+
 DEFAULT_MODEL = os.getenv("CLAW_CODEX_MODEL", "gpt-5.2")
 ORIGINATOR = os.getenv("CLAW_CODEX_ORIGINATOR", "pi")
 MOCK_MODE = _is_truthy(os.getenv("CLAW_CODEX_MOCK", ""))
@@ -32,3 +39,130 @@ MOCK_MODE = _is_truthy(os.getenv("CLAW_CODEX_MOCK", ""))
 DEFAULT_AUTH_DIR = Path(os.getenv("CLAW_CODEX_AUTH_DIR", Path.home() / ".claw-codex"))
 AUTH_FILE = Path(os.getenv("CLAW_CODEX_AUTH_FILE", DEFAULT_AUTH_DIR / "auth.json"))
 PKCE_FILE = Path(os.getenv("CLAW_CODEX_PKCE_FILE", DEFAULT_AUTH_DIR / "pkce.json"))
+USAGE_DB = Path(os.getenv("CLAW_CODEX_USAGE_DB", "") or DEFAULT_AUTH_DIR / "usage.db")
+
+
+@dataclass
+class Settings:
+    """Per-instance server configuration; see ``claw_codex.app.create_app``."""
+
+    mock_mode: bool = False
+    auth_file: Path = AUTH_FILE
+    pkce_file: Path = PKCE_FILE
+    default_model: str = DEFAULT_MODEL
+    originator: str = ORIGINATOR
+    max_request_body_bytes: int = 32 * 1024 * 1024
+    compress_min_bytes: int = 1024
+    max_connections: int = 100
+    max_keepalive_connections: int = 20
+    keepalive_expiry: float = 30.0
+    # 0 means unlimited; otherwise extra completions wait for a free slot.
+    max_concurrent_completions: int = 0
+    # Worker processes serving the app. In-flight completions and rate-limit buckets live in each one.
+    workers: int = 1
+    # Estimated input token budget for chat histories; 0 sends them untrimmed. See ``claw_codex.context``.
+    max_input_tokens: int = 0
+    context_strategies: Tuple[str, ...] = ("truncate_tool_outputs", "drop_oldest")
+    context_keep_turns: int = 8
+    context_max_tool_output_tokens: int = 2000
+    # Upper bound on a chat completion's ``n``; each choice is its own upstream stream.
+    max_choices: int = 8
+    # Turns a WebSocket conversation keeps in its server-side history; 0 keeps them all.
+    websocket_history_turns: int = 50
+    # SQLite usage ledger; None disables usage recording.
+    usage_db: Optional[Path] = None
+    # JSONL access log written in the background; None disables it. ``{pid}`` becomes the worker's process id.
+    access_log: Optional[Path] = None
+    # Share of successful requests logged; failures are always logged.
+    access_log_sample_rate: float = 1.0
+    # Rotate once the file reaches this size, keeping ``access_log_backups`` old files.
+    access_log_max_bytes: int = 100 * 1024 * 1024
+    access_log_backups: int = 5
+    # JSON file of downstream API keys with rpm/tpm limits; None disables auth on /v1/*.
+    api_keys_file: Optional[Path] = None
+    # JSON file of extra model aliases; see ``claw_codex.models.ModelRouter``.
+    models_file: Optional[Path] = None
+    # Circuit breaker around the Codex upstream; see ``claw_codex.breaker``.
+    breaker_window_seconds: float = 30.0
+    breaker_min_calls: int = 10
+    breaker_failure_ratio: float = 0.5
+    # Calls slower than this to their first event count as failures; None disables.
+    breaker_slow_call_seconds: Optional[float] = None
+    breaker_open_seconds: float = 15.0
+    breaker_half_open_probes: int = 2
+    # Upstream phase limits in seconds; 0 disables a phase. Callers may tighten them with a deadline.
+    connect_timeout: float = 10.0
+    first_event_timeout: float = 60.0
+    idle_timeout: float = 120.0
+    total_timeout: float = 900.0
+    # Exposes POST /admin/profile (sampling CPU profiler and tracemalloc) when set.
+    profiling_enabled: bool = False
+    # Pooled connections pre-opened to the Codex backend at startup and re-warmed after idle periods; 0 disables.
+    # Off by default: while idle, every worker would send the upstream a HEAD request each warm interval.
+    warm_connections: int = 0
+    # How often an idle pool is touched; keep below keepalive_expiry.
+    warm_interval_seconds: float = 20.0
+    # How long resolved upstream addresses are reused; 0 disables the DNS cache.
+    dns_cache_seconds: float = 300.0
+
+    def __post_init__(self) -> None:
+        self.auth_file = Path(self.auth_file)
+        self.pkce_file = Path(self.pkce_file)
+        if self.usage_db is not None:
+            self.usage_db = Path(self.usage_db)
+        if self.api_keys_file is not None:
+            self.api_keys_file = Path(self.api_keys_file)
+        if self.models_file is not None:
+            self.models_file = Path(self.models_file)
+        if self.access_log is not None:
+            self.access_log = Path(self.access_log)
+
+    @classmethod
+    def from_env(cls) -> "Settings":
+        auth_dir = Path(os.getenv("CLAW_CODEX_AUTH_DIR", Path.home() / ".claw-codex"))
+        slow_call = os.getenv("CLAW_CODEX_BREAKER_SLOW_CALL_SECONDS", "")
+        return cls(
+            mock_mode=_is_truthy(os.getenv("CLAW_CODEX_MOCK", "")),
+            auth_file=Path(os.getenv("CLAW_CODEX_AUTH_FILE", auth_dir / "auth.json")),
+            pkce_file=Path(os.getenv("CLAW_CODEX_PKCE_FILE", auth_dir / "pkce.json")),
+            default_model=os.getenv("CLAW_CODEX_MODEL", "gpt-5.2"),
+            originator=os.getenv("CLAW_CODEX_ORIGINATOR", "pi"),
+            max_request_body_bytes=int(os.getenv("CLAW_CODEX_MAX_BODY_BYTES", str(32 * 1024 * 1024))),
+            compress_min_bytes=int(os.getenv("CLAW_CODEX_COMPRESS_MIN_BYTES", "1024")),
+            max_connections=int(os.getenv("CLAW_CODEX_MAX_CONNECTIONS", "100")),
+            max_keepalive_connections=int(os.getenv("CLAW_CODEX_MAX_KEEPALIVE", "20")),
+            keepalive_expiry=float(os.getenv("CLAW_CODEX_KEEPALIVE_EXPIRY", "30")),
+            max_concurrent_completions=int(os.getenv("CLAW_CODEX_MAX_CONCURRENT", "0")),
+            workers=int(os.getenv("CLAW_CODEX_WORKERS", "1")),
+            max_choices=int(os.getenv("CLAW_CODEX_MAX_CHOICES", "8")),
+            websocket_history_turns=int(os.getenv("CLAW_CODEX_WS_HISTORY_TURNS", "50")),
+            max_input_tokens=int(os.getenv("CLAW_CODEX_MAX_INPUT_TOKENS", "0")),
+            context_strategies=tuple(
+                name.strip()
+                for name in os.getenv("CLAW_CODEX_CONTEXT_STRATEGIES", "truncate_tool_outputs,drop_oldest").split(",")
+                if name.strip()
+            ),
+            context_keep_turns=int(os.getenv("CLAW_CODEX_CONTEXT_KEEP_TURNS", "8")),
+            context_max_tool_output_tokens=int(os.getenv("CLAW_CODEX_MAX_TOOL_OUTPUT_TOKENS", "2000")),
+            usage_db=_optional_path(os.getenv("CLAW_CODEX_USAGE_DB", str(auth_dir / "usage.db"))),
+            access_log=_optional_path(os.getenv("CLAW_CODEX_ACCESS_LOG", "")),
+            access_log_sample_rate=float(os.getenv("CLAW_CODEX_ACCESS_LOG_SAMPLE", "1")),
+            access_log_max_bytes=int(os.getenv("CLAW_CODEX_ACCESS_LOG_MAX_BYTES", str(100 * 1024 * 1024))),
+            access_log_backups=int(os.getenv("CLAW_CODEX_ACCESS_LOG_BACKUPS", "5")),
+            api_keys_file=_optional_path(os.getenv("CLAW_CODEX_API_KEYS_FILE", "")),
+            models_file=_optional_path(os.getenv("CLAW_CODEX_MODELS_FILE", "")),
+            breaker_window_seconds=float(os.getenv("CLAW_CODEX_BREAKER_WINDOW", "30")),
+            breaker_min_calls=int(os.getenv("CLAW_CODEX_BREAKER_MIN_CALLS", "10")),
+            breaker_failure_ratio=float(os.getenv("CLAW_CODEX_BREAKER_FAILURE_RATIO", "0.5")),
+            breaker_slow_call_seconds=float(slow_call) if slow_call else None,
+            breaker_open_seconds=float(os.getenv("CLAW_CODEX_BREAKER_OPEN_SECONDS", "15")),
+            breaker_half_open_probes=int(os.getenv("CLAW_CODEX_BREAKER_PROBES", "2")),
+            connect_timeout=float(os.getenv("CLAW_CODEX_CONNECT_TIMEOUT", "10")),
+            first_event_timeout=float(os.getenv("CLAW_CODEX_FIRST_EVENT_TIMEOUT", "60")),
+            idle_timeout=float(os.getenv("CLAW_CODEX_IDLE_TIMEOUT", "120")),
+            total_timeout=float(os.getenv("CLAW_CODEX_TOTAL_TIMEOUT", "900")),
+            profiling_enabled=_is_truthy(os.getenv("CLAW_CODEX_PROFILING", "")),
+            warm_connections=int(os.getenv("CLAW_CODEX_WARM_CONNECTIONS", "0")),
+            warm_interval_seconds=float(os.getenv("CLAW_CODEX_WARM_INTERVAL", "20")),
+            dns_cache_seconds=float(os.getenv("CLAW_CODEX_DNS_TTL", "300")),
+        )
@@ -0,0 +1,200 @@
+import json
+import re
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Tuple
+
+STRATEGIES = ("truncate_tool_outputs", "keep_last_turns", "drop_oldest")
+
+# Roles that are never trimmed; they become the upstream instructions.
+_PINNED_ROLES = {"system", "developer"}
+_TOOL_ROLES = {"tool", "function"}
+# Chat formats add a few tokens per message for the role and separators.
+_MESSAGE_OVERHEAD = 4
+
+_CJK_RANGES = "\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uac00-\ud7af\uf900-\ufaff"
+_CJK = re.compile(f"[{_CJK_RANGES}]")
+_WORD = re.compile(f"[^\\W\\d_{_CJK_RANGES}]+")
+_LONG_WORD = re.compile(f"[^\\W\\d_{_CJK_RANGES}]{{9,}}")
+_DIGITS = re.compile(r"\d{1,3}")
+_SYMBOLS = re.compile(r"[^\w\s]{1,2}|_+")
+_LINE_BREAKS = re.compile(r"\n[ \t]*")
+
+
+def _count_tokens(text: str) -> int:
+    # BPE vocabularies used by GPT models encode a common word (with its leading
+    # space) as one token, split rare long words every few letters, group digits
+    # in threes and merge pairs of punctuation; CJK is about one token per
+    # character. Each count is one C-level regex pass, with no per-token Python work.
+    long_letters = sum(map(len, _LONG_WORD.findall(text)))
+    return (
+        len(_WORD.findall(text))
+        + long_letters // 6
+        + len(_DIGITS.findall(text))
+        + len(_SYMBOLS.findall(text))
+        + len(_LINE_BREAKS.findall(text))
+        + len(_CJK.findall(text))
+    )
+
+
+class _TokenCache:
+    """LRU of token counts for long texts, bounded by the characters it keeps alive."""
+
+    def __init__(self, max_chars: int = 4_000_000, min_chars: int = 256) -> None:
+        self.max_chars = max_chars
+        self.min_chars = min_chars
+        self.chars = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[str, int]" = OrderedDict()
+
+    def count(self, text: str) -> int:
+        if len(text) < self.min_chars or len(text) > self.max_chars:
+            return _count_tokens(text)
+        tokens = self._entries.get(text)
+        if tokens is not None:
+            self.hits += 1
+            self._entries.move_to_end(text)
+            return tokens
+        self.misses += 1
+        tokens = self._entries[text] = _count_tokens(text)
+        self.chars += len(text)
+        while self.chars > self.max_chars:
+            evicted, _ = self._entries.popitem(last=False)
+            self.chars -= len(evicted)
+        return tokens
+
+
+_CACHE = _TokenCache()
+
+
+def estimate_tokens(text: str) -> int:
+    """Approximate the BPE token count of ``text`` without a tokenizer; long texts are cached."""
+    return _CACHE.count(text) if text else 0
+
+
+def _content_text(content: Any) -> str:
+    if content is None:
+        return ""
+    if isinstance(content, str):
+        return content
+    if isinstance(content, list):
+        texts = []
+        for item in content:
+            if isinstance(item, dict):
+                texts.append(str(item.get("text") or item.get("refusal") or ""))
+        return "\n".join(texts)
+    return str(content)
+
+
+def message_tokens(message: Dict[str, Any]) -> int:
+    """Estimated tokens a chat message costs in the prompt."""
+    tokens = _MESSAGE_OVERHEAD + estimate_tokens(_content_text(message.get("content")))
+    if message.get("name"):
+        tokens += 1
+    if message.get("tool_calls"):
+        tokens += estimate_tokens(json.dumps(message["tool_calls"]))
+    return tokens
+
+
+@dataclass
+class ContextPolicy:
+    """An input token budget and the strategies, applied in order, that bring a history under it.
+
+    - ``truncate_tool_outputs``: cut tool results over ``max_tool_output_tokens``
+      to their head and tail, oldest first.
+    - ``keep_last_turns``: keep only the last ``keep_turns`` turns.
+    - ``drop_oldest``: drop the oldest turns one at a time.
+
+    A turn is a user message and everything after it up to the next one.
+    System messages and the latest turn are never dropped.
+    """
+
+    max_input_tokens: int
+    strategies: Tuple[str, ...] = ("truncate_tool_outputs", "drop_oldest")
+    keep_turns: int = 8
+    max_tool_output_tokens: int = 2000
+
+    def __post_init__(self) -> None:
+        unknown = [name for name in self.strategies if name not in STRATEGIES]
+        if unknown:
+            raise ValueError(f"Unknown context strategies {unknown}; use {', '.join(STRATEGIES)}")
+
+
+def _truncate(text: str, tokens: int, limit: int) -> str:
+    keep_chars = int(len(text) * limit / tokens)
+    head = keep_chars * 2 // 3
+    tail = keep_chars - head
+    return f"{text[:head]}\n[... about {tokens - limit} tokens truncated ...]\n{text[len(text) - tail:]}"
+
+
+def fit_messages(
+    messages: List[Dict[str, Any]], policy: ContextPolicy
+) -> Tuple[List[Dict[str, Any]], Optional[Dict[str, Any]]]:
+    """Trim ``messages`` to the policy's budget; returns them with a report, or unchanged with None."""
+    counts = [message_tokens(message) for message in messages]
+    before = sum(counts)
+    if before <= policy.max_input_tokens:
+        return messages, None
+
+    kept = list(messages)
+    turns: List[List[int]] = []
+    for index, message in enumerate(messages):
+        if message.get("role") in _PINNED_ROLES:
+            continue
+        if message.get("role") == "user" or not turns:
+            turns.append([index])
+        else:
+            turns[-1].append(index)
+    total = before
+    dropped = 0
+    truncated = 0
+
+    def drop_turn() -> None:
+        nonlocal total, dropped
+        for index in turns.pop(0):
+            total -= counts[index]
+            dropped += 1
+
+    for strategy in policy.strategies:
+        if total <= policy.max_input_tokens:
+            break
+        if strategy == "truncate_tool_outputs":
+            limit = policy.max_tool_output_tokens
+            for turn in turns:
+                for index in turn:
+                    message = kept[index]
+                    content = message.get("content")
+                    if message.get("role") not in _TOOL_ROLES or not isinstance(content, str):
+                        continue
+                    tokens = counts[index] - _MESSAGE_OVERHEAD
+                    if tokens <= limit or total <= policy.max_input_tokens:
+                        continue
+                    kept[index] = {**message, "content": _truncate(content, tokens, limit)}
+                    new_count = message_tokens(kept[index])
+                    total -= counts[index] - new_count
+                    counts[index] = new_count
+                    truncated += 1
+        elif strategy == "keep_last_turns":
+            while len(turns) > max(policy.keep_turns, 1):
+                drop_turn()
+        elif strategy == "drop_oldest":
+            while len(turns) > 1 and total > policy.max_input_tokens:
+                drop_turn()
+
+    remaining = {index for turn in turns for index in turn}
+    trimmed = [
+        message
+        for index, message in enumerate(kept)
+        if index in remaining or message.get("role") in _PINNED_ROLES
+    ]
+    report = {
+        "max_input_tokens": policy.max_input_tokens,
+        "input_tokens_before": before,
+        "input_tokens_after": total,
+        "tokens_saved": before - total,
+        "messages_dropped": dropped,
+        "tool_outputs_truncated": truncated,
+        "over_budget": total > policy.max_input_tokens,
+    }
+    return trimmed, report
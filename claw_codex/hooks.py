@@ -0,0 +1,79 @@
+import logging
+import time
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class CallTrace:
+    """One chat call as seen by ClientHooks.
+
+    ``marks`` maps each stage reached (``request_built``, ``credentials``,
+    ``connect``, ``first_event``, ``complete`` or ``error``) to its
+    ``time.perf_counter()`` instant; ``timings()`` turns them into
+    milliseconds since ``started``. ``started_at`` is wall-clock time.
+    """
+
+    completion_id: str
+    model: str
+    stream: bool
+    started: float = field(default_factory=time.perf_counter)
+    started_at: float = field(default_factory=time.time)
+    marks: Dict[str, float] = field(default_factory=dict)
+    body: Optional[Dict[str, Any]] = None
+    account_id: Optional[str] = None
+    events: int = 0
+    usage: Dict[str, int] = field(default_factory=dict)
+    finish_reason: Optional[str] = None
+    error: Optional[BaseException] = None
+
+    def timings(self) -> Dict[str, float]:
+        return {stage: round((at - self.started) * 1000, 3) for stage, at in self.marks.items()}
+
+
+@dataclass
+class ClientHooks:
+    """Callbacks fired by AsyncClawCodexClient around each chat call.
+
+    Every callback gets the call's CallTrace first; ``on_first_event`` and
+    ``on_event`` also get the upstream event, ``on_error`` the exception.
+    Each call ends with exactly one of ``on_complete`` or ``on_error``; a
+    stream closed early by its consumer ends in ``on_error`` with
+    GeneratorExit. Callbacks run inline on the event loop, so they should
+    be quick; exceptions they raise are logged and swallowed. A client
+    without hooks skips all of this.
+    """
+
+    on_request_built: Optional[Callable[[CallTrace], None]] = None
+    on_credentials: Optional[Callable[[CallTrace], None]] = None
+    on_connect: Optional[Callable[[CallTrace], None]] = None
+    on_first_event: Optional[Callable[[CallTrace, Dict[str, Any]], None]] = None
+    on_event: Optional[Callable[[CallTrace, Dict[str, Any]], None]] = None
+    on_complete: Optional[Callable[[CallTrace], None]] = None
+    on_error: Optional[Callable[[CallTrace, BaseException], None]] = None
+
+    def _call(self, callback: Optional[Callable[..., None]], *args: Any) -> None:
+        if callback is None:
+            return
+        try:
+            callback(*args)
+        except Exception:
+            logger.exception("Client hook %r failed", callback)
+
+    def fire(self, stage: str, trace: CallTrace) -> None:
+        trace.marks[stage] = time.perf_counter()
+        self._call(getattr(self, f"on_{stage}"), trace)
+
+    def event(self, trace: CallTrace, event: Dict[str, Any]) -> None:
+        trace.events += 1
+        if trace.events == 1:
+            trace.marks["first_event"] = time.perf_counter()
+            self._call(self.on_first_event, trace, event)
+        self._call(self.on_event, trace, event)
+
+    def fail(self, trace: CallTrace, exc: BaseException) -> None:
+        trace.error = exc
+        trace.marks["error"] = time.perf_counter()
+        self._call(self.on_error, trace, exc)
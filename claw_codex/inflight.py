@@ -0,0 +1,135 @@
+import asyncio
+import time
+from typing import Any, Dict, Iterator, Optional
+
+QUEUED = "queued"
+CONNECTING = "connecting"
+STREAMING = "streaming"
+
+
+class CompletionCancelled(RuntimeError):
+    def __init__(self, completion_id: str) -> None:
+        super().__init__(f"Completion {completion_id} was cancelled")
+        self.completion_id = completion_id
+
+
+class InFlight:
+    """One running completion; setting ``abort`` stops its upstream stream.
+
+    The handler serving it updates ``phase`` and the progress counters as it
+    goes, so a snapshot is just a read of plain attributes.
+    """
+
+    def __init__(
+        self,
+        completion_id: str,
+        *,
+        endpoint: str = "chat.completions",
+        owner: Optional[str] = None,
+        caller: Optional[str] = None,
+        session_id: Optional[str] = None,
+        account_id: Optional[str] = None,
+        abort: Optional[asyncio.Event] = None,
+    ) -> None:
+        self.id = completion_id
+        self.endpoint = endpoint
+        self.owner = owner
+        self.caller = caller
+        self.session_id = session_id
+        self.account_id = account_id
+        self.abort = abort or asyncio.Event()
+        self.cancelled = False
+        self.started = time.monotonic()
+        self.phase = QUEUED
+        self.slot_at: Optional[float] = None
+        self.first_token_at: Optional[float] = None
+        self.deltas = 0
+        self.bytes_sent = 0
+
+    def cancel(self) -> None:
+        self.cancelled = True
+        self.abort.set()
+
+    def record_delta(self) -> None:
+        if self.first_token_at is None:
+            self.first_token_at = time.monotonic()
+        self.deltas += 1
+
+    def upstream_ms(self, now: float) -> float:
+        """Milliseconds since the upstream request went out: since the slot was taken, if it needed one."""
+        return round((now - (self.slot_at if self.slot_at is not None else self.started)) * 1000, 3)
+
+    def timing(self, now: float, completion_tokens: int) -> Dict[str, Any]:
+        """Where a finished stream's time went, for clients that asked for timing."""
+        first = self.first_token_at
+        generating = now - first if first is not None else 0.0
+        return {
+            "queue_ms": round((self.slot_at - self.started) * 1000, 3) if self.slot_at is not None else 0.0,
+            "ttft_ms": round((first - self.started) * 1000, 3) if first is not None else None,
+            "upstream_ms": self.upstream_ms(now),
+            "total_ms": round((now - self.started) * 1000, 3),
+            "tokens_per_second": round(completion_tokens / generating, 2) if generating > 0 else None,
+        }
+
+    def snapshot(self, now: float) -> Dict[str, Any]:
+        return {
+            "id": self.id,
+            "endpoint": self.endpoint,
+            "phase": self.phase,
+            "caller": self.caller,
+            "session_id": self.session_id,
+            "account_id": self.account_id,
+            "elapsed_seconds": round(now - self.started, 3),
+            "ttft_seconds": round(self.first_token_at - self.started, 3) if self.first_token_at is not None else None,
+            "deltas": self.deltas,
+            "bytes_sent": self.bytes_sent,
+            "cancelled": self.cancelled,
+        }
+
+
+class InFlightRegistry:
+    """Completions currently running, keyed by their ``chatcmpl_`` id."""
+
+    def __init__(self) -> None:
+        self._entries: Dict[str, InFlight] = {}
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __iter__(self) -> Iterator[InFlight]:
+        return iter(list(self._entries.values()))
+
+    def register(self, entry: InFlight) -> InFlight:
+        if entry.id in self._entries:
+            raise KeyError(entry.id)
+        self._entries[entry.id] = entry
+        return entry
+
+    def unregister(self, entry: InFlight) -> None:
+        if self._entries.get(entry.id) is entry:
+            del self._entries[entry.id]
+
+    def get(self, completion_id: str) -> Optional[InFlight]:
+        return self._entries.get(completion_id)
+
+    def cancel(self, completion_id: str, owner: Optional[str] = None) -> bool:
+        """Cancel a completion; with ``owner`` set, only one started by that owner."""
+        entry = self._entries.get(completion_id)
+        if entry is None or (owner is not None and entry.owner != owner):
+            return False
+        entry.cancel()
+        return True
+
+    def snapshot(self) -> Dict[str, Any]:
+        now = time.monotonic()
+        streams = [entry.snapshot(now) for entry in self]
+        phases = {QUEUED: 0, CONNECTING: 0, STREAMING: 0}
+        for stream in streams:
+            phases[stream["phase"]] = phases.get(stream["phase"], 0) + 1
+        queued = [stream["elapsed_seconds"] for stream in streams if stream["phase"] == QUEUED]
+        return {
+            "in_flight": len(streams),
+            "phases": phases,
+            "oldest_queued_seconds": max(queued) if queued else None,
+            "streams": sorted(streams, key=lambda stream: stream["elapsed_seconds"], reverse=True),
+        }
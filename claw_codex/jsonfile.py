@@ -0,0 +1,54 @@
+import json
+import logging
+import time
+from pathlib import Path
+from typing import Any, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class ReloadingJsonFile:
+    """Base for configuration read from a JSON file and re-read when its mtime changes.
+
+    Subclasses implement ``_apply``, which builds their state from the parsed
+    document and swaps it in only once it is complete. A file that fails to
+    read, parse or apply is logged and the previous state is kept. The mtime
+    is checked at most every ``check_interval`` seconds; ``path`` None means
+    there is no file and the subclass keeps its defaults.
+    """
+
+    # What the file holds, for log messages.
+    noun = "entries"
+
+    def __init__(self, path: Optional[Path], *, check_interval: float = 1.0) -> None:
+        self.path = Path(path) if path is not None else None
+        self.check_interval = check_interval
+        self._mtime_ns: Optional[int] = None
+        self._checked_at = float("-inf")
+
+    def _apply(self, raw: Any) -> None:
+        raise NotImplementedError
+
+    def reload(self) -> None:
+        assert self.path is not None
+        try:
+            mtime_ns = self.path.stat().st_mtime_ns
+            self._apply(json.loads(self.path.read_text(encoding="utf-8")))
+        except (OSError, ValueError, KeyError, TypeError, AttributeError):
+            logger.exception("Failed to load %s from %s; keeping previous %s", self.noun, self.path, self.noun)
+            return
+        self._mtime_ns = mtime_ns
+
+    def _maybe_reload(self) -> None:
+        if self.path is None:
+            return
+        now = time.monotonic()
+        if now - self._checked_at < self.check_interval:
+            return
+        self._checked_at = now
+        try:
+            mtime_ns = self.path.stat().st_mtime_ns
+        except OSError:
+            return
+        if mtime_ns != self._mtime_ns:
+            self.reload()
@@ -0,0 +1,171 @@
+import sqlite3
+import time
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+from .writebehind import WriteBehind
+
+GROUP_BY_COLUMNS = {"model", "account_id", "caller", "endpoint", "status"}
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS usage (
+    created_at REAL NOT NULL,
+    completion_id TEXT NOT NULL,
+    endpoint TEXT NOT NULL,
+    model TEXT,
+    account_id TEXT,
+    caller TEXT,
+    prompt_tokens INTEGER NOT NULL,
+    completion_tokens INTEGER NOT NULL,
+    total_tokens INTEGER NOT NULL,
+    latency_ms REAL NOT NULL,
+    status TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS usage_created_at ON usage (created_at);
+"""
+
+_INSERT = "INSERT INTO usage VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)"
+
+_UNITS = {"s": 1, "m": 60, "h": 3600, "d": 86400, "w": 604800}
+
+
+@dataclass
+class UsageRecord:
+    completion_id: str
+    endpoint: str
+    model: Optional[str]
+    account_id: Optional[str]
+    caller: Optional[str]
+    prompt_tokens: int
+    completion_tokens: int
+    total_tokens: int
+    latency_ms: float
+    status: str = "ok"
+    created_at: float = field(default_factory=time.time)
+
+    def row(self) -> tuple:
+        return (
+            self.created_at,
+            self.completion_id,
+            self.endpoint,
+            self.model,
+            self.account_id,
+            self.caller,
+            self.prompt_tokens,
+            self.completion_tokens,
+            self.total_tokens,
+            self.latency_ms,
+            self.status,
+        )
+
+
+def parse_duration(value: str) -> float:
+    """Parse ``90``, ``30m``, ``24h`` or ``7d`` into seconds."""
+    raw = value.strip().lower()
+    if raw and raw[-1] in _UNITS:
+        return float(raw[:-1]) * _UNITS[raw[-1]]
+    return float(raw)
+
+
+def parse_time_bound(value: Optional[str], now: Optional[float] = None) -> Optional[float]:
+    """Accept an epoch timestamp or a relative duration (``24h`` means 24 hours ago)."""
+    if value is None or not str(value).strip():
+        return None
+    raw = str(value).strip().lower()
+    if raw[-1] in _UNITS:
+        return (time.time() if now is None else now) - parse_duration(raw)
+    return float(raw)
+
+
+def _connect(path: Path) -> sqlite3.Connection:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    conn = sqlite3.connect(str(path), check_same_thread=False, timeout=30)
+    # WAL lets several server workers append while the CLI reads.
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.executescript(_SCHEMA)
+    return conn
+
+
+def query_usage(
+    path: Path,
+    *,
+    since: Optional[float] = None,
+    until: Optional[float] = None,
+    group_by: Optional[str] = None,
+    bucket_seconds: Optional[float] = None,
+    caller: Optional[str] = None,
+) -> List[Dict[str, Any]]:
+    """Aggregate recorded usage, optionally grouped by a column and/or time bucket; ``caller`` limits it to one."""
+    if group_by is not None and group_by not in GROUP_BY_COLUMNS:
+        raise ValueError(f"group_by must be one of: {', '.join(sorted(GROUP_BY_COLUMNS))}")
+    if bucket_seconds is not None and bucket_seconds <= 0:
+        raise ValueError("bucket must be positive")
+
+    keys: List[str] = []
+    params: List[Any] = []
+    if bucket_seconds is not None:
+        keys.append("CAST(created_at / ? AS INTEGER) * ? AS bucket_start")
+        params.extend([bucket_seconds, bucket_seconds])
+    if group_by is not None:
+        keys.append(group_by)
+
+    where: List[str] = []
+    if since is not None:
+        where.append("created_at >= ?")
+        params.append(since)
+    if until is not None:
+        where.append("created_at < ?")
+        params.append(until)
+    if caller is not None:
+        where.append("caller = ?")
+        params.append(caller)
+
+    columns = keys + [
+        "COUNT(*) AS requests",
+        "SUM(prompt_tokens) AS prompt_tokens",
+        "SUM(completion_tokens) AS completion_tokens",
+        "SUM(total_tokens) AS total_tokens",
+        "ROUND(AVG(latency_ms), 2) AS avg_latency_ms",
+        "ROUND(MAX(latency_ms), 2) AS max_latency_ms",
+    ]
+    sql = f"SELECT {', '.join(columns)} FROM usage"
+    if where:
+        sql += " WHERE " + " AND ".join(where)
+    group_names = (["bucket_start"] if bucket_seconds is not None else []) + ([group_by] if group_by else [])
+    if group_names:
+        sql += f" GROUP BY {', '.join(group_names)} ORDER BY {', '.join(group_names)}"
+
+    conn = _connect(path)
+    try:
+        conn.row_factory = sqlite3.Row
+        rows = [dict(row) for row in conn.execute(sql, params)]
+    finally:
+        conn.close()
+    return [row for row in rows if row["requests"]]
+
+
+class UsageLedger(WriteBehind[UsageRecord]):
+    """Write-behind usage ledger: batches of records are inserted into SQLite off the request path."""
+
+    write_errors = (sqlite3.Error,)
+    noun = "usage records"
+
+    def __init__(self, path: Path, *, batch_size: int = 500, max_queue: int = 10000) -> None:
+        super().__init__(batch_size=batch_size, max_queue=max_queue)
+        self.path = Path(path)
+        self._conn: Optional[sqlite3.Connection] = None
+
+    def _open(self) -> None:
+        self._conn = _connect(self.path)
+
+    def _write(self, batch: List[UsageRecord]) -> None:
+        assert self._conn is not None
+        with self._conn:
+            self._conn.executemany(_INSERT, [record.row() for record in batch])
+
+    def _close(self) -> None:
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
@@ -0,0 +1,85 @@
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+from .jsonfile import ReloadingJsonFile
+
+EFFORTS = ("none", "minimal", "low", "medium", "high", "xhigh")
+VERBOSITIES = ("low", "medium", "high")
+
+
+@dataclass(frozen=True)
+class ModelRoute:
+    """A model alias and the upstream configuration it selects.
+
+    ``model`` None means the instance's default upstream model; ``effort``
+    None leaves reasoning effort to the upstream default.
+    """
+
+    id: str
+    model: Optional[str] = None
+    effort: Optional[str] = None
+    verbosity: str = "medium"
+    description: str = ""
+
+    def __post_init__(self) -> None:
+        if self.effort is not None and self.effort not in EFFORTS:
+            raise ValueError(f"Model {self.id!r}: effort must be one of {', '.join(EFFORTS)}")
+        if self.verbosity not in VERBOSITIES:
+            raise ValueError(f"Model {self.id!r}: verbosity must be one of {', '.join(VERBOSITIES)}")
+
+
+DEFAULT_ROUTES = (
+    ModelRoute("claw/codex", description="Default model and reasoning effort"),
+    ModelRoute("claw/codex-fast", effort="low", verbosity="low", description="Low effort and terse output"),
+    ModelRoute("claw/codex-deep", effort="high", description="High effort for hard problems"),
+    # Older aliases, still accepted.
+    ModelRoute("claw/codex-responses"),
+    ModelRoute("openai-codex"),
+)
+
+
+def _route(entry: Dict[str, Any]) -> ModelRoute:
+    return ModelRoute(
+        str(entry["id"]),
+        model=str(entry["model"]) if entry.get("model") else None,
+        effort=str(entry["effort"]) if entry.get("effort") else None,
+        verbosity=str(entry.get("verbosity") or "medium"),
+        description=str(entry.get("description") or ""),
+    )
+
+
+class ModelRouter(ReloadingJsonFile):
+    """The model aliases callers can ask for, optionally extended from a JSON file reloaded when it changes.
+
+    File format::
+
+        {"models": [{"id": "claw/codex-mini", "model": "gpt-5.1-codex-mini", "effort": "low", "verbosity": "low"}]}
+
+    File entries add aliases or replace built-in ones with the same ``id``.
+    A file that fails to load is logged and the previous table is kept.
+    """
+
+    noun = "models"
+
+    def __init__(self, path: Optional[Path] = None, *, check_interval: float = 1.0) -> None:
+        super().__init__(path, check_interval=check_interval)
+        self._routes: Dict[str, ModelRoute] = {route.id: route for route in DEFAULT_ROUTES}
+        if self.path is not None:
+            self.reload()
+
+    def _apply(self, raw: Any) -> None:
+        entries = raw.get("models", []) if isinstance(raw, dict) else raw
+        routes = {route.id: route for route in DEFAULT_ROUTES}
+        for entry in entries:
+            route = _route(entry)
+            routes[route.id] = route
+        self._routes = routes
+
+    def resolve(self, alias: Any) -> Optional[ModelRoute]:
+        self._maybe_reload()
+        return self._routes.get(alias) if isinstance(alias, str) else None
+
+    def routes(self) -> List[ModelRoute]:
+        self._maybe_reload()
+        return list(self._routes.values())
@@ -131,7 +131,20 @@ def extract_account_id(access_token: str) -> str:
     return str(account_id)
 
 
-async def exchange_authorization_code(code: str, verifier: str, redirect_uri: str = REDIRECT_URI) -> OAuthCredentials:
+async def _post_token(data: dict, http_client: Optional[httpx.AsyncClient]) -> httpx.Response:
+    headers = {"Content-Type": "application/x-www-form-urlencoded"}
+    if http_client is not None:
+        return await http_client.post(TOKEN_URL, data=data, headers=headers, timeout=30)
+    async with httpx.AsyncClient(timeout=30) as client:
+        return await client.post(TOKEN_URL, data=data, headers=headers)
+
+
+async def exchange_authorization_code(
+    code: str,
+    verifier: str,
+    redirect_uri: str = REDIRECT_URI,
+    http_client: Optional[httpx.AsyncClient] = None,
+) -> OAuthCredentials:
     data = {
         "grant_type": "authorization_code",
         "client_id": CLIENT_ID,
@@ -139,8 +152,7 @@ async def exchange_authorization_code(code: str, verifier: str, redirect_uri: st
         "code_verifier": verifier,
         "redirect_uri": redirect_uri,
     }
-    async with httpx.AsyncClient(timeout=30) as client:
-        resp = await client.post(TOKEN_URL, data=data, headers={"Content-Type": "application/x-www-form-urlencoded"})
+    resp = await _post_token(data, http_client)
     if resp.status_code >= 400:
         raise RuntimeError(f"Token exchange failed: {resp.status_code} {resp.text}")
     payload = resp.json()
@@ -157,14 +169,13 @@ async def exchange_authorization_code(code: str, verifier: str, redirect_uri: st
     return OAuthCredentials(access=access, refresh=refresh, expires=expires, account_id=account_id)
 
 
-async def refresh_access_token(refresh_token: str) -> OAuthCredentials:
+async def refresh_access_token(refresh_token: str, http_client: Optional[httpx.AsyncClient] = None) -> OAuthCredentials:
     data = {
         "grant_type": "refresh_token",
         "refresh_token": refresh_token,
         "client_id": CLIENT_ID,
     }
-    async with httpx.AsyncClient(timeout=30) as client:
-        resp = await client.post(TOKEN_URL, data=data, headers={"Content-Type": "application/x-www-form-urlencoded"})
+    resp = await _post_token(data, http_client)
     if resp.status_code >= 400:
         raise RuntimeError(f"Token refresh failed: {resp.status_code} {resp.text}")
     payload = resp.json()
@@ -0,0 +1,156 @@
+import collections
+import os
+import sys
+import threading
+import time
+import tracemalloc
+from typing import Any, Counter, Dict, List, Optional
+
+# Frames from these files are dropped from allocation stacks; they are the profiler itself.
+_OWN_FILES = {__file__, tracemalloc.__file__}
+
+
+def _location(filename: str, lineno: int) -> str:
+    parent, base = os.path.split(filename)
+    # Collapsed stacks separate frames with ';'.
+    return f"{os.path.basename(parent)}/{base}:{lineno}".replace(";", ":")
+
+
+def _collapsed(counts: Counter[str]) -> str:
+    return "".join(f"{stack} {count}\n" for stack, count in counts.most_common())
+
+
+class SamplingProfiler:
+    """Samples one thread's Python stack from a background thread.
+
+    Output is in the collapsed-stack format (``frame;frame;frame count`` per
+    line) read by flamegraph.pl, speedscope and inferno. Sampling costs the
+    target thread a GIL hand-off per interval. The sampler can only look when
+    it holds the GIL, so while it runs the interpreter's switch interval is
+    lowered to below the sampling interval; otherwise samples pile up on
+    calls that release the GIL, such as syscalls.
+    """
+
+    def __init__(self, interval: float = 0.005, thread_id: Optional[int] = None) -> None:
+        self.interval = interval
+        self.thread_id = thread_id if thread_id is not None else threading.get_ident()
+        self.samples = 0
+        self._stacks: Counter[str] = collections.Counter()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._switch_interval: Optional[float] = None
+
+    def _run(self) -> None:
+        labels: Dict[Any, str] = {}
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                continue
+            stack: List[str] = []
+            while frame is not None:
+                code = frame.f_code
+                label = labels.get(code)
+                if label is None:
+                    label = labels[code] = f"{code.co_name} ({_location(code.co_filename, code.co_firstlineno)})"
+                stack.append(label)
+                frame = frame.f_back
+            stack.reverse()
+            self._stacks[";".join(stack)] += 1
+            self.samples += 1
+
+    def start(self) -> None:
+        self._switch_interval = sys.getswitchinterval()
+        sys.setswitchinterval(min(self._switch_interval, self.interval / 2))
+        self._thread = threading.Thread(target=self._run, name="claw-codex-profiler", daemon=True)
+        self._thread.start()
+
+    def top(self, limit: int = 20) -> List[Dict[str, Any]]:
+        """Functions by self samples: the innermost frame of each stack."""
+        leaves: Counter[str] = collections.Counter()
+        for stack, count in self._stacks.items():
+            leaves[stack.rsplit(";", 1)[-1]] += count
+        total = self.samples or 1
+        return [
+            {"function": name, "samples": count, "share": round(count / total, 4)}
+            for name, count in leaves.most_common(limit)
+        ]
+
+    def stop(self) -> str:
+        """Stop sampling and return the collapsed stacks."""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        if self._switch_interval is not None:
+            sys.setswitchinterval(self._switch_interval)
+            self._switch_interval = None
+        return _collapsed(self._stacks)
+
+
+class AllocationTracer:
+    """tracemalloc over a window: reports memory allocated during it and still live at the end."""
+
+    def __init__(self, frames: int = 32) -> None:
+        self.frames = frames
+        self._owns_tracing = False
+        self._baseline: Optional[tracemalloc.Snapshot] = None
+
+    def start(self) -> None:
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(self.frames)
+            self._owns_tracing = True
+        self._baseline = tracemalloc.take_snapshot()
+
+    def stop(self, limit: int = 20) -> Dict[str, Any]:
+        """Stop tracing; returns ``collapsed`` stacks weighted by bytes and the ``top`` allocation sites."""
+        snapshot = tracemalloc.take_snapshot()
+        if self._owns_tracing:
+            tracemalloc.stop()
+            self._owns_tracing = False
+        filters = [tracemalloc.Filter(False, path) for path in _OWN_FILES]
+        snapshot = snapshot.filter_traces(filters)
+        assert self._baseline is not None
+        baseline = self._baseline.filter_traces(filters)
+        stacks: Counter[str] = collections.Counter()
+        for stat in snapshot.compare_to(baseline, "traceback"):
+            if stat.size_diff <= 0:
+                continue
+            stack = ";".join(_location(frame.filename, frame.lineno) for frame in stat.traceback)
+            stacks[stack] += stat.size_diff
+        top = [
+            {"site": _location(stat.traceback[0].filename, stat.traceback[0].lineno), "bytes": stat.size_diff}
+            for stat in snapshot.compare_to(baseline, "lineno")[:limit]
+            if stat.size_diff > 0
+        ]
+        return {"collapsed": _collapsed(stacks), "bytes": sum(stacks.values()), "top": top}
+
+
+class ProfileSession:
+    """A CPU sampler and optional allocation tracer run over the same window."""
+
+    def __init__(self, *, interval: float = 0.005, allocations: bool = True, thread_id: Optional[int] = None) -> None:
+        self.sampler = SamplingProfiler(interval, thread_id)
+        self.tracer = AllocationTracer() if allocations else None
+        self.started = 0.0
+
+    def start(self) -> None:
+        self.started = time.monotonic()
+        if self.tracer is not None:
+            self.tracer.start()
+        self.sampler.start()
+
+    def stop(self) -> Dict[str, Any]:
+        cpu = self.sampler.stop()
+        result: Dict[str, Any] = {
+            "seconds": round(time.monotonic() - self.started, 3),
+            "interval": self.sampler.interval,
+            "samples": self.sampler.samples,
+            "cpu_top": self.sampler.top(),
+            "cpu_collapsed": cpu,
+        }
+        if self.tracer is not None:
+            allocations = self.tracer.stop()
+            result["alloc_collapsed"] = allocations["collapsed"]
+            result["alloc_bytes"] = allocations["bytes"]
+            result["alloc_top"] = allocations["top"]
+        return result
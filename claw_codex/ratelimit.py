@@ -0,0 +1,117 @@
+import hashlib
+import time
+from pathlib import Path
+from typing import Any, Dict, Optional
+
+from .jsonfile import ReloadingJsonFile
+
+
+class TokenBucket:
+    """Continuously refilled token bucket; O(1) per operation.
+
+    ``take`` may drive the balance negative, which is how usage that is only
+    known after a completion (tokens) is charged: the debt delays the next
+    admission instead of being rejected retroactively.
+    """
+
+    __slots__ = ("capacity", "rate", "tokens", "updated")
+
+    def __init__(self, capacity: float, period_seconds: float = 60.0) -> None:
+        self.capacity = float(capacity)
+        self.rate = self.capacity / period_seconds
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float) -> None:
+        if now > self.updated:
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+
+    def wait_time(self, amount: float, now: Optional[float] = None) -> float:
+        """Seconds until ``amount`` tokens are available (0 if they are now)."""
+        self._refill(time.monotonic() if now is None else now)
+        if self.tokens >= amount:
+            return 0.0
+        return (amount - self.tokens) / self.rate
+
+    def take(self, amount: float, now: Optional[float] = None) -> None:
+        self._refill(time.monotonic() if now is None else now)
+        self.tokens -= amount
+
+
+class KeyState:
+    __slots__ = ("name", "rpm", "tpm", "admin", "requests", "tokens")
+
+    def __init__(self, name: str, rpm: Optional[int], tpm: Optional[int], admin: bool = False) -> None:
+        self.name = name
+        self.rpm = rpm
+        self.tpm = tpm
+        self.admin = admin
+        self.requests = TokenBucket(rpm) if rpm else None
+        self.tokens = TokenBucket(tpm) if tpm else None
+
+    def admit(self, now: Optional[float] = None) -> float:
+        """Admit one request, or return the seconds to wait before retrying."""
+        now = time.monotonic() if now is None else now
+        wait = 0.0
+        if self.requests is not None:
+            wait = self.requests.wait_time(1, now)
+        if self.tokens is not None:
+            wait = max(wait, self.tokens.wait_time(1, now))
+        if wait == 0.0 and self.requests is not None:
+            self.requests.take(1, now)
+        return wait
+
+    def charge(self, tokens: int) -> None:
+        if self.tokens is not None and tokens > 0:
+            self.tokens.take(tokens)
+
+
+def _digest(secret: str) -> str:
+    return hashlib.sha256(secret.encode("utf-8")).hexdigest()
+
+
+class ApiKeyRegistry(ReloadingJsonFile):
+    """Downstream API keys loaded from a JSON file and reloaded when it changes.
+
+    File format::
+
+        {"keys": [{"name": "agent-a", "key": "secret", "rpm": 60, "tpm": 200000}]}
+
+    ``rpm``/``tpm`` are optional; omitting them leaves that dimension unlimited.
+    ``"admin": true`` grants access to the ``/admin`` endpoints.
+    Bucket state survives reloads for keys whose name and limits are unchanged.
+    """
+
+    noun = "API keys"
+
+    def __init__(self, path: Path, *, check_interval: float = 1.0) -> None:
+        super().__init__(path, check_interval=check_interval)
+        self._by_digest: Dict[str, KeyState] = {}
+        self._by_name: Dict[str, KeyState] = {}
+        self.reload()
+
+    def _apply(self, raw: Any) -> None:
+        entries = raw.get("keys", []) if isinstance(raw, dict) else raw
+        by_digest: Dict[str, KeyState] = {}
+        by_name: Dict[str, KeyState] = {}
+        for entry in entries:
+            name = str(entry["name"])
+            rpm = int(entry["rpm"]) if entry.get("rpm") else None
+            tpm = int(entry["tpm"]) if entry.get("tpm") else None
+            state = self._by_name.get(name)
+            if state is None or state.rpm != rpm or state.tpm != tpm:
+                state = KeyState(name, rpm, tpm)
+            state.admin = bool(entry.get("admin"))
+            by_digest[_digest(str(entry["key"]))] = state
+            by_name[name] = state
+        self._by_digest, self._by_name = by_digest, by_name
+
+    def lookup(self, secret: Optional[str]) -> Optional[KeyState]:
+        self._maybe_reload()
+        if not secret:
+            return None
+        return self._by_digest.get(_digest(secret))
+
+    def get(self, name: str) -> Optional[KeyState]:
+        return self._by_name.get(name)
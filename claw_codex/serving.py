@@ -0,0 +1,102 @@
+import inspect
+import logging
+import signal
+import socket
+import time
+from functools import partial
+from types import FrameType
+from typing import TYPE_CHECKING, Any, List, Optional
+
+import uvicorn
+from uvicorn.supervisors import multiprocess
+
+if TYPE_CHECKING:
+    from .app import ServerState
+
+logger = logging.getLogger(__name__)
+
+
+def _server_state(app: Any) -> Optional["ServerState"]:
+    # uvicorn wraps the app in middleware; each layer keeps the next one in ``.app``.
+    while app is not None:
+        state = getattr(app, "state", None)
+        if state is not None and hasattr(state, "claw"):
+            return state.claw
+        app = getattr(app, "app", None)
+    return None
+
+
+class DrainingServer(uvicorn.Server):
+    """uvicorn server that drains before it stops.
+
+    The first SIGTERM does not stop the server: it marks the app as
+    draining, so /readyz fails and new completions get 503, while the
+    listeners stay open for load balancers to notice. Once no completion
+    is in flight, or ``drain_timeout`` seconds have passed and the rest
+    have been aborted, the usual uvicorn shutdown runs. SIGINT, a second
+    SIGTERM or a ``drain_timeout`` of 0 stop the server right away.
+    """
+
+    def __init__(self, config: uvicorn.Config, drain_timeout: float = 30.0) -> None:
+        super().__init__(config)
+        self.drain_timeout = drain_timeout
+        self.drain_deadline: Optional[float] = None
+
+    @property
+    def state(self) -> Optional["ServerState"]:
+        return _server_state(getattr(self.config, "loaded_app", None))
+
+    def handle_exit(self, sig: int, frame: Optional[FrameType]) -> None:
+        state = self.state
+        if sig != signal.SIGTERM or self.drain_timeout <= 0 or self.drain_deadline is not None or state is None:
+            super().handle_exit(sig, frame)
+            return
+        # Re-raised by uvicorn once it exits, as if the server had stopped on the signal itself.
+        captured = getattr(self, "_captured_signals", None)
+        if captured is not None:
+            captured.append(sig)
+        self.drain_deadline = time.monotonic() + self.drain_timeout
+        state.begin_drain()
+        logger.info(
+            "Draining %d in-flight completions for up to %.0f seconds", len(state.inflight), self.drain_timeout
+        )
+
+    async def on_tick(self, counter: int) -> bool:
+        state = self.state
+        if self.drain_deadline is not None and not self.should_exit and state is not None:
+            if state.drained(self.drain_deadline):
+                self.should_exit = True
+        return await super().on_tick(counter)
+
+
+class _DrainingProcess(multiprocess.Process):
+    # Newer uvicorn builds each worker's server in its own process from the
+    # Process class, without a target to hand it.
+    def __init__(self, config: uvicorn.Config, sockets: List[socket.socket], *, drain_timeout: float) -> None:
+        self.drain_timeout = drain_timeout
+        super().__init__(config, sockets)
+
+    @property
+    def server(self) -> uvicorn.Server:
+        if self._server is None:
+            self._server = DrainingServer(self.config, drain_timeout=self.drain_timeout)
+        return self._server
+
+
+def run_workers(config: uvicorn.Config, sockets: List[socket.socket], drain_timeout: float = 30.0) -> None:
+    """Serve ``config.workers`` worker processes on ``sockets``, each a ``DrainingServer``.
+
+    Older uvicorn takes the server's ``run`` as the workers' target; newer
+    uvicorn has no target and creates the workers' servers itself, so its
+    worker class is swapped for one that builds a ``DrainingServer``.
+    """
+    if "target" in inspect.signature(multiprocess.Multiprocess).parameters:
+        server = DrainingServer(config, drain_timeout=drain_timeout)
+        multiprocess.Multiprocess(config, target=server.run, sockets=sockets).run()  # type: ignore[call-arg]
+        return
+    original = multiprocess.Process
+    multiprocess.Process = partial(_DrainingProcess, drain_timeout=drain_timeout)  # type: ignore[misc]
+    try:
+        multiprocess.Multiprocess(config, sockets=sockets).run()
+    finally:
+        multiprocess.Process = original  # type: ignore[misc]
@@ -1,11 +1,18 @@
+import asyncio
 import json
+import os
 import time
 from dataclasses import dataclass
 from pathlib import Path
-from typing import Optional
+from typing import Awaitable, Callable, Optional
 
 from .config import AUTH_FILE, PKCE_FILE
 
+try:
+    import fcntl
+except ImportError:  # Windows: no cross-process locking, single worker only.
+    fcntl = None
+
 
 @dataclass
 class OAuthCredentials:
@@ -27,6 +34,13 @@ def _ensure_parent(path: Path) -> None:
     path.parent.mkdir(parents=True, exist_ok=True)
 
 
+def _write_atomic(path: Path, text: str) -> None:
+    # Readers in other worker processes must never observe a half-written file.
+    tmp = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+    tmp.write_text(text, encoding="utf-8")
+    os.replace(tmp, path)
+
+
 def save_credentials(creds: OAuthCredentials, path: Path = AUTH_FILE) -> None:
     _ensure_parent(path)
     data = {
@@ -35,7 +49,7 @@ def save_credentials(creds: OAuthCredentials, path: Path = AUTH_FILE) -> None:
         "expires": creds.expires,
         "account_id": creds.account_id,
     }
-    path.write_text(json.dumps(data, indent=2), encoding="utf-8")
+    _write_atomic(path, json.dumps(data, indent=2))
 
 
 def load_credentials(path: Path = AUTH_FILE) -> Optional[OAuthCredentials]:
@@ -57,6 +71,56 @@ def credentials_valid(creds: OAuthCredentials, min_ttl_seconds: int = 60) -> boo
     return creds.expires > int(time.time() * 1000) + (min_ttl_seconds * 1000)
 
 
+def _lock_file(path: Path) -> int:
+    _ensure_parent(path)
+    fd = os.open(str(path.with_name(f"{path.name}.lock")), os.O_RDWR | os.O_CREAT, 0o600)
+    if fcntl is not None:
+        fcntl.flock(fd, fcntl.LOCK_EX)
+    return fd
+
+
+def _unlock_file(fd: int) -> None:
+    if fcntl is not None:
+        fcntl.flock(fd, fcntl.LOCK_UN)
+    os.close(fd)
+
+
+def _unlock_abandoned(locking: "asyncio.Future[int]") -> None:
+    if not locking.cancelled() and locking.exception() is None:
+        _unlock_file(locking.result())
+
+
+async def refresh_credentials_locked(
+    refresh: Callable[[OAuthCredentials], Awaitable[OAuthCredentials]],
+    path: Path = AUTH_FILE,
+    stale: Optional[OAuthCredentials] = None,
+) -> OAuthCredentials:
+    """Refresh stored credentials while holding an exclusive lock on the auth file.
+
+    Refresh tokens are single-use, so concurrent workers must not race each
+    other. If the stored refresh token no longer matches ``stale`` another
+    worker already refreshed, and its credentials are returned as-is.
+    """
+    locking = asyncio.ensure_future(asyncio.to_thread(_lock_file, path))
+    try:
+        fd = await asyncio.shield(locking)
+    except asyncio.CancelledError:
+        # The thread goes on to take the lock; release it as soon as it has.
+        locking.add_done_callback(_unlock_abandoned)
+        raise
+    try:
+        creds = load_credentials(path=path)
+        if not creds:
+            raise RuntimeError("No credentials to refresh")
+        if stale is not None and creds.refresh != stale.refresh:
+            return creds
+        refreshed = await refresh(creds)
+        save_credentials(refreshed, path=path)
+        return refreshed
+    finally:
+        _unlock_file(fd)
+
+
 def save_pkce(state: OAuthState, path: Path = PKCE_FILE, max_entries: int = 5) -> None:
     _ensure_parent(path)
     entries: list[dict] = []
@@ -76,7 +140,7 @@ def save_pkce(state: OAuthState, path: Path = PKCE_FILE, max_entries: int = 5) -
         entry["redirect_uri"] = state.redirect_uri
     entries.insert(0, entry)
     entries = entries[: max_entries if max_entries > 0 else 1]
-    path.write_text(json.dumps(entries, indent=2), encoding="utf-8")
+    _write_atomic(path, json.dumps(entries, indent=2))
 
 
 def load_pkce(state: Optional[str] = None, path: Path = PKCE_FILE) -> Optional[OAuthState]:
@@ -117,3 +181,54 @@ def load_pkce(state: Optional[str] = None, path: Path = PKCE_FILE) -> Optional[O
         )
 
     return None
+
+
+class CredentialCache:
+    """In-memory view of an auth file that is re-parsed only when it changes on disk."""
+
+    def __init__(
+        self,
+        path: Path = AUTH_FILE,
+        refresh: Optional[Callable[[OAuthCredentials], Awaitable[OAuthCredentials]]] = None,
+    ) -> None:
+        self.path = path
+        self._refresh = refresh
+        self._creds: Optional[OAuthCredentials] = None
+        self._mtime_ns: Optional[int] = None
+        self._lock = asyncio.Lock()
+
+    def load(self) -> Optional[OAuthCredentials]:
+        try:
+            mtime_ns = self.path.stat().st_mtime_ns
+        except OSError:
+            self._creds, self._mtime_ns = None, None
+            return None
+        if mtime_ns != self._mtime_ns:
+            self._creds, self._mtime_ns = load_credentials(path=self.path), mtime_ns
+        return self._creds
+
+    def save(self, creds: OAuthCredentials) -> None:
+        save_credentials(creds, path=self.path)
+        self._mtime_ns = None
+        self.load()
+
+    async def refresh(self, stale: Optional[OAuthCredentials] = None) -> OAuthCredentials:
+        if self._refresh is None:
+            raise RuntimeError("No refresh function configured")
+        # The asyncio lock coalesces refreshes within this process; the file
+        # lock in refresh_credentials_locked does the same across workers.
+        async with self._lock:
+            current = self.load()
+            if stale is not None and current is not None and current.refresh != stale.refresh:
+                return current
+            refreshed = await refresh_credentials_locked(self._refresh, path=self.path, stale=stale)
+            self._mtime_ns = None
+            self.load()
+            return refreshed
+
+    async def get_valid(self) -> Optional[OAuthCredentials]:
+        """Return usable credentials, refreshing expired ones; None if not authenticated."""
+        creds = self.load()
+        if creds is None or credentials_valid(creds):
+            return creds
+        return await self.refresh(stale=creds)
@@ -0,0 +1,195 @@
+import asyncio
+import socket
+import time
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+from urllib.request import getproxies
+
+import httpcore
+import httpx
+
+from .config import CODEX_URL, TOKEN_URL
+
+# Origins worth keeping warm: the Codex backend on the hot path, the token endpoint for refreshes.
+CODEX_ORIGIN = str(httpx.URL(CODEX_URL).copy_with(path="/", query=None))
+TOKEN_ORIGIN = str(httpx.URL(TOKEN_URL).copy_with(path="/", query=None))
+
+
+class DNSCache:
+    """Resolved addresses per (host, port), kept for ``ttl`` seconds."""
+
+    def __init__(self, ttl: float = 300.0) -> None:
+        self.ttl = ttl
+        self._entries: Dict[Tuple[str, int], Tuple[float, List[str]]] = {}
+
+    def lookup(self, host: str, port: int) -> Optional[List[str]]:
+        entry = self._entries.get((host, port))
+        if entry is None or entry[0] < time.monotonic():
+            return None
+        return entry[1]
+
+    async def resolve(self, host: str, port: int) -> List[str]:
+        cached = self.lookup(host, port)
+        if cached is not None:
+            return cached
+        infos = await asyncio.get_running_loop().getaddrinfo(host, port, type=socket.SOCK_STREAM)
+        addresses: List[str] = []
+        for _, _, _, _, sockaddr in infos:
+            if sockaddr[0] not in addresses:
+                addresses.append(sockaddr[0])
+        self._entries[(host, port)] = (time.monotonic() + self.ttl, addresses)
+        return addresses
+
+    def invalidate(self, host: str) -> None:
+        for key in [key for key in self._entries if key[0] == host]:
+            del self._entries[key]
+
+
+class _CachedDNSBackend(httpcore.AsyncNetworkBackend):
+    """Connects to addresses from a DNSCache; TLS still verifies and sends SNI for the original host."""
+
+    def __init__(self, cache: DNSCache) -> None:
+        self._cache = cache
+        self._backend = httpcore.AnyIOBackend()
+
+    async def connect_tcp(
+        self,
+        host: str,
+        port: int,
+        timeout: Optional[float] = None,
+        local_address: Optional[str] = None,
+        socket_options: Optional[Iterable[Any]] = None,
+    ) -> httpcore.AsyncNetworkStream:
+        try:
+            addresses = await self._cache.resolve(host, port)
+        except OSError:
+            addresses = []
+        for address in addresses:
+            try:
+                return await self._backend.connect_tcp(
+                    address, port, timeout=timeout, local_address=local_address, socket_options=socket_options
+                )
+            except (httpcore.ConnectError, httpcore.ConnectTimeout):
+                continue
+        # Every cached address failed (or none resolved): forget them and let the backend resolve.
+        self._cache.invalidate(host)
+        return await self._backend.connect_tcp(
+            host, port, timeout=timeout, local_address=local_address, socket_options=socket_options
+        )
+
+    async def connect_unix_socket(
+        self,
+        path: str,
+        timeout: Optional[float] = None,
+        socket_options: Optional[Iterable[Any]] = None,
+    ) -> httpcore.AsyncNetworkStream:
+        return await self._backend.connect_unix_socket(path, timeout=timeout, socket_options=socket_options)
+
+    async def sleep(self, seconds: float) -> None:
+        await self._backend.sleep(seconds)
+
+
+def create_pooled_client(
+    limits: Optional[httpx.Limits] = None,
+    dns_cache: Optional[DNSCache] = None,
+    **kwargs: Any,
+) -> httpx.AsyncClient:
+    """An AsyncClient whose pool resolves hosts through ``dns_cache``.
+
+    With no cache, when environment proxies are set (a custom transport
+    would bypass them), or if httpcore's pool no longer has the attribute
+    this relies on, this is a plain pooled AsyncClient.
+    """
+    kwargs.setdefault("timeout", None)
+    limits = limits or httpx.Limits()
+    if dns_cache is None or getproxies():
+        return httpx.AsyncClient(limits=limits, **kwargs)
+    transport = httpx.AsyncHTTPTransport(limits=limits)
+    # httpx has no public hook for the network backend; the pool reads this attribute per new connection.
+    # If a later httpx or httpcore drops it, go without the DNS cache rather than fail.
+    pool = getattr(transport, "_pool", None)
+    if not hasattr(pool, "_network_backend"):
+        return httpx.AsyncClient(limits=limits, **kwargs)
+    pool._network_backend = _CachedDNSBackend(dns_cache)
+    return httpx.AsyncClient(transport=transport, **kwargs)
+
+
+async def prewarm(client: httpx.AsyncClient, targets: Dict[str, int], timeout: float = 10.0) -> int:
+    """Open up to ``targets[origin]`` concurrent pooled connections per origin; returns how many answered.
+
+    Each connection carries one HEAD request, so it ends up idle in the pool
+    with TLS done. Failures are ignored: warming is best effort.
+    """
+
+    async def touch(origin: str) -> bool:
+        try:
+            await client.head(origin, timeout=timeout, extensions={"claw_warmup": True})
+        except httpx.HTTPError:
+            return False
+        return True
+
+    results = await asyncio.gather(*(touch(origin) for origin, count in targets.items() for _ in range(count)))
+    return sum(results)
+
+
+class ConnectionWarmer:
+    """Keeps a client's pool warm: warms on start, then again whenever the upstream has been idle.
+
+    Register ``mark_active`` as a request event hook so real traffic postpones
+    the keep-alive pings. ``interval`` should stay below the pool's
+    keep-alive expiry, or idle connections close before they are touched.
+    """
+
+    def __init__(
+        self,
+        client: httpx.AsyncClient,
+        targets: Dict[str, int],
+        *,
+        interval: float = 20.0,
+        dns_cache: Optional[DNSCache] = None,
+    ) -> None:
+        self.client = client
+        self.targets = targets
+        self.interval = interval
+        self.dns_cache = dns_cache
+        self.warmed = 0
+        self.rounds = 0
+        self._last_active = 0.0
+        self._task: Optional[asyncio.Task] = None
+
+    async def mark_active(self, request: Optional[httpx.Request] = None) -> None:
+        if request is not None and request.extensions.get("claw_warmup"):
+            return
+        self._last_active = time.monotonic()
+
+    async def warm(self) -> int:
+        if self.dns_cache is not None:
+            for origin in self.targets:
+                url = httpx.URL(origin)
+                try:
+                    await self.dns_cache.resolve(url.host, url.port or (443 if url.scheme == "https" else 80))
+                except OSError:
+                    pass
+        self.warmed = await prewarm(self.client, self.targets)
+        self.rounds += 1
+        return self.warmed
+
+    async def _run(self) -> None:
+        await self.warm()
+        while True:
+            await asyncio.sleep(self.interval)
+            if time.monotonic() - self._last_active >= self.interval:
+                await self.warm()
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def close(self) -> None:
+        task, self._task = self._task, None
+        if task is None:
+            return
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
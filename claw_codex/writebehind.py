@@ -0,0 +1,86 @@
+import asyncio
+import logging
+from typing import Generic, List, Optional, Tuple, Type, TypeVar
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+
+class WriteBehind(Generic[T]):
+    """Base for sinks that persist records off the request path.
+
+    ``record`` only enqueues; a background task drains the queue in batches
+    and passes them to ``_write`` on a worker thread, so request handlers
+    never wait on storage. Records are dropped (and counted) if the queue is
+    full or their batch fails with one of ``write_errors``. Subclasses
+    implement ``_write`` and may override ``_open`` and ``_close``.
+    """
+
+    # Errors from ``_write`` that drop the batch instead of stopping the writer.
+    write_errors: Tuple[Type[BaseException], ...] = (OSError,)
+    # Names what is written, in log messages.
+    noun = "records"
+
+    def __init__(self, *, batch_size: int = 500, max_queue: int = 10000) -> None:
+        self.batch_size = batch_size
+        self.written = 0
+        self.dropped = 0
+        self._queue: "asyncio.Queue[Optional[T]]" = asyncio.Queue(maxsize=max_queue)
+        self._task: Optional["asyncio.Task[None]"] = None
+
+    async def start(self) -> None:
+        await asyncio.to_thread(self._open)
+        self._task = asyncio.create_task(self._run())
+
+    def record(self, item: T) -> None:
+        if self._task is None:
+            return
+        try:
+            self._queue.put_nowait(item)
+        except asyncio.QueueFull:
+            self.dropped += 1
+
+    async def flush(self) -> None:
+        """Wait until every record enqueued so far has been written."""
+        if self._task is not None:
+            await self._queue.join()
+
+    async def close(self) -> None:
+        if self._task is None:
+            return
+        await self._queue.put(None)
+        await self._task
+        self._task = None
+        self._close()
+
+    def _open(self) -> None:
+        pass
+
+    def _write(self, batch: List[T]) -> None:
+        raise NotImplementedError
+
+    def _close(self) -> None:
+        pass
+
+    async def _run(self) -> None:
+        stopping = False
+        while not stopping:
+            item = await self._queue.get()
+            batch: List[T] = []
+            while item is not None:
+                batch.append(item)
+                if len(batch) >= self.batch_size or self._queue.empty():
+                    break
+                item = self._queue.get_nowait()
+            stopping = item is None
+            try:
+                if batch:
+                    await asyncio.to_thread(self._write, batch)
+                    self.written += len(batch)
+            except self.write_errors:
+                logger.exception("Failed to write %d %s", len(batch), self.noun)
+                self.dropped += len(batch)
+            finally:
+                for _ in range(len(batch) + (1 if stopping else 0)):
+                    self._queue.task_done()
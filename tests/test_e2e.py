@@ -1,31 +1,31 @@
-import importlib
+import asyncio
+import gzip
+import json
+import sys
+import time
 
 from fastapi.testclient import TestClient
+from starlette.requests import Request
 
+from claw_codex.app import admin_streams, cancel_chat_completion, chat_completions, create_app
+from claw_codex.config import Settings
 
-def _build_client(tmp_path, monkeypatch):
-    monkeypatch.setenv("CLAW_CODEX_MOCK", "1")
-    monkeypatch.setenv("CLAW_CODEX_AUTH_DIR", str(tmp_path))
-    monkeypatch.setenv("CLAW_CODEX_AUTH_FILE", str(tmp_path / "auth.json"))
-    monkeypatch.setenv("CLAW_CODEX_PKCE_FILE", str(tmp_path / "pkce.json"))
 
-    config = importlib.import_module("claw_codex.config")
-    storage = importlib.import_module("claw_codex.storage")
-    oauth = importlib.import_module("claw_codex.oauth")
-    codex = importlib.import_module("claw_codex.codex")
-    app_module = importlib.import_module("claw_codex.app")
+def _settings(tmp_path, **overrides):
+    return Settings(
+        mock_mode=True,
+        auth_file=tmp_path / "auth.json",
+        pkce_file=tmp_path / "pkce.json",
+        **overrides,
+    )
 
-    importlib.reload(config)
-    importlib.reload(storage)
-    importlib.reload(oauth)
-    importlib.reload(codex)
-    importlib.reload(app_module)
 
-    return TestClient(app_module.app)
+def _build_client(tmp_path, **overrides):
+    return TestClient(create_app(_settings(tmp_path, **overrides)))
 
 
-def test_mock_oauth_and_chat(tmp_path, monkeypatch):
-    client = _build_client(tmp_path, monkeypatch)
+def test_mock_oauth_and_chat(tmp_path):
+    client = _build_client(tmp_path)
 
     start = client.post("/auth/codex/start")
     assert start.status_code == 200
@@ -57,3 +57,919 @@ def test_mock_oauth_and_chat(tmp_path, monkeypatch):
     assert completion.status_code == 200
     content = completion.json()["choices"][0]["message"]["content"]
     assert "Mock Codex response" in content
+
+
+def test_chat_rejects_malformed_messages(tmp_path):
+    client = _build_client(tmp_path)
+    assert client.post("/auth/codex/exchange", json={"code": "mock"}).status_code == 200
+
+    for messages in (["oops"], [{"content": "no role"}]):
+        malformed = client.post("/v1/chat/completions", json={"model": "claw/codex", "messages": messages})
+        assert malformed.status_code == 400
+        assert "messages[0]" in malformed.json()["detail"]
+
+
+def test_stream_aborts_when_client_disconnects(tmp_path):
+    app = create_app(_settings(tmp_path))
+    client = TestClient(app)
+    assert client.post("/auth/codex/exchange", json={"code": "mock"}).status_code == 200
+
+    payload = json.dumps(
+        {"model": "claw/codex", "messages": [{"role": "user", "content": "Say hello " * 20}], "stream": True}
+    ).encode("utf-8")
+
+    async def _run():
+        messages = [{"type": "http.request", "body": payload, "more_body": False}]
+
+        async def receive():
+            if messages:
+                return messages.pop(0)
+            return {"type": "http.disconnect"}
+
+        scope = {"type": "http", "method": "POST", "path": "/v1/chat/completions", "headers": [], "app": app}
+        response = await chat_completions(Request(scope, receive))
+        return [chunk async for chunk in response.body_iterator]
+
+    chunks = asyncio.run(_run())
+    assert "data: [DONE]\n\n" not in chunks
+    assert app.state.claw.metrics.get("chat_completions_aborted") == 1
+
+
+def test_stream_completes_with_done(tmp_path):
+    client = _build_client(tmp_path)
+    assert client.post("/auth/codex/exchange", json={"code": "mock"}).status_code == 200
+
+    with client.stream(
+        "POST",
+        "/v1/chat/completions",
+        json={"model": "claw/codex", "messages": [{"role": "user", "content": "Stream hello"}], "stream": True},
+    ) as resp:
+        body = "".join(resp.iter_text())
+    assert resp.status_code == 200
+    assert "Mock Codex" in body
+    assert body.rstrip().endswith("data: [DONE]")
+
+
+def test_n_choices_fan_out_and_merge(tmp_path):
+    client = _build_client(tmp_path, max_choices=4)
+    assert client.post("/auth/codex/exchange", json={"code": "mock"}).status_code == 200
+    request = {"model": "claw/codex", "messages": [{"role": "user", "content": "Say hello"}], "n": 3}
+
+    single = client.post("/v1/chat/completions", json={**request, "n": 1}).json()
+    merged = client.post("/v1/chat/completions", json=request).json()
+    assert [choice["index"] for choice in merged["choices"]] == [0, 1, 2]
+    assert all(choice["message"]["content"] == single["choices"][0]["message"]["content"] for choice in merged["choices"])
+    assert merged["usage"]["completion_tokens"] == 3 * single["usage"]["completion_tokens"]
+
+    with client.stream("POST", "/v1/chat/completions", json={**request, "stream": True}) as resp:
+        lines = [line for line in resp.iter_lines() if line.startswith("data: {")]
+    chunks = [json.loads(line[6:])["choices"][0] for line in lines]
+    for index in range(3):
+        mine = [chunk for chunk in chunks if chunk["index"] == index]
+        assert mine[0]["delta"] == {"role": "assistant"}
+        assert mine[-1]["finish_reason"] == "stop"
+        assert "".join(chunk["delta"].get("content", "") for chunk in mine) == single["choices"][0]["message"]["content"]
+
+    assert client.post("/v1/chat/completions", json={**request, "n": 5}).status_code == 400
+    assert client.post("/v1/chat/completions", json={**request, "n": 0}).status_code == 400
+
+
+def test_chat_history_is_trimmed_to_input_budget(tmp_path):
+    client = _build_client(tmp_path, max_input_tokens=200, context_max_tool_output_tokens=50)
+    assert client.post("/auth/codex/exchange", json={"code": "mock"}).status_code == 200
+
+    messages = [{"role": "system", "content": "Be terse."}]
+    for turn in range(5):
+        messages += [
+            {"role": "user", "content": f"step {turn} " * 30},
+            {"role": "assistant", "content": f"done {turn} " * 30},
+        ]
+    messages.append({"role": "user", "content": "summarize"})
+    request = {"model": "claw/codex", "messages": messages}
+
+    response = client.post("/v1/chat/completions", json=request)
+    assert response.status_code == 200
+    context = response.json()["context"]
+    assert context["messages_dropped"] > 0 and context["input_tokens_after"] <= 200
+    assert response.headers["x-claw-tokens-saved"] == str(context["tokens_saved"])
+    assert response.json()["choices"][0]["message"]["content"] == "Mock Codex response to: summarize"
+
+    with client.stream("POST", "/v1/chat/completions", json={**request, "stream": True}) as streamed:
+        assert streamed.headers["x-claw-tokens-saved"] == str(context["tokens_saved"])
+
+    short = client.post("/v1/chat/completions", json={**request, "messages": messages[-1:]})
+    assert "context" not in short.json() and "x-claw-tokens-saved" not in short.headers
+    assert client.get("/metrics").json()["counters"]["context_trimmed"] == 2
+
+
+def test_stop_sequences_and_max_tokens_end_generation_early(tmp_path):
+    client = _build_client(tmp_path)
+    assert client.post("/auth/codex/exchange", json={"code": "mock"}).status_code == 200
+    request = {"model": "claw/codex", "messages": [{"role": "user", "content": "alpha beta gamma delta"}]}
+
+    # The mock streams 16-character deltas, so "response" arrives split across two of them.
+    stopped = client.post("/v1/chat/completions", json={**request, "stop": ["response", "never"]}).json()
+    assert stopped["choices"][0]["message"]["content"] == "Mock Codex "
+    assert stopped["choices"][0]["finish_reason"] == "stop"
+    assert stopped["usage"]["completion_tokens"] == 2
+
+    capped = client.post("/v1/chat/completions", json={**request, "max_tokens": 4}).json()
+    assert capped["choices"][0]["finish_reason"] == "length"
+    assert capped["usage"]["completion_tokens"] == 4
+    assert capped["choices"][0]["message"]["content"].startswith("Mock Codex")
+
+    with client.stream("POST", "/v1/chat/completions", json={**request, "stream": True, "stop": "beta"}) as response:
+        chunks = [json.loads(line[6:]) for line in response.iter_lines() if line.startswith("data: {")]
+    text = "".join(chunk["choices"][0]["delta"].get("content", "") for chunk in chunks)
+    assert text == "Mock Codex response to: alpha "
+    assert chunks[-1]["choices"][0]["finish_reason"] == "stop"
+
+    natural = client.post("/v1/chat/completions", json={**request, "stop": "never", "max_tokens": 1000}).json()
+    assert natural["choices"][0]["message"]["content"] == "Mock Codex response to: alpha beta gamma delta"
+    assert natural["choices"][0]["finish_reason"] == "stop"
+
+    assert client.post("/v1/chat/completions", json={**request, "max_tokens": 0}).status_code == 400
+    assert client.post("/v1/chat/completions", json={**request, "stop": ["a"] * 5}).status_code == 400
+
+
+def test_reasoning_items_are_returned_and_carried_into_the_next_turn(tmp_path):
+    client = _build_client(tmp_path)
+    assert client.post("/auth/codex/exchange", json={"code": "mock"}).status_code == 200
+    messages = [{"role": "user", "content": "plan it"}]
+
+    first = client.post("/v1/chat/completions", json={"model": "claw/codex", "messages": messages}).json()
+    message = first["choices"][0]["message"]
+    assert message["reasoning_details"] == [
+        {"type": "reasoning.encrypted", "id": "rs_mock", "format": "openai-responses-v1", "data": "mock:0"}
+    ]
+
+    # The mock reports how many reasoning items came back in the input.
+    messages += [message, {"role": "user", "content": "go on"}]
+    request = {"model": "claw/codex", "messages": messages, "stream": True}
+    with client.stream("POST", "/v1/chat/completions", json=request) as response:
+        chunks = [json.loads(line[6:]) for line in response.iter_lines() if line.startswith("data: {")]
+    details = [d for chunk in chunks for d in chunk["choices"][0]["delta"].get("reasoning_details", [])]
+    assert [detail["data"] for detail in details] == ["mock:1"]
+    assert chunks[0]["choices"][0]["delta"] == {"role": "assistant"}
+
+
+def test_model_aliases_route_effort_and_verbosity(tmp_path):
+    # ``claw_codex.app`` is the ASGI app; the module is in sys.modules.
+    app_module = sys.modules["claw_codex.app"]
+
+    models_file = tmp_path / "models.json"
+    mini = {"id": "claw/codex-mini", "model": "gpt-mini", "effort": "minimal"}
+    models_file.write_text(json.dumps({"models": [mini]}))
+    client = _build_client(tmp_path, models_file=models_file)
+    server = client.app.state.claw
+    assert client.post("/auth/codex/exchange", json={"code": "mock"}).status_code == 200
+
+    listed = {model["id"]: model for model in client.get("/v1/models").json()["data"]}
+    assert {"claw/codex", "claw/codex-fast", "claw/codex-deep", "claw/codex-mini"} <= set(listed)
+    assert listed["claw/codex-fast"]["reasoning_effort"] == "low"
+    assert listed["claw/codex-mini"]["upstream_model"] == "gpt-mini"
+
+    def body(**payload):
+        return app_module._chat_body(server, {"messages": [{"role": "user", "content": "hi"}], **payload})[3]
+
+    default = body(model="claw/codex")
+    assert default["model"] == server.settings.default_model and "reasoning" not in default
+    assert default["text"] == {"verbosity": "medium"}
+    fast = body(model="claw/codex-fast")
+    assert fast["reasoning"] == {"effort": "low"} and fast["text"] == {"verbosity": "low"}
+    mini = body(model="claw/codex-mini", verbosity="high")
+    assert mini["model"] == "gpt-mini" and mini["reasoning"] == {"effort": "minimal"}
+    assert mini["text"] == {"verbosity": "high"}
+    assert body(model="claw/codex-deep", reasoning_effort="medium")["reasoning"] == {"effort": "medium"}
+    # null means "not set" for both fields, so the alias's values stay.
+    nulls = body(model="claw/codex-fast", reasoning_effort=None, verbosity=None)
+    assert nulls["reasoning"] == {"effort": "low"} and nulls["text"] == {"verbosity": "low"}
+
+    deep = {"model": "claw/codex-deep", "messages": [{"role": "user", "content": "x"}]}
+    response = client.post("/v1/chat/completions", json=deep)
+    assert response.status_code == 200 and response.json()["model"] == "claw/codex-deep"
+    assert client.post("/v1/chat/completions", json={"model": "claw/nope", "messages": []}).status_code == 400
+    bad_effort = {"model": "claw/codex", "messages": [], "reasoning_effort": "max"}
+    assert client.post("/v1/chat/completions", json=bad_effort).status_code == 400
+
+
+def test_stream_options_add_usage_and_timing_chunks(tmp_path):
+    client = _build_client(tmp_path)
+    assert client.post("/auth/codex/exchange", json={"code": "mock"}).status_code == 200
+    request = {"model": "claw/codex", "messages": [{"role": "user", "content": "count it"}], "stream": True, "n": 2}
+
+    def stream(**options):
+        with client.stream("POST", "/v1/chat/completions", json={**request, "stream_options": options}) as response:
+            return [json.loads(line[6:]) for line in response.iter_lines() if line.startswith("data: {")]
+
+    chunks = stream(include_usage=True)
+    *deltas, final = chunks
+    assert all(chunk["usage"] is None and chunk["choices"] for chunk in deltas)
+    assert final["choices"] == [] and final["usage"]["completion_tokens"] > 0
+    assert final["usage"]["total_tokens"] == sum(final["usage"][k] for k in ("prompt_tokens", "completion_tokens"))
+
+    *deltas, final = stream(include_timing=True)
+    stamps = [chunk["timing"]["upstream_ms"] for chunk in deltas]
+    assert stamps == sorted(stamps) and "usage" not in final
+    assert final["timing"]["ttft_ms"] <= final["timing"]["total_ms"]
+    assert final["timing"]["tokens_per_second"] > 0
+
+    assert all("usage" not in chunk and "timing" not in chunk for chunk in stream())
+    bad = {**request, "stream_options": "usage"}
+    assert client.post("/v1/chat/completions", json=bad).status_code == 400
+
+
+def test_websocket_chat_multiplexes_turns_and_keeps_history(tmp_path, monkeypatch):
+    # ``claw_codex.app`` is the ASGI app; the module is in sys.modules.
+    app_module = sys.modules["claw_codex.app"]
+
+    seen = []
+    convert = app_module.convert_messages
+    monkeypatch.setattr(
+        app_module, "convert_messages", lambda messages, policy: seen.append(messages) or convert(messages, policy)
+    )
+    client = _build_client(tmp_path)
+    assert client.post("/auth/codex/exchange", json={"code": "mock"}).status_code == 200
+
+    def until_done(ws, count):
+        frames = []
+        while count:
+            frame = ws.receive_json()
+            frames.append(frame)
+            count -= frame.get("type") == "done"
+        return frames
+
+    def text(frames, request_id, index=0):
+        choices = [f["choices"][0] for f in frames if f.get("request_id") == request_id and "choices" in f]
+        return "".join(c["delta"].get("content", "") for c in choices if c["index"] == index)
+
+    with client.websocket_connect("/v1/chat/ws") as ws:
+        turn = {"type": "chat.completion", "model": "claw/codex"}
+        ws.send_json({**turn, "id": "a", "conversation": "c", "messages": [{"role": "user", "content": "first"}]})
+        ws.send_json({**turn, "id": "b", "n": 2, "messages": [{"role": "user", "content": "other"}]})
+        frames = until_done(ws, 2)
+        assert text(frames, "a") == "Mock Codex response to: first"
+        assert text(frames, "b", 1) == "Mock Codex response to: other"
+        done = {f["request_id"]: f for f in frames if f.get("type") == "done"}
+        assert done["a"]["id"].startswith("chatcmpl_") and done["a"]["usage"]["total_tokens"] > 0
+
+        ws.send_json({**turn, "id": "a", "conversation": "c", "messages": [{"role": "user", "content": "second"}]})
+        assert text(until_done(ws, 1), "a") == "Mock Codex response to: second"
+        assert [m["role"] for m in seen[-1]] == ["user", "assistant", "user"]
+        assert seen[-1][1]["content"] == "Mock Codex response to: first"
+        assert seen[-1][1]["reasoning_details"][0]["data"] == "mock:0"
+
+        ws.send_json({"type": "reset", "conversation": "c"})
+        assert ws.receive_json() == {"type": "reset", "conversation": "c"}
+        ws.send_json({**turn, "id": "bad", "model": "nope"})
+        assert ws.receive_json()["error"]["code"] == 400
+        ws.send_json({**turn, "id": "bad", "messages": ["oops"]})
+        assert ws.receive_json()["error"]["code"] == 400
+        ws.send_json({"type": "cancel", "id": "missing"})
+        assert ws.receive_json()["error"]["code"] == 404
+    assert client.app.state.claw.metrics.get("chat_completions_websocket") == 3
+
+
+
+def test_websocket_history_is_capped_and_failed_turns_still_end(tmp_path, monkeypatch):
+    app_module = sys.modules["claw_codex.app"]
+
+    seen = []
+    convert = app_module.convert_messages
+
+    def record(messages, policy):
+        if messages[-1]["content"] == "explode":
+            raise KeyError("boom")
+        seen.append(messages)
+        return convert(messages, policy)
+
+    monkeypatch.setattr(app_module, "convert_messages", record)
+    client = _build_client(tmp_path, websocket_history_turns=2)
+    assert client.post("/auth/codex/exchange", json={"code": "mock"}).status_code == 200
+
+    def until_done(ws):
+        frames = [ws.receive_json()]
+        while frames[-1].get("type") != "done":
+            frames.append(ws.receive_json())
+        return frames
+
+    with client.websocket_connect("/v1/chat/ws") as ws:
+        turn = {"type": "chat.completion", "model": "claw/codex", "conversation": "c"}
+        for number in range(4):
+            ws.send_json({**turn, "id": "t", "messages": [{"role": "user", "content": f"turn {number}"}]})
+            until_done(ws)
+        # Two earlier turns, then the new one.
+        assert [m["content"] for m in seen[-1] if m["role"] == "user"] == ["turn 1", "turn 2", "turn 3"]
+
+        ws.send_json({**turn, "id": "x", "messages": [{"role": "user", "content": "explode"}]})
+        error, done = until_done(ws)
+        assert error["type"] == "error" and error["error"]["code"] == 500
+        assert done["type"] == "done" and done["request_id"] == "x"
+
+        ws.send_json({**turn, "id": "t", "messages": [{"role": "user", "content": "after"}]})
+        assert until_done(ws)[-1]["type"] == "done"
+
+def test_compressed_request_and_response(tmp_path):
+    client = _build_client(tmp_path, compress_min_bytes=0, max_request_body_bytes=4096)
+    assert client.post("/auth/codex/exchange", json={"code": "mock"}).status_code == 200
+
+    payload = {"model": "claw/codex", "messages": [{"role": "user", "content": "Say hello"}]}
+    completion = client.post(
+        "/v1/chat/completions",
+        content=gzip.compress(json.dumps(payload).encode("utf-8")),
+        headers={"Content-Type": "application/json", "Content-Encoding": "gzip", "Accept-Encoding": "gzip"},
+    )
+    assert completion.status_code == 200
+    assert completion.headers["content-encoding"] == "gzip"
+    assert "Mock Codex response" in completion.json()["choices"][0]["message"]["content"]
+
+    bomb = {"model": "claw/codex", "messages": [{"role": "user", "content": "x" * 100_000}]}
+    too_large = client.post(
+        "/v1/chat/completions",
+        content=gzip.compress(json.dumps(bomb).encode("utf-8")),
+        headers={"Content-Type": "application/json", "Content-Encoding": "gzip"},
+    )
+    assert too_large.status_code == 413
+
+    truncated = client.post(
+        "/v1/chat/completions",
+        content=gzip.compress(json.dumps(payload).encode("utf-8"))[:-8],
+        headers={"Content-Type": "application/json", "Content-Encoding": "gzip"},
+    )
+    assert truncated.status_code == 400
+    assert truncated.json()["detail"] == "Invalid gzip request body"
+
+    unsupported = client.post(
+        "/v1/chat/completions",
+        content=b"{}",
+        headers={"Content-Type": "application/json", "Content-Encoding": "br"},
+    )
+    assert unsupported.status_code == 415
+
+
+
+def test_zstandard_body_stops_decoding_at_the_limit():
+    import pytest
+
+    zstandard = pytest.importorskip("zstandard")
+    from claw_codex.compression import BodyTooLarge, _ZstandardDecoder
+
+    bomb = zstandard.ZstdCompressor().compress(b"x" * (64 * 1024 * 1024))
+    decoder = _ZstandardDecoder()
+    with pytest.raises(BodyTooLarge):
+        decoder.feed(bomb, 4096)
+    # Rejected after the first block of output instead of inflating all 64 MiB.
+    assert len(decoder._sink.out) <= 4096
+
+    decoder = _ZstandardDecoder()
+    payload = json.dumps({"messages": []}).encode("utf-8")
+    framed = zstandard.ZstdCompressor().compress(payload)
+    assert decoder.feed(framed[:5], 4096) + decoder.feed(framed[5:], 4096) == payload
+
+def test_apps_are_isolated_and_own_their_pool(tmp_path):
+    first = create_app(_settings(tmp_path / "a"))
+    second = create_app(_settings(tmp_path / "b", max_concurrent_completions=1))
+
+    with TestClient(first) as client_a, TestClient(second) as client_b:
+        assert first.state.claw.http is not None
+        assert client_a.post("/auth/codex/exchange", json={"code": "mock"}).status_code == 200
+        assert client_a.get("/auth/codex/status").json()["authenticated"] is True
+        assert client_b.get("/auth/codex/status").json()["authenticated"] is False
+
+    assert first.state.claw.http is None
+
+
+def test_settings_from_environment(tmp_path, monkeypatch):
+    monkeypatch.setenv("CLAW_CODEX_MOCK", "1")
+    monkeypatch.setenv("CLAW_CODEX_AUTH_FILE", str(tmp_path / "auth.json"))
+    settings = Settings.from_env()
+    assert settings.mock_mode is True
+    assert settings.auth_file == tmp_path / "auth.json"
+
+
+def test_responses_passthrough_relays_sse_and_records_usage(tmp_path):
+    app = create_app(_settings(tmp_path))
+    client = TestClient(app)
+    assert client.post("/auth/codex/exchange", json={"code": "mock"}).status_code == 200
+
+    body = {"model": "gpt-5.2", "stream": True, "input": [{"role": "user", "content": "Relay hello"}]}
+    with client.stream("POST", "/v1/responses", json=body) as resp:
+        raw = b"".join(resp.iter_bytes())
+    assert resp.status_code == 200
+    assert resp.headers["content-type"].startswith("text/event-stream")
+    assert b"event: response.output_text.delta" in raw
+    assert raw.rstrip().splitlines()[-1].startswith(b"data: {\"type\": \"response.completed\"")
+    assert app.state.claw.metrics.get("total_tokens") > 0
+
+
+def test_completed_event_sniffer_handles_split_frames():
+    from claw_codex.codex import CompletedEventSniffer
+
+    frame = b'event: response.completed\ndata: {"type": "response.completed", "response": {"usage": {"input_tokens": 3}}}\n\n'
+    stream = b'data: {"type": "response.output_text.delta", "delta": "hi"}\n\n' + frame
+    sniffer = CompletedEventSniffer()
+    for i in range(0, len(stream), 7):
+        sniffer.feed(stream[i : i + 7])
+    assert sniffer.response == {"usage": {"input_tokens": 3}}
+
+
+def test_responses_passthrough_forwards_bytes_unchanged(tmp_path):
+    import httpx
+
+    from claw_codex.storage import OAuthCredentials, save_credentials
+
+    upstream_body = (
+        b'event: response.output_text.delta\ndata: {"type":"response.output_text.delta","delta":"Hi"}\n\n'
+        b'event: response.completed\ndata: {"type":"response.completed","response":{"usage":{"total_tokens":7}}}\n\n'
+    )
+    seen = {}
+
+    def handler(request):
+        seen["authorization"] = request.headers["authorization"]
+        seen["body"] = request.content
+        if b"fail" in request.content:
+            return httpx.Response(429, json={"detail": "slow down"})
+        return httpx.Response(200, content=upstream_body, headers={"content-type": "text/event-stream"})
+
+    app = create_app(Settings(mock_mode=False, auth_file=tmp_path / "auth.json", pkce_file=tmp_path / "pkce.json"))
+    save_credentials(OAuthCredentials("tok", "ref", 2**42, "acct"), path=tmp_path / "auth.json")
+    app.state.claw.http = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+    client = TestClient(app)
+
+    request_body = b'{"model":"gpt-5.2","input":[]}'
+    resp = client.post("/v1/responses", content=request_body, headers={"content-type": "application/json"})
+    assert resp.status_code == 200
+    assert resp.content == upstream_body
+    assert seen == {"authorization": "Bearer tok", "body": request_body}
+    assert app.state.claw.metrics.get("total_tokens") == 7
+
+    failed = client.post("/v1/responses", content=b'{"fail":true}')
+    assert failed.status_code == 429
+    assert failed.json() == {"detail": "slow down"}
+
+
+def test_usage_ledger_records_streaming_and_non_streaming(tmp_path):
+    app = create_app(_settings(tmp_path, usage_db=tmp_path / "usage.db"))
+    messages = [{"role": "user", "content": "Count my tokens"}]
+
+    with TestClient(app) as client:
+        assert client.post("/auth/codex/exchange", json={"code": "mock"}).status_code == 200
+        headers = {"X-Claw-Caller": "agent-a"}
+        body = {"model": "claw/codex", "messages": messages}
+        assert client.post("/v1/chat/completions", json=body, headers=headers).status_code == 200
+        with client.stream("POST", "/v1/chat/completions", json={**body, "stream": True}, headers=headers) as resp:
+            "".join(resp.iter_text())
+
+        usage = client.get("/v1/usage", params={"since": "1h", "group_by": "caller"})
+        assert usage.status_code == 200
+        rows = usage.json()["data"]
+        assert len(rows) == 1
+        assert rows[0]["caller"] == "agent-a"
+        assert rows[0]["requests"] == 2
+        assert rows[0]["total_tokens"] > 0
+
+        assert client.get("/v1/usage", params={"group_by": "nope"}).status_code == 400
+
+
+def test_usage_is_scoped_to_the_callers_key(tmp_path):
+    keys_file = tmp_path / "keys.json"
+    keys = [
+        {"name": "agent-a", "key": "k-a"},
+        {"name": "agent-b", "key": "k-b"},
+        {"name": "ops", "key": "k-ops", "admin": True},
+    ]
+    keys_file.write_text(json.dumps({"keys": keys}))
+    app = create_app(_settings(tmp_path, usage_db=tmp_path / "usage.db", api_keys_file=keys_file))
+    body = {"model": "claw/codex", "messages": [{"role": "user", "content": "Count my tokens"}]}
+
+    with TestClient(app) as client:
+        assert client.post("/auth/codex/exchange", json={"code": "mock"}).status_code == 200
+        for key in ("k-a", "k-b", "k-b"):
+            headers = {"Authorization": f"Bearer {key}"}
+            assert client.post("/v1/chat/completions", json=body, headers=headers).status_code == 200
+
+        def usage(key):
+            resp = client.get("/v1/usage", params={"group_by": "caller"}, headers={"Authorization": f"Bearer {key}"})
+            assert resp.status_code == 200
+            return {row["caller"]: row["requests"] for row in resp.json()["data"]}
+
+        assert usage("k-a") == {"agent-a": 1}
+        assert usage("k-b") == {"agent-b": 2}
+        assert usage("k-ops") == {"agent-a": 1, "agent-b": 2}
+        assert client.get("/v1/usage").status_code == 401
+
+
+def test_parse_time_bound():
+    from claw_codex.ledger import parse_duration, parse_time_bound
+
+    assert parse_duration("90") == 90
+    assert parse_duration("2h") == 7200
+    assert parse_time_bound("30m", now=10_000) == 8_200
+    assert parse_time_bound("1700000000") == 1_700_000_000
+    assert parse_time_bound(None) is None
+
+
+def test_api_keys_and_rate_limits(tmp_path):
+    keys_file = tmp_path / "keys.json"
+    keys_file.write_text(json.dumps({"keys": [{"name": "agent-a", "key": "secret-a", "rpm": 2}]}))
+    app = create_app(_settings(tmp_path, api_keys_file=keys_file))
+    app.state.claw.api_keys.check_interval = 0
+    client = TestClient(app)
+    assert client.post("/auth/codex/exchange", json={"code": "mock"}).status_code == 200
+
+    body = {"model": "claw/codex", "messages": [{"role": "user", "content": "hi"}]}
+    assert client.post("/v1/chat/completions", json=body).status_code == 401
+    assert client.get("/v1/models", headers={"Authorization": "Bearer wrong"}).status_code == 401
+
+    auth = {"Authorization": "Bearer secret-a"}
+    assert client.post("/v1/chat/completions", json=body, headers=auth).status_code == 200
+    assert client.post("/v1/chat/completions", json=body, headers=auth).status_code == 200
+    limited = client.post("/v1/chat/completions", json=body, headers=auth)
+    assert limited.status_code == 429
+    assert int(limited.headers["retry-after"]) >= 1
+
+    # Hot reload: a token-per-minute cap is charged from actual usage after each completion.
+    keys_file.write_text(json.dumps({"keys": [{"name": "agent-b", "key": "secret-b", "tpm": 3}]}))
+    auth = {"Authorization": "Bearer secret-b"}
+    assert client.post("/v1/chat/completions", json=body, headers=auth).status_code == 200
+    assert client.post("/v1/chat/completions", json=body, headers=auth).status_code == 429
+    assert client.get("/v1/models", headers={"Authorization": "Bearer secret-a"}).status_code == 401
+
+
+def test_token_bucket_refills_over_time():
+    from claw_codex.ratelimit import TokenBucket
+
+    bucket = TokenBucket(60, period_seconds=60)
+    bucket.take(70, now=bucket.updated)
+    assert bucket.wait_time(1, now=bucket.updated) == 11
+    assert bucket.wait_time(1, now=bucket.updated + 11) == 0
+
+
+def test_circuit_breaker_opens_probes_and_closes():
+    from claw_codex.breaker import CircuitBreaker, CircuitOpenError
+
+    breaker = CircuitBreaker(window_seconds=10, min_calls=4, failure_ratio=0.5, open_seconds=5, half_open_probes=2)
+    for now in (0, 1):
+        breaker.record_success(breaker.before_call(now), 0.1, now)
+        breaker.record_failure(breaker.before_call(now), now)
+    assert breaker.state(1) == "open"
+    try:
+        breaker.before_call(2)
+    except CircuitOpenError as exc:
+        assert exc.retry_after == 4
+    else:
+        raise AssertionError("expected the open circuit to fail fast")
+
+    probes = [breaker.before_call(6), breaker.before_call(6)]
+    assert probes == [True, True]
+    assert breaker.retry_after(6) > 0
+    breaker.record_success(True, 0.1, 6)
+    breaker.record_success(True, 0.1, 6)
+    assert breaker.state(6) == "closed"
+
+    # Old outcomes age out of the window instead of tripping the circuit later.
+    for now in (7, 8):
+        breaker.record_failure(breaker.before_call(now), now)
+    for now in (20, 21):
+        breaker.record_failure(breaker.before_call(now), now)
+    assert breaker.state(21) == "closed"
+
+    # A probe that outlives its half-open period does not count in the next one.
+    for now in (30, 31, 32, 33):
+        breaker.record_failure(breaker.before_call(now), now)
+    stale = breaker.start_call()
+    breaker.record_failure(breaker.before_call(40), 40)
+    assert breaker.before_call(46) is True
+    stale.ok = True
+    stale.finish()
+    assert breaker.snapshot(46)["probes_in_flight"] == 1
+    breaker.record_success(True, 0.1, 46)
+    assert breaker.state(46) == "half_open"
+
+
+def test_open_circuit_fails_fast_with_503(tmp_path):
+    import httpx
+
+    from claw_codex.storage import OAuthCredentials, save_credentials
+
+    calls = []
+
+    def handler(request):
+        calls.append(request)
+        return httpx.Response(502, text="bad gateway")
+
+    app = create_app(
+        Settings(
+            mock_mode=False,
+            auth_file=tmp_path / "auth.json",
+            pkce_file=tmp_path / "pkce.json",
+            breaker_min_calls=3,
+            breaker_open_seconds=30,
+        )
+    )
+    save_credentials(OAuthCredentials("tok", "ref", 2**42, "acct"), path=tmp_path / "auth.json")
+    app.state.claw.http = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+    client = TestClient(app)
+
+    chat = {"model": "claw/codex", "messages": [{"role": "user", "content": "hi"}], "stream": False}
+    assert client.post("/v1/chat/completions", json=chat).status_code == 400
+    # Once a stream has started, the upstream failure arrives as a final error chunk.
+    with client.stream("POST", "/v1/chat/completions", json={**chat, "stream": True}) as resp:
+        lines = [line for line in resp.iter_lines() if line]
+    assert json.loads(lines[-2][len("data: "):])["error"]["code"] == 502
+    assert lines[-1] == "data: [DONE]"
+    assert client.post("/v1/responses", content=b'{"input":[]}').status_code == 502
+    assert len(calls) == 3
+
+    rejected = client.post("/v1/chat/completions", json=chat)
+    assert rejected.status_code == 503
+    assert int(rejected.headers["retry-after"]) > 0
+    assert client.post("/v1/responses", content=b'{"input":[]}').status_code == 503
+    assert len(calls) == 3
+
+    status = client.get("/status").json()
+    assert status["ok"] is False
+    assert status["circuit"]["state"] == "open"
+    assert client.get("/metrics").json()["circuit"]["times_opened"] == 1
+
+
+def test_phase_timeouts_and_caller_deadline(tmp_path):
+    import httpx
+
+    from claw_codex.storage import OAuthCredentials, save_credentials
+
+    async def stalled():
+        yield b'data: {"type":"response.output_text.delta","delta":"Hi"}\n\n'
+        await asyncio.sleep(5)
+
+    def handler(request):
+        return httpx.Response(200, content=stalled(), headers={"content-type": "text/event-stream"})
+
+    app = create_app(
+        Settings(
+            mock_mode=False,
+            auth_file=tmp_path / "auth.json",
+            pkce_file=tmp_path / "pkce.json",
+            idle_timeout=0.2,
+            breaker_min_calls=1,
+        )
+    )
+    save_credentials(OAuthCredentials("tok", "ref", 2**42, "acct"), path=tmp_path / "auth.json")
+    app.state.claw.http = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+    client = TestClient(app)
+    chat = {"model": "claw/codex", "messages": [{"role": "user", "content": "hi"}]}
+
+    # The caller's deadline is tighter than the idle limit, and does not count against the upstream.
+    resp = client.post("/v1/chat/completions", json={**chat, "timeout": 0.1})
+    assert resp.status_code == 504
+    assert "deadline" in resp.json()["detail"]
+    assert app.state.claw.breaker.state() == "closed"
+
+    with client.stream("POST", "/v1/chat/completions", json={**chat, "stream": True}) as resp:
+        lines = [line for line in resp.iter_lines() if line]
+    assert '"Hi"' in lines[1]
+    error = json.loads(lines[-2][len("data: "):])["error"]
+    assert error["code"] == "idle_timeout"
+    assert lines[-1] == "data: [DONE]"
+    assert app.state.claw.metrics.get("upstream_timeouts") == 2
+
+    for header in ("soon", "nan", "inf", "1e400"):
+        bad = client.post("/v1/chat/completions", json=chat, headers={"X-Request-Deadline": header})
+        assert bad.status_code == 400
+    for timeout in ("NaN", "Infinity", "1e400"):
+        raw = json.dumps(chat)[:-1] + f', "timeout": {timeout}}}'
+        bad = client.post("/v1/chat/completions", content=raw, headers={"Content-Type": "application/json"})
+        assert bad.status_code == 400
+
+
+def test_cancel_in_flight_stream(tmp_path):
+    app = create_app(_settings(tmp_path, max_concurrent_completions=1))
+    client = TestClient(app)
+    assert client.post("/auth/codex/exchange", json={"code": "mock"}).status_code == 200
+    assert client.post("/v1/chat/completions/chatcmpl_missing/cancel").status_code == 404
+    # With several workers the completion may be running in another process.
+    workers = TestClient(create_app(_settings(tmp_path, workers=2)))
+    elsewhere = workers.post("/v1/chat/completions/chatcmpl_missing/cancel")
+    assert elsewhere.status_code == 421
+    assert elsewhere.headers["connection"] == "close"
+
+    payload = json.dumps(
+        {"model": "claw/codex", "messages": [{"role": "user", "content": "Say hello " * 20}], "stream": True}
+    ).encode("utf-8")
+
+    async def _run():
+        messages = [{"type": "http.request", "body": payload, "more_body": False}]
+
+        async def receive():
+            if messages:
+                return messages.pop(0)
+            await asyncio.Event().wait()
+
+        scope = {
+            "type": "http",
+            "method": "POST",
+            "path": "/v1/chat/completions",
+            "headers": [(b"x-claw-completion-id", b"chatcmpl_mine")],
+            "app": app,
+        }
+        response = await chat_completions(Request(scope, receive))
+        assert response.headers["x-claw-completion-id"] == "chatcmpl_mine"
+        chunks = []
+        async for chunk in response.body_iterator:
+            chunks.append(chunk)
+            if len(chunks) == 2:
+                cancel_scope = {"type": "http", "method": "POST", "path": "/", "headers": [], "app": app}
+                result = await cancel_chat_completion(Request(cancel_scope, receive), "chatcmpl_mine", key=None)
+                assert json.loads(result.body)["cancelled"] is True
+        # The slot is free again: another completion gets it straight away.
+        assert not app.state.claw._slots.locked()
+        return chunks
+
+    chunks = asyncio.run(_run())
+    assert '"finish_reason": "cancelled"' in chunks[-2]
+    assert chunks[-1] == "data: [DONE]\n\n"
+    assert len(chunks) < 10
+    assert app.state.claw.metrics.get("chat_completions_cancelled") == 1
+    assert len(app.state.claw.inflight) == 0
+
+
+def test_admin_streams_lists_live_completions(tmp_path):
+    keys_file = tmp_path / "keys.json"
+    keys_file.write_text(
+        json.dumps({"keys": [{"name": "agent", "key": "k-agent"}, {"name": "ops", "key": "k-ops", "admin": True}]})
+    )
+    app = create_app(_settings(tmp_path, max_concurrent_completions=1, api_keys_file=keys_file))
+    client = TestClient(app)
+    assert client.post("/auth/codex/exchange", json={"code": "mock"}).status_code == 200
+    assert client.get("/admin/streams", headers={"Authorization": "Bearer k-agent"}).status_code == 403
+    idle = client.get("/admin/streams", headers={"Authorization": "Bearer k-ops"}).json()
+    assert idle["in_flight"] == 0
+    assert idle["slots"] == {"limit": 1, "in_use": 0}
+
+    payload = json.dumps(
+        {"model": "claw/codex", "messages": [{"role": "user", "content": "Say hello " * 20}], "stream": True}
+    ).encode("utf-8")
+
+    async def _run():
+        async def receive():
+            await asyncio.Event().wait()
+
+        def request(completion_id):
+            body = [{"type": "http.request", "body": payload, "more_body": False}]
+
+            async def first_receive():
+                return body.pop(0) if body else await receive()
+
+            headers = [(b"authorization", b"Bearer k-agent"), (b"x-claw-completion-id", completion_id.encode())]
+            scope = {"type": "http", "method": "POST", "path": "/", "headers": headers, "app": app}
+            req = Request(scope, first_receive)
+            req.state.api_key = app.state.claw.api_keys.lookup("k-agent")
+            return req
+
+        running = await chat_completions(request("chatcmpl_running"))
+        await chat_completions(request("chatcmpl_waiting"))
+        chunks = running.body_iterator
+        # Role, reasoning, then the first text delta.
+        for _ in range(3):
+            await chunks.__anext__()
+        scope = {"type": "http", "method": "GET", "path": "/", "headers": [], "app": app}
+        snapshot = json.loads((await admin_streams(Request(scope, receive))).body)
+        await chunks.aclose()
+        return snapshot
+
+    snapshot = asyncio.run(_run())
+    assert snapshot["in_flight"] == 2
+    assert snapshot["phases"] == {"queued": 1, "connecting": 0, "streaming": 1}
+    assert snapshot["slots"] == {"limit": 1, "in_use": 1}
+    assert snapshot["worker"]["workers"] == 1
+    streams = {stream["id"]: stream for stream in snapshot["streams"]}
+    running = streams["chatcmpl_running"]
+    assert running["caller"] == "agent"
+    assert running["account_id"] == "mock-account"
+    assert running["deltas"] == 1
+    assert running["bytes_sent"] > 0
+    assert running["ttft_seconds"] is not None
+    assert streams["chatcmpl_waiting"]["phase"] == "queued"
+
+
+def test_profiler_samples_and_admin_profile_endpoint(tmp_path):
+    from claw_codex.profiling import ProfileSession
+
+    def spin(deadline):
+        while time.monotonic() < deadline:
+            pass
+
+    session = ProfileSession(interval=0.001, allocations=True)
+    session.start()
+    spin(time.monotonic() + 0.1)
+    kept = [bytearray(1024) for _ in range(64)]
+    result = session.stop()
+    assert result["samples"] > 0
+    assert "spin (tests/test_e2e.py" in result["cpu_collapsed"]
+    assert result["alloc_bytes"] >= 64 * 1024 and kept
+
+    assert _build_client(tmp_path).post("/admin/profile?seconds=0.1").status_code == 404
+    client = _build_client(tmp_path, profiling_enabled=True)
+    assert client.post("/admin/profile?seconds=0").status_code == 400
+    profile = client.post("/admin/profile?seconds=0.1&interval_ms=1")
+    assert profile.status_code == 200
+    assert profile.json()["samples"] > 0
+    collapsed = client.post("/admin/profile?seconds=0.1&interval_ms=1&format=collapsed")
+    assert collapsed.headers["content-type"].startswith("text/plain")
+    assert collapsed.text.strip().rsplit(" ", 1)[-1].isdigit()
+
+
+def test_access_log_records_timings_and_rotates(tmp_path):
+    log_path = tmp_path / "logs" / "access-{pid}.jsonl"
+    request = {"model": "claw/codex", "messages": [{"role": "user", "content": "Say hello"}]}
+    with TestClient(create_app(_settings(tmp_path, access_log=log_path))) as client:
+        assert client.post("/auth/codex/exchange", json={"code": "mock"}).status_code == 200
+        assert client.post("/v1/chat/completions", json=request).status_code == 200
+        with client.stream("POST", "/v1/chat/completions", json={**request, "stream": True}) as resp:
+            "".join(resp.iter_text())
+        assert client.post("/v1/chat/completions", json={**request, "model": "nope"}).status_code == 400
+        written = client.get("/metrics").json()["access_log"]
+    [path] = (tmp_path / "logs").iterdir()
+    lines = [json.loads(line) for line in path.read_text().splitlines()]
+    assert written["path"] == str(path)
+    assert [(line["method"], line["path"], line["http_status"]) for line in lines] == [
+        ("POST", "/auth/codex/exchange", 200),
+        ("POST", "/v1/chat/completions", 200),
+        ("POST", "/v1/chat/completions", 200),
+        ("POST", "/v1/chat/completions", 400),
+        ("GET", "/metrics", 200),
+    ]
+    plain, streamed, rejected = lines[1:4]
+    assert plain["status"] == streamed["status"] == "ok"
+    assert rejected["status"] == "error" and "completion_id" not in rejected
+    assert plain["completion_id"].startswith("chatcmpl_") and plain["total_tokens"] > 0
+    assert streamed["queue_ms"] <= streamed["ttft_ms"] <= streamed["total_ms"]
+    assert streamed["bytes_sent"] > 0 and streamed["deltas"] > 0
+
+    from claw_codex.accesslog import AccessLog
+
+    async def _run():
+        log = AccessLog(tmp_path / "rotating.jsonl", sample_rate=0.0, max_bytes=200, backups=2)
+        await log.start()
+        for index in range(12):
+            log.record({"status": "ok", "index": index})
+            log.record({"status": "error", "index": index, "pad": "x" * 40})
+            await log.flush()
+        await log.close()
+        return log
+
+    log = asyncio.run(_run())
+    assert log.sampled_out == 12 and log.written == 12 and log.rotations > 2
+    assert sorted(p.name for p in tmp_path.glob("rotating.jsonl*")) == [
+        "rotating.jsonl",
+        "rotating.jsonl.1",
+        "rotating.jsonl.2",
+    ]
+
+
+def test_health_readiness_and_drain(tmp_path):
+    from starlette.websockets import WebSocketDisconnect
+
+    from claw_codex.inflight import InFlight
+
+    app = create_app(_settings(tmp_path))
+    client = TestClient(app)
+    assert client.get("/healthz").json() == {"ok": True, "draining": False, "in_flight": 0}
+    missing = client.get("/readyz")
+    assert missing.status_code == 503
+    assert missing.json()["credentials"] == "missing"
+
+    assert client.post("/auth/codex/exchange", json={"code": "mock"}).status_code == 200
+    ready = client.get("/readyz")
+    assert ready.status_code == 200
+    assert ready.json() == {
+        "ready": True,
+        "draining": False,
+        "credentials": "valid",
+        "circuit": "closed",
+        "in_flight": 0,
+    }
+
+    server = app.state.claw
+    server.begin_drain()
+    assert client.get("/healthz").json()["draining"] is True
+    assert client.get("/readyz").status_code == 503
+    request = {"model": "claw/codex", "messages": [{"role": "user", "content": "hi"}]}
+    refused = client.post("/v1/chat/completions", json=request)
+    assert refused.status_code == 503
+    assert refused.headers["retry-after"] == "1"
+    assert client.post("/v1/responses", json={"model": "claw/codex", "input": "hi"}).status_code == 503
+    try:
+        with client.websocket_connect("/v1/chat/ws"):
+            raise AssertionError("a draining server accepted a WebSocket")
+    except WebSocketDisconnect as exc:
+        assert exc.code == 1012
+
+    # Past the deadline whatever is still running is aborted so shutdown can proceed.
+    entry = server.inflight.register(InFlight("chatcmpl_slow"))
+    assert not server.drained(time.monotonic() + 60)
+    assert server.drained(time.monotonic() - 1)
+    assert entry.abort.is_set()
+    server.inflight.unregister(entry)
+    assert server.drained()
+    assert client.get("/metrics").json()["counters"]["drain_aborted"] == 1
@@ -0,0 +1,33 @@
+import subprocess
+import sys
+
+SERVER_MODULES = ("fastapi", "starlette", "pydantic", "uvicorn", "claw_codex.app", "claw_codex.demo")
+
+
+def _loaded_after(stmt: str) -> list:
+    code = f"import sys; {stmt}; print(','.join(m for m in {SERVER_MODULES!r} if m in sys.modules))"
+    out = subprocess.run([sys.executable, "-c", code], check=True, capture_output=True, text=True)
+    return [m for m in out.stdout.strip().split(",") if m]
+
+
+def test_library_import_skips_server_stack():
+    assert _loaded_after("from claw_codex import ClawCodexClient, AsyncClawCodexClient") == []
+    assert _loaded_after("import claw_codex.cli") == []
+
+
+def test_app_attribute_is_lazy():
+    code = (
+        "import sys, claw_codex; assert 'fastapi' not in sys.modules; "
+        "from fastapi import FastAPI; assert isinstance(claw_codex.app, FastAPI); "
+        "assert claw_codex.app is claw_codex.app"
+    )
+    subprocess.run([sys.executable, "-c", code], check=True)
+
+
+def test_app_attribute_survives_submodule_import():
+    code = (
+        "import claw_codex.app; from fastapi import FastAPI; import claw_codex; "
+        "assert isinstance(claw_codex.app, FastAPI); "
+        "from claw_codex import app; assert app is sys.modules['claw_codex.app'].app"
+    )
+    subprocess.run([sys.executable, "-c", "import sys; " + code], check=True)
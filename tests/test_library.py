@@ -107,3 +107,369 @@ def test_approach_b_state_encoding():
     
     # But the state should be encoded with the actual redirect
     assert oauth_state.redirect_uri == actual_redirect
+
+
+def test_concurrent_refresh_uses_single_grant(tmp_path):
+    from claw_codex.storage import OAuthCredentials, refresh_credentials_locked, save_credentials
+
+    auth_file = tmp_path / "auth.json"
+    stale = OAuthCredentials(access="old", refresh="refresh-1", expires=0, account_id="acct")
+    save_credentials(stale, path=auth_file)
+    grants = []
+
+    async def _grant(creds):
+        grants.append(creds.refresh)
+        await asyncio.sleep(0.01)
+        return OAuthCredentials(access="new", refresh="refresh-2", expires=2**40, account_id="acct")
+
+    async def _refresh_twice():
+        return await asyncio.gather(
+            refresh_credentials_locked(_grant, path=auth_file, stale=stale),
+            refresh_credentials_locked(_grant, path=auth_file, stale=stale),
+        )
+
+    first, second = asyncio.run(_refresh_twice())
+    assert grants == ["refresh-1"]
+    assert first.access == second.access == "new"
+
+
+
+def test_refresh_cancelled_while_waiting_for_the_lock_releases_it(tmp_path):
+    import fcntl
+    import os
+
+    from claw_codex.storage import _lock_file, _unlock_file, refresh_credentials_locked
+
+    auth_file = tmp_path / "auth.json"
+
+    async def _grant(creds):
+        return creds
+
+    async def _run():
+        held = _lock_file(auth_file)
+        waiting = asyncio.create_task(refresh_credentials_locked(_grant, path=auth_file))
+        await asyncio.sleep(0.1)
+        waiting.cancel()
+        try:
+            await waiting
+        except asyncio.CancelledError:
+            pass
+        _unlock_file(held)
+        # The abandoned waiter takes the lock once it is free and must hand it straight back.
+        await asyncio.sleep(0.2)
+
+    asyncio.run(_run())
+    fd = os.open(str(tmp_path / "auth.json.lock"), os.O_RDWR)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    finally:
+        os.close(fd)
+
+def test_warmer_preopens_connections_through_dns_cache():
+    from claw_codex.warmup import ConnectionWarmer, DNSCache, create_pooled_client
+
+    async def _run():
+        accepted = []
+
+        async def handle(reader, writer):
+            accepted.append(writer)
+            try:
+                while await reader.readuntil(b"\r\n\r\n"):
+                    writer.write(b"HTTP/1.1 200 OK\r\nContent-Length: 0\r\n\r\n")
+                    await writer.drain()
+            except (asyncio.IncompleteReadError, ConnectionError):
+                writer.close()
+
+        server = await asyncio.start_server(handle, "127.0.0.1", 0)
+        port = server.sockets[0].getsockname()[1]
+        dns_cache = DNSCache(ttl=60)
+        client = create_pooled_client(dns_cache=dns_cache)
+        origin = f"http://localhost:{port}/"
+        warmer = ConnectionWarmer(client, {origin: 3}, interval=60, dns_cache=dns_cache)
+        try:
+            assert await warmer.warm() == 3
+            assert len(accepted) == 3
+            assert "127.0.0.1" in dns_cache.lookup("localhost", port)
+            # Warm connections are reused rather than reopened.
+            assert (await client.get(origin)).status_code == 200
+            assert len(accepted) == 3
+        finally:
+            await client.aclose()
+            server.close()
+
+    asyncio.run(_run())
+
+
+def test_async_client_cancels_stream(tmp_path):
+    client = AsyncClawCodexClient(auth_file=tmp_path / "auth.json", pkce_file=tmp_path / "pkce.json", mock_mode=True)
+
+    async def _run():
+        await client.exchange_code("mock")
+        chunks = []
+        async for chunk in client.stream_chat_completions(
+            messages=[{"role": "user", "content": "Say hello " * 20}], completion_id="chatcmpl_lib"
+        ):
+            chunks.append(chunk)
+            if len(chunks) == 2:
+                assert await client.cancel("chatcmpl_lib") is True
+        assert await client.cancel("chatcmpl_lib") is False
+        return chunks
+
+    chunks = asyncio.run(_run())
+    assert chunks[-1]["choices"][0]["finish_reason"] == "cancelled"
+    assert len(chunks) == 3
+
+
+def test_cancelled_relay_releases_its_source():
+    from claw_codex.codex import _until_aborted
+
+    async def _source():
+        yield 1
+        await asyncio.sleep(60)
+        yield 2
+
+    async def _run():
+        source = _source()
+        relay = _until_aborted(source, asyncio.Event())
+
+        async def _consume():
+            async for _ in relay:
+                pass
+
+        task = asyncio.create_task(_consume())
+        await asyncio.sleep(0.05)
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+        # Would raise "asynchronous generator is already running" with the read still pending.
+        await source.aclose()
+
+    asyncio.run(_run())
+
+def test_server_client_over_unix_socket(tmp_path):
+    import os
+    import stat
+
+    import pytest
+    import uvicorn
+
+    from claw_codex import server_client
+    from claw_codex.app import create_app
+    from claw_codex.cli import _bind_unix_socket
+    from claw_codex.config import Settings
+
+    path = str(tmp_path / "claw.sock")
+    sock = _bind_unix_socket(path, 0o600)
+    assert stat.S_IMODE(os.stat(path).st_mode) == 0o600
+    app = create_app(Settings(mock_mode=True, auth_file=tmp_path / "auth.json", pkce_file=tmp_path / "pkce.json"))
+
+    async def _run():
+        server = uvicorn.Server(uvicorn.Config(app, log_level="warning"))
+        task = asyncio.create_task(server.serve(sockets=[sock]))
+        while not server.started:
+            await asyncio.sleep(0.01)
+        try:
+            with pytest.raises(SystemExit):
+                _bind_unix_socket(path, 0o600)
+            async with server_client(uds=path) as client:
+                assert (await client.post("/auth/codex/exchange", json={"code": "mock"})).status_code == 200
+                resp = await client.post(
+                    "/v1/chat/completions",
+                    json={"model": "claw/codex", "messages": [{"role": "user", "content": "over uds"}]},
+                )
+                assert resp.json()["choices"][0]["message"]["content"] == "Mock Codex response to: over uds"
+        finally:
+            server.should_exit = True
+            await task
+
+    asyncio.run(_run())
+
+
+def test_sigterm_drains_before_the_server_stops(tmp_path):
+    import signal
+    import time
+
+    import uvicorn
+
+    from claw_codex import server_client
+    from claw_codex.app import create_app
+    from claw_codex.cli import _bind_unix_socket
+    from claw_codex.config import Settings
+    from claw_codex.inflight import InFlight
+    from claw_codex.serving import DrainingServer
+
+    path = str(tmp_path / "claw.sock")
+    sock = _bind_unix_socket(path, 0o600)
+    app = create_app(Settings(mock_mode=True, auth_file=tmp_path / "auth.json", pkce_file=tmp_path / "pkce.json"))
+    entry = app.state.claw.inflight.register(InFlight("chatcmpl_slow"))
+
+    async def _run():
+        server = DrainingServer(uvicorn.Config(app, log_level="warning"), drain_timeout=0.5)
+        task = asyncio.create_task(server.serve(sockets=[sock]))
+        while not server.started:
+            await asyncio.sleep(0.01)
+        async with server_client(uds=path) as client:
+            assert (await client.post("/auth/codex/exchange", json={"code": "mock"})).status_code == 200
+            assert (await client.get("/readyz")).status_code == 200
+            started = time.monotonic()
+            signal.raise_signal(signal.SIGTERM)
+            # Still serving: load balancers see readiness fail and new work is refused.
+            readiness = await client.get("/readyz")
+            assert readiness.status_code == 503 and readiness.json()["draining"] is True
+            request = {"model": "claw/codex", "messages": [{"role": "user", "content": "late"}]}
+            assert (await client.post("/v1/chat/completions", json=request)).status_code == 503
+        await task
+        return time.monotonic() - started
+
+    reraised = []
+    previous = signal.signal(signal.SIGTERM, lambda sig, frame: reraised.append(sig))
+    try:
+        drained_after = asyncio.run(_run())
+    finally:
+        signal.signal(signal.SIGTERM, previous)
+    assert drained_after >= 0.5
+    assert entry.abort.is_set()
+    assert reraised == [signal.SIGTERM]
+
+
+def test_workers_serve_and_drain_on_sigterm(tmp_path):
+    import os
+    import signal
+    import subprocess
+    import sys
+    import time
+
+    import httpx
+
+    # Workers are spawned interpreters; this makes each one log at INFO to stderr.
+    (tmp_path / "sitecustomize.py").write_text("import logging\nlogging.basicConfig(level=logging.INFO)\n")
+    path = str(tmp_path / "claw.sock")
+    env = dict(
+        os.environ,
+        PYTHONPATH=os.pathsep.join([str(tmp_path), os.getcwd()]),
+        CLAW_CODEX_MOCK="1",
+        CLAW_CODEX_AUTH_DIR=str(tmp_path),
+        CLAW_CODEX_USAGE_DB="",
+    )
+    command = [sys.executable, "-m", "claw_codex", "serve", "--uds", path, "--workers", "2", "--drain-timeout", "5"]
+    proc = subprocess.Popen(command, env=env, stderr=subprocess.PIPE, text=True)
+    try:
+        with httpx.Client(transport=httpx.HTTPTransport(uds=path), base_url="http://claw") as client:
+            deadline = time.monotonic() + 30
+            while True:
+                assert proc.poll() is None and time.monotonic() < deadline
+                try:
+                    if client.get("/healthz").status_code == 200:
+                        break
+                except httpx.TransportError:
+                    pass
+                time.sleep(0.1)
+            assert client.post("/auth/codex/exchange", json={"code": "mock"}).status_code == 200
+            request = {"model": "claw/codex", "messages": [{"role": "user", "content": "Say hello"}]}
+            completion = client.post("/v1/chat/completions", json=request)
+            assert completion.status_code == 200
+            assert "Mock Codex response" in completion.json()["choices"][0]["message"]["content"]
+        proc.send_signal(signal.SIGTERM)
+        _, stderr = proc.communicate(timeout=30)
+    finally:
+        if proc.poll() is None:
+            proc.kill()
+            proc.communicate()
+    assert proc.returncode == 0
+    assert stderr.count("Draining 0 in-flight completions") == 2
+
+
+def test_context_policy_trims_history_to_budget():
+    from claw_codex.context import ContextPolicy, estimate_tokens, fit_messages
+
+    assert estimate_tokens("Hello, world!") == 4
+    assert estimate_tokens("") == 0
+
+    log = "\n".join(f"line {i}: request served in {i * 3} ms" for i in range(400))
+    messages = [{"role": "system", "content": "Be terse."}]
+    for turn in range(6):
+        messages += [
+            {"role": "user", "content": f"question {turn} " * 20},
+            {"role": "assistant", "content": None, "tool_calls": [{"id": f"c{turn}", "type": "function"}]},
+            {"role": "tool", "tool_call_id": f"c{turn}", "content": log},
+            {"role": "assistant", "content": f"answer {turn} " * 20},
+        ]
+
+    untouched, report = fit_messages(messages, ContextPolicy(max_input_tokens=10**6))
+    assert untouched is messages and report is None
+
+    trimmed, report = fit_messages(messages, ContextPolicy(max_input_tokens=1500, max_tool_output_tokens=100))
+    assert trimmed[0] == messages[0]
+    assert trimmed[-1] == messages[-1]
+    assert report["tool_outputs_truncated"] >= 1
+    assert "tokens truncated" in trimmed[-2]["content"]
+    assert report["input_tokens_after"] <= 1500 and not report["over_budget"]
+    assert report["tokens_saved"] == report["input_tokens_before"] - report["input_tokens_after"]
+
+    kept, report = fit_messages(messages, ContextPolicy(max_input_tokens=1, strategies=("keep_last_turns",), keep_turns=2))
+    assert [m["content"] for m in kept if m["role"] == "user"] == [messages[-8]["content"], messages[-4]["content"]]
+    assert report["messages_dropped"] == 16 and report["over_budget"]
+
+
+def test_client_hooks_trace_each_stage(tmp_path):
+    from claw_codex import ClientHooks
+
+    seen = []
+    traces = []
+
+    def record(stage):
+        return lambda trace, *args: seen.append((trace.completion_id, stage))
+
+    def broken(trace, event):
+        raise ValueError("hooks must not break calls")
+
+    hooks = ClientHooks(
+        on_request_built=record("request_built"),
+        on_credentials=record("credentials"),
+        on_connect=record("connect"),
+        on_first_event=record("first_event"),
+        on_event=broken,
+        on_complete=lambda trace: traces.append(trace),
+        on_error=lambda trace, exc: traces.append(trace),
+    )
+    client = AsyncClawCodexClient(
+        auth_file=tmp_path / "auth.json", pkce_file=tmp_path / "pkce.json", mock_mode=True, hooks=hooks
+    )
+    messages = [{"role": "user", "content": "trace me"}]
+
+    async def _run():
+        await client.exchange_code("mock")
+        await client.chat_completions(messages=messages, completion_id="c1")
+        chunks = client.stream_chat_completions(messages=messages, completion_id="c2", stop="Codex")
+        async for _ in chunks:
+            pass
+        partial = client.stream_chat_completions(messages=messages, completion_id="c3")
+        await partial.__anext__()
+        await partial.aclose()
+
+    asyncio.run(_run())
+    stages = ["request_built", "credentials", "connect", "first_event"]
+    assert seen == [(cid, stage) for cid in ("c1", "c2", "c3") for stage in stages]
+    complete, streamed, abandoned = traces
+    assert complete.usage["total_tokens"] > 0 and complete.finish_reason == "stop" and not complete.stream
+    assert list(complete.timings()) == stages + ["complete"]
+    assert complete.events >= 3 and complete.body["input"][0]["role"] == "user"
+    assert streamed.stream and streamed.finish_reason == "stop" and streamed.account_id == "mock-account"
+    assert isinstance(abandoned.error, GeneratorExit) and "error" in abandoned.timings()
+
+
+def test_async_client_stream_options(tmp_path):
+    async def _collect_chunks():
+        client = AsyncClawCodexClient(auth_file=tmp_path / "auth.json", pkce_file=tmp_path / "pkce.json", mock_mode=True)
+        await client.exchange_code("mock")
+        options = {"include_usage": True, "include_timing": True}
+        messages = [{"role": "user", "content": "Stream hello"}]
+        return [chunk async for chunk in client.stream_chat_completions(messages=messages, stream_options=options)]
+
+    *deltas, final = asyncio.run(_collect_chunks())
+    assert deltas[-1]["choices"][0]["finish_reason"] == "stop"
+    assert all(chunk["usage"] is None and "upstream_ms" in chunk["timing"] for chunk in deltas)
+    assert final["choices"] == [] and final["usage"]["total_tokens"] > 0
+    assert final["timing"]["ttft_ms"] is not None and final["timing"]["queue_ms"] == 0.0